@@ -7,6 +7,7 @@ import os
 # Database connection
 db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'health.db')
 conn = sqlite3.connect(db_path)
+conn.execute('PRAGMA foreign_keys = ON')
 cursor = conn.cursor()
 
 # Helper function to generate a random date within the last 6 months
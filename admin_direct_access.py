@@ -2,8 +2,20 @@ import sqlite3
 import os
 import sys
 import json
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response, make_response
 from werkzeug.security import generate_password_hash, check_password_hash
+from db_utils import blood_pressure_from_row
+from migrations import apply_migrations
+import sharding
+from compression import CompressionMiddleware
+import static_assets
+import search
+import counters
+import timeline
+import admin_listing
+import exporter
+import purge
+import etags
 
 # Create a minimal Flask app for direct admin access
 app = Flask(__name__, template_folder='templates', static_folder='static')
@@ -15,6 +27,12 @@ app.config['SESSION_COOKIE_SECURE'] = False
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 
+# gzip/brotli for HTML, JSON and static text (see compression.py)
+app.wsgi_app = CompressionMiddleware(app.wsgi_app)
+
+# Fingerprinted static URLs with long-lived caching (see static_assets.py)
+static_assets.init_app(app)
+
 # Helper function to process JSON fields in database rows
 def process_json_fields(items, field_mappings):
     """
@@ -41,11 +59,58 @@ def get_db_connection():
         db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'health.db')
         conn = sqlite3.connect(db_path)
         conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA foreign_keys = ON')
         return conn
     except Exception as e:
         print(f"Database connection error: {str(e)}")
         return None
 
+# Connection for one user's data: their shard when sharding is enabled
+def get_user_data_connection(user_id):
+    if sharding.sharding_enabled():
+        try:
+            return sharding.connect_for_user(user_id)
+        except Exception as e:
+            print(f"Shard connection error: {str(e)}")
+            return None
+    return get_db_connection()
+
+# Run a cross-user query ordered by `order_column` DESC on the central database,
+# or on every shard in parallel with the ordered results merged
+def query_all_users(cursor, sql, order_column, limit=None, params=()):
+    if sharding.sharding_enabled():
+        return sharding.fan_out_query(sql, params, sort_key=lambda row: row[order_column] or '',
+                                      reverse=True, limit=limit)
+    cursor.execute(sql, params)
+    return [dict(row) for row in cursor.fetchall()]
+
+# Read a trigger-maintained row count; None when the counter does not exist yet
+def get_counter(cursor, name):
+    try:
+        cursor.execute("SELECT value FROM stats_counters WHERE name = ?", (name,))
+    except sqlite3.OperationalError:
+        return None
+    row = cursor.fetchone()
+    return row['value'] if row else None
+
+# WHERE clause for the admin user search. Substrings of 3+ characters use the
+# users_search trigram index; shorter input can only be a prefix, which the
+# NOCASE indexes on username and email (migration 16) answer as range scans,
+# case-insensitive like the trigram and LIKE matches.
+def user_search_filter(cursor, search_query):
+    if not search_query:
+        return "1", []
+    if len(search_query) >= 3:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'users_search'")
+        if cursor.fetchone():
+            phrase = '"' + search_query.replace('"', '""') + '"'
+            return "id IN (SELECT rowid FROM users_search WHERE users_search MATCH ?)", [phrase]
+        return "(username LIKE ? OR email LIKE ?)", [f'%{search_query}%', f'%{search_query}%']
+    upper = search_query + '\uffff'
+    return ("(username COLLATE NOCASE >= ? AND username COLLATE NOCASE < ?"
+            " OR email COLLATE NOCASE >= ? AND email COLLATE NOCASE < ?)",
+            [search_query, upper, search_query, upper])
+
 # Fix admin account
 def ensure_admin_exists():
     conn = get_db_connection()
@@ -107,7 +172,7 @@ def login():
             error = "Database connection error"
         else:
             cursor = conn.cursor()
-            cursor.execute("SELECT id, username, password_hash, is_admin FROM users WHERE username = ?", (username,))
+            cursor.execute("SELECT id, username, password_hash, is_admin FROM users WHERE username = ? AND deleted_at_ms IS NULL", (username,))
             user = cursor.fetchone()
             conn.close()
             
@@ -137,20 +202,40 @@ def dashboard():
         
     cursor = conn.cursor()
     
-    # Get system stats
-    stats = {}
-    
-    # Total users
-    cursor.execute("SELECT COUNT(*) as count FROM users")
-    stats['total_users'] = cursor.fetchone()['count']
+    # Get system stats from the trigger-maintained counters (O(1) rows)
+    totals, recent = counters.dashboard_stats(days=7)
+    stats = {
+        'total_users': totals.get('active_users', 0),
+        'health_records': totals.get('health_records', 0),
+        'disease_predictions': totals.get('disease_predictions', 0),
+        'prescriptions': totals.get('prescriptions', 0),
+        'medical_records': totals.get('medical_records', 0),
+        'active_medications': totals.get('active_medications', 0),
+    }
     
     # Recent users
-    cursor.execute("SELECT id, username, email, created_at FROM users ORDER BY created_at DESC LIMIT 5")
+    cursor.execute("SELECT id, username, email, is_admin, created_at FROM users WHERE deleted_at_ms IS NULL ORDER BY id DESC LIMIT 5")
     recent_users = [dict(row) for row in cursor.fetchall()]
     
+    # Latest health readings, read newest-first from the created_at_ms index
+    recent_health_records = query_all_users(cursor, """
+        SELECT hm.id, hm.user_id, u.username, hm.heart_rate, hm.blood_pressure,
+               hm.bp_systolic, hm.bp_diastolic, hm.oxygen_level, hm.created_at, hm.created_at_ms
+        FROM health_monitoring hm
+        JOIN users u ON hm.user_id = u.id
+        ORDER BY hm.created_at_ms DESC
+        LIMIT 5
+    """, 'created_at_ms', limit=5)
+    for record in recent_health_records:
+        blood_pressure_from_row(record)
+        bp = record['blood_pressure']
+        if isinstance(bp, dict):
+            record['blood_pressure'] = f"{bp.get('systolic')}/{bp.get('diastolic')}"
+    
     conn.close()
     
-    return render_template('direct_admin_dashboard.html', stats=stats, recent_users=recent_users)
+    return render_template('direct_admin_dashboard.html', stats=stats, recent=recent,
+                           recent_users=recent_users, recent_health_records=recent_health_records)
 
 @app.route('/users', methods=['GET', 'POST'])
 def users():
@@ -195,38 +280,56 @@ def users():
         
         return redirect(url_for('users'))
     
-    # Get query parameters for GET request
-    page = request.args.get('page', 1, type=int)
-    search_query = request.args.get('search', '')
+    # Get query parameters for GET request. Pages are keyset-paginated on id
+    # (newest first): `after` is the last id of the previous page, `before`
+    # the first id of the next one, so every page costs the same to build.
+    page = max(request.args.get('page', 1, type=int), 1)
+    after_id = request.args.get('after', type=int)
+    before_id = request.args.get('before', type=int)
+    search_query = request.args.get('search', '').strip()
     per_page = 10  # Number of users per page
     
     cursor = conn.cursor()
     
-    # If search query is provided, filter users
-    if search_query:
-        cursor.execute("""
-            SELECT id, username, email, is_admin, created_at 
-            FROM users 
-            WHERE username LIKE ? OR email LIKE ?
-            ORDER BY created_at DESC
-        """, (f'%{search_query}%', f'%{search_query}%'))
+    filter_sql, params = user_search_filter(cursor, search_query)
+    # Deleted accounts disappear at once, while their purge is still running
+    filter_sql = f"deleted_at_ms IS NULL AND ({filter_sql})"
+    if before_id is not None:
+        filter_sql += " AND id > ?"
+        params.append(before_id)
+        order = "ASC"
     else:
-        cursor.execute("""
-            SELECT id, username, email, is_admin, created_at 
-            FROM users 
-            ORDER BY created_at DESC
-        """)
-    
-    all_users = [dict(row) for row in cursor.fetchall()]
-    
-    # Get total number of pages
-    total_users = len(all_users)
-    total_pages = (total_users + per_page - 1) // per_page  # Ceiling division
-    
-    # Calculate pagination
-    start_idx = (page - 1) * per_page
-    end_idx = start_idx + per_page
-    users = all_users[start_idx:end_idx] if start_idx < total_users else []
+        if after_id is not None:
+            filter_sql += " AND id < ?"
+            params.append(after_id)
+        order = "DESC"
+    
+    cursor.execute(f"""
+        SELECT id, username, email, is_admin, created_at, last_login
+        FROM users
+        WHERE {filter_sql}
+        ORDER BY id {order}
+        LIMIT ?
+    """, params + [per_page + 1])
+    users = [dict(row) for row in cursor.fetchall()]
+    
+    # The extra row only tells us whether there is another page in this direction
+    has_more = len(users) > per_page
+    users = users[:per_page]
+    if before_id is not None:
+        users.reverse()
+    
+    has_next = has_more if before_id is None else True
+    has_prev = has_more if before_id is not None else after_id is not None
+    
+    # Totals come from the trigger-maintained counter; a search only knows
+    # whether more matches follow
+    total_users = None
+    total_pages = None
+    if not search_query:
+        total_users = get_counter(cursor, 'active_users')
+        if total_users is not None:
+            total_pages = max((total_users + per_page - 1) // per_page, 1)
     
     conn.close()
     
@@ -234,6 +337,9 @@ def users():
                           users=users, 
                           page=page, 
                           total_pages=total_pages, 
+                          total_users=total_users,
+                          next_after=users[-1]['id'] if users and has_next else None,
+                          prev_before=users[0]['id'] if users and has_prev and page > 1 else None,
                           search_query=search_query)
 
 @app.route('/logout')
@@ -259,16 +365,16 @@ def delete_user(user_id):
     
     try:
         # Check if user exists and is not the main admin
-        cursor.execute("SELECT username FROM users WHERE id = ?", (user_id,))
+        cursor.execute("SELECT username FROM users WHERE id = ? AND deleted_at_ms IS NULL", (user_id,))
         user = cursor.fetchone()
         
         if not user:
             flash("User not found.", "error")
         else:
-            # Delete user
-            cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-            conn.commit()
-            flash(f"User '{user['username']}' has been deleted successfully.", "success")
+            # Mark the account deleted now; its rows are purged in the background
+            purge.schedule_purge(conn, user_id)
+            purge.start_background_purger()
+            flash(f"User '{user['username']}' has been deleted. Their data is being purged in the background.", "success")
     except Exception as e:
         flash(f"Error deleting user: {str(e)}", "error")
     finally:
@@ -276,6 +382,20 @@ def delete_user(user_id):
     
     return redirect(url_for('users'))
 
+@app.route('/users/purges')
+def purge_status():
+    """Progress of background user purges as JSON (?user_id= for one user)"""
+    if 'admin_authenticated' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'}), 401
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'success': False, 'error': 'Database connection error'}), 500
+    try:
+        return jsonify({'success': True, 'jobs': purge.job_status(conn, request.args.get('user_id', type=int))})
+    finally:
+        conn.close()
+
 @app.route('/home')
 def main_site():
     # Redirect to the main site - adjust the URL as needed
@@ -287,7 +407,7 @@ def user_history(user_id):
     if 'admin_authenticated' not in session:
         return redirect(url_for('login'))
         
-    conn = get_db_connection()
+    conn = get_user_data_connection(user_id)
     if not conn:
         return "Database connection error", 500
         
@@ -303,294 +423,174 @@ def user_history(user_id):
     
     user = dict(user)
     
-    # Get user health monitoring data
-    cursor.execute("""
-        SELECT id, heart_rate, blood_pressure, oxygen_level, body_temperature, glucose_level,
-               created_at
-        FROM health_monitoring
-        WHERE user_id = ?
-        ORDER BY created_at DESC
-        LIMIT 10
-    """, (user_id,))
-    health_data = [dict(row) for row in cursor.fetchall()]
-    
-    # Process JSON fields in health data
-    health_data = process_json_fields(health_data, {
-        'blood_pressure': {'systolic': None, 'diastolic': None}
-    })
-    
-    # Get user's disease predictions
-    cursor.execute("""
-        SELECT id, symptoms, predicted_disease, confidence_score, predicted_at
-        FROM disease_predictions
-        WHERE user_id = ?
-        ORDER BY predicted_at DESC
-        LIMIT 10
-    """, (user_id,))
-    predictions = [dict(row) for row in cursor.fetchall()]
-    
-    # Process JSON fields in predictions
-    predictions = process_json_fields(predictions, {
-        'symptoms': []
-    })
-    
-    # Get user's BMI history
-    cursor.execute("""
-        SELECT id, height, weight, bmi, bmi_category, recorded_at, notes
-        FROM bmi_history
-        WHERE user_id = ?
-        ORDER BY recorded_at DESC
-        LIMIT 10
-    """, (user_id,))
-    bmi_history = [dict(row) for row in cursor.fetchall()]
-    
-    # Get user's activity tracking data
-    cursor.execute("""
-        SELECT id, activity_type, duration, steps, calories_burned, 
-               activity_date, notes, created_at
-        FROM activity_tracking
-        WHERE user_id = ?
-        ORDER BY created_at DESC
-        LIMIT 10
-    """, (user_id,))
-    activity_data = [dict(row) for row in cursor.fetchall()]
-    
-    # Get user's medical records
-    cursor.execute("""
-        SELECT id, record_name, record_type, file_path, record_date, notes, uploaded_at
-        FROM medical_records
-        WHERE user_id = ?
-        ORDER BY uploaded_at DESC
-        LIMIT 10
-    """, (user_id,))
-    medical_records = [dict(row) for row in cursor.fetchall()]
-    
-    # Get user's prescriptions
-    prescriptions = []
-    try:
-        # Check if table exists before querying
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='medical_prescriptions'")
-        if cursor.fetchone():
-            cursor.execute("""
-                SELECT id, doctor_name, specialization, patient_name, patient_age, 
-                       patient_gender, allergies, diagnosis, medications, 
-                       instructions, follow_up, created_at
-                FROM medical_prescriptions
-                WHERE user_id = ?
-                ORDER BY created_at DESC
-                LIMIT 10
-            """, (user_id,))
-            prescriptions = [dict(row) for row in cursor.fetchall()]
-    except Exception as e:
-        print(f"Error fetching prescriptions: {e}")
+    # Latest rows of every source (index range scans), cached until one of the
+    # user's tables is written to
+    sections = timeline.get_sections(conn, user_id, per_source=10)
+    summary = timeline.get_summary(conn, user_id)
     
     conn.close()
     
     return render_template('user_history.html',
                            user=user,
-                           health_data=health_data,
-                           predictions=predictions,
-                           bmi_history=bmi_history,
-                           activity_data=activity_data,
-                           medical_records=medical_records,
-                           prescriptions=prescriptions)
+                           summary=summary,
+                           health_data=sections['health'],
+                           predictions=sections['prediction'],
+                           bmi_history=sections['bmi'],
+                           activity_data=sections['activity'],
+                           medical_records=sections['record'],
+                           prescriptions=sections['prescription'])
 
-# Add new routes for specific data sections
-@app.route('/medical-records')
-def medical_records():
+@app.route('/user/<int:user_id>/timeline')
+def user_timeline(user_id):
+    """
+    One page of a user's merged timeline as JSON, newest first
+
+    Query args:
+        cursor: next_cursor from the previous page
+        limit: items per page (default 50, at most 200)
+        types: comma-separated subset of health,prediction,bmi,activity,record,prescription
+    """
     if 'admin_authenticated' not in session:
-        return redirect(url_for('login'))
-        
-    conn = get_db_connection()
-    if not conn:
-        return "Database connection error", 500
-        
-    cursor = conn.cursor()
+        return jsonify({'success': False, 'error': 'Not authenticated'}), 401
     
-    # Get all medical records with user data
-    cursor.execute("""
-        SELECT mr.id, mr.user_id, u.username, mr.record_name, mr.record_type, 
-               mr.file_path, mr.record_date, mr.notes, mr.uploaded_at
-        FROM medical_records mr
-        JOIN users u ON mr.user_id = u.id
-        ORDER BY mr.uploaded_at DESC
-        LIMIT 100
-    """)
-    records = [dict(row) for row in cursor.fetchall()]
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    sources = [name for name in request.args.get('types', '').split(',') if name in timeline.TIMELINE_SOURCES]
     
-    conn.close()
+    conn = get_user_data_connection(user_id)
+    if not conn:
+        return jsonify({'success': False, 'error': 'Database connection error'}), 500
     
-    return render_template('admin_medical_records.html', records=records)
+    try:
+        page = timeline.get_timeline(conn, user_id, limit=limit,
+                                     cursor=request.args.get('cursor'), sources=sources or None)
+        return jsonify({'success': True, **page})
+    except sqlite3.Error as e:
+        return jsonify({'success': False, 'error': f'Database error: {str(e)}'}), 500
+    finally:
+        conn.close()
 
-@app.route('/activity-tracking')
-def activity_tracking():
+# Render one of the filtered, keyset-paginated data listings (see admin_listing.py)
+def render_listing(listing, template, rows_name):
     if 'admin_authenticated' not in session:
         return redirect(url_for('login'))
-        
-    conn = get_db_connection()
-    if not conn:
-        return "Database connection error", 500
-        
-    cursor = conn.cursor()
-    
-    # Get all activity tracking data with user data
-    cursor.execute("""
-        SELECT at.id, at.user_id, u.username, at.activity_type, at.duration, 
-               at.steps, at.calories_burned, at.activity_date, at.created_at
-        FROM activity_tracking at
-        JOIN users u ON at.user_id = u.id
-        ORDER BY at.created_at DESC
-        LIMIT 100
-    """)
-    activities = [dict(row) for row in cursor.fetchall()]
     
-    conn.close()
+    # Pages showing flashed messages are never reused
+    etag = None
+    if not session.get('_flashes'):
+        try:
+            etag = admin_listing.page_etag(listing, request.args, session.get('admin_id'))
+        except sqlite3.Error as e:
+            print(f"Could not read the change token for {listing}: {str(e)}")
+    cached = etags.not_modified(etag)
+    if cached:
+        return cached
+    
+    page = admin_listing.empty_page()
+    try:
+        page = admin_listing.fetch_page(listing, request.args)
+    except sqlite3.Error as e:
+        flash(f"Error querying {listing.replace('_', ' ')}: {str(e)}", "error")
+        etag = None
     
-    return render_template('admin_activity_tracking.html', activities=activities)
+    return etags.with_etag(make_response(render_template(template, listing=page, **{rows_name: page['rows']})), etag)
+
+# Add new routes for specific data sections
+@app.route('/medical-records')
+def medical_records():
+    return render_listing('medical_records', 'admin_medical_records.html', 'records')
+
+@app.route('/activity-tracking')
+def activity_tracking():
+    return render_listing('activity_tracking', 'admin_activity_tracking.html', 'activities')
 
 @app.route('/bmi-history')
 def bmi_history():
-    if 'admin_authenticated' not in session:
-        return redirect(url_for('login'))
-        
-    conn = get_db_connection()
-    if not conn:
-        return "Database connection error", 500
-        
-    cursor = conn.cursor()
-    
-    # Get all BMI history data with user data
-    cursor.execute("""
-        SELECT bh.id, bh.user_id, u.username, bh.height, bh.weight, 
-               bh.bmi, bh.bmi_category, bh.recorded_at
-        FROM bmi_history bh
-        JOIN users u ON bh.user_id = u.id
-        ORDER BY bh.recorded_at DESC
-        LIMIT 100
-    """)
-    bmi_entries = [dict(row) for row in cursor.fetchall()]
-    
-    conn.close()
-    
-    return render_template('admin_bmi_history.html', bmi_entries=bmi_entries)
+    return render_listing('bmi_history', 'admin_bmi_history.html', 'bmi_entries')
 
 @app.route('/health-monitoring')
 def health_monitoring():
+    return render_listing('health_monitoring', 'admin_health_monitoring.html', 'health_entries')
+
+@app.route('/medical-prescriptions')
+def medical_prescriptions():
+    return render_listing('medical_prescriptions', 'admin_medical_prescriptions.html', 'prescriptions')
+
+@app.route('/export')
+def export_tables():
     if 'admin_authenticated' not in session:
-        return redirect(url_for('login'))
-    
-    health_entries = []
+        return jsonify({'success': False, 'error': 'Not authenticated'}), 401
+    return jsonify({'success': True, 'tables': exporter.EXPORT_TABLES, 'formats': list(exporter.EXPORT_FORMATS)})
+
+@app.route('/export/<table>')
+def export_table(table):
+    """
+    Stream a table as CSV or Parquet
+
+    Query args:
+        format: csv (default) or parquet
+        with_users: 1 to add username and email from users
+        user: only this user's rows (id or username)
+        from, to: inclusive YYYY-MM-DD bounds on the table's timestamp
+    """
+    if 'admin_authenticated' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'}), 401
     
-    try:
+    fmt = request.args.get('format', 'csv')
+    user_id = None
+    if request.args.get('user'):
         conn = get_db_connection()
         if not conn:
-            flash("Database connection error", "error")
-            return render_template('admin_health_monitoring.html', health_entries=health_entries)
-        
-        cursor = conn.cursor()
-        
-        # Check if health_monitoring table exists
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='health_monitoring'")
-        table_exists = cursor.fetchone() is not None
-        
-        if table_exists:
-            try:
-                # Get all health monitoring data with user data
-                cursor.execute("""
-                    SELECT hm.id, hm.user_id, u.username, hm.heart_rate, hm.blood_pressure,
-                           hm.oxygen_level, hm.body_temperature, hm.glucose_level, hm.created_at
-                    FROM health_monitoring hm
-                    JOIN users u ON hm.user_id = u.id
-                    ORDER BY hm.created_at DESC
-                    LIMIT 100
-                """)
-                
-                health_entries = [dict(row) for row in cursor.fetchall()]
-                
-                # Process blood pressure JSON using the helper function
-                health_entries = process_json_fields(health_entries, {
-                    'blood_pressure': {'systolic': None, 'diastolic': None}
-                })
-                
-            except Exception as e:
-                flash(f"Error querying health data: {str(e)}", "error")
-        else:
-            # Create sample data for demonstration if table doesn't exist
-            flash("Health monitoring table doesn't exist. Showing sample data for demonstration.", "warning")
-            health_entries = [
-                {
-                    'id': 1, 
-                    'user_id': 1, 
-                    'username': 'demo_user', 
-                    'heart_rate': 75, 
-                    'blood_pressure': {'systolic': 120, 'diastolic': 80},
-                    'oxygen_level': 98, 
-                    'body_temperature': 36.8, 
-                    'glucose_level': 100, 
-                    'created_at': '2023-05-01'
-                },
-                {
-                    'id': 2, 
-                    'user_id': 1, 
-                    'username': 'demo_user', 
-                    'heart_rate': 82, 
-                    'blood_pressure': {'systolic': 125, 'diastolic': 85},
-                    'oxygen_level': 97, 
-                    'body_temperature': 37.1, 
-                    'glucose_level': 110, 
-                    'created_at': '2023-05-02'
-                }
-            ]
-    except Exception as e:
-        flash(f"Error accessing database: {str(e)}", "error")
-    finally:
-        if 'conn' in locals() and conn:
+            return jsonify({'success': False, 'error': 'Database connection error'}), 500
+        try:
+            user_id = admin_listing.resolve_user(conn, request.args['user'])
+        finally:
             conn.close()
+        if user_id is None:
+            return jsonify({'success': False, 'error': 'User not found'}), 404
     
-    return render_template('admin_health_monitoring.html', health_entries=health_entries)
+    try:
+        pieces = exporter.export(table, fmt,
+                                 with_users=request.args.get('with_users') == '1',
+                                 user_id=user_id,
+                                 date_from=request.args.get('from') or None,
+                                 date_to=request.args.get('to') or None)
+    except exporter.ExportError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    filename = exporter.export_filename(table, fmt)
+    return Response(pieces, mimetype=exporter.EXPORT_FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
 
-@app.route('/medical-prescriptions')
-def medical_prescriptions():
+@app.route('/search')
+def search_all():
     if 'admin_authenticated' not in session:
         return redirect(url_for('login'))
-        
-    conn = get_db_connection()
-    if not conn:
-        return "Database connection error", 500
-    
-    prescriptions = []
-    try:
-        cursor = conn.cursor()
-        
-        # Check if medical_prescriptions table exists
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='medical_prescriptions'")
-        table_exists = cursor.fetchone() is not None
-        
-        if table_exists:
-            try:
-                # Get all prescriptions with user data
-                cursor.execute("""
-                    SELECT mp.id, mp.user_id, u.username, mp.doctor_name, mp.specialization,
-                           mp.patient_name, mp.patient_age, mp.patient_gender, mp.allergies,
-                           mp.diagnosis, mp.medications, mp.instructions, mp.follow_up,
-                           mp.created_at
-                    FROM medical_prescriptions mp
-                    JOIN users u ON mp.user_id = u.id
-                    ORDER BY mp.created_at DESC
-                    LIMIT 100
-                """)
-                
-                prescriptions = [dict(row) for row in cursor.fetchall()]
-            except Exception as e:
-                flash(f"Error querying prescriptions data: {str(e)}", "error")
-        else:
-            flash("Medical prescriptions table does not exist in the database", "warning")
-    except Exception as e:
-        flash(f"Database error: {str(e)}", "error")
-    finally:
-        conn.close()
-    
-    return render_template('admin_medical_prescriptions.html', prescriptions=prescriptions)
+
+    query = request.args.get('q', '').strip()
+    source = request.args.get('type', 'all')
+    if source != 'all' and source not in search.SEARCH_SOURCES:
+        source = 'all'
+
+    results = []
+    match = search.build_match_query(query)
+    if match:
+        conn = get_db_connection()
+        if not conn:
+            return "Database connection error", 500
+        try:
+            cursor = conn.cursor()
+            for name in (search.SEARCH_SOURCES if source == 'all' else [source]):
+                rows = query_all_users(cursor, search.search_sql(name), 'score', limit=50,
+                                       params=(search.source_match(name, match), 50))
+                results.extend(search.pick_snippet(row, name) for row in rows)
+            results.sort(key=lambda item: item['score'], reverse=True)
+            results = results[:50]
+        except Exception as e:
+            flash(f"Search error: {str(e)}", "error")
+        finally:
+            conn.close()
+
+    return render_template('admin_search.html', results=results, query=query, source=source)
 
 # Create basic templates if they don't exist
 def create_templates():
@@ -950,19 +950,19 @@ def create_templates():
 </body>
 </html>"""
 
-    # Write templates to files
-    with open(os.path.join(templates_dir, 'direct_admin_login.html'), 'w', encoding='utf-8') as f:
-        f.write(login_template)
-    
-    with open(os.path.join(templates_dir, 'direct_admin_dashboard.html'), 'w', encoding='utf-8') as f:
-        f.write(dashboard_template)
-        
-    with open(os.path.join(templates_dir, 'direct_admin_users.html'), 'w', encoding='utf-8') as f:
-        f.write(users_template)
-        
-    # Add the new template
-    with open(os.path.join(templates_dir, 'user_history.html'), 'w', encoding='utf-8') as f:
-        f.write(user_history_template)
+    # Write templates to files, keeping any that already exist (the versions
+    # checked into templates/ are newer than these fallbacks)
+    templates = {
+        'direct_admin_login.html': login_template,
+        'direct_admin_dashboard.html': dashboard_template,
+        'direct_admin_users.html': users_template,
+        'user_history.html': user_history_template,
+    }
+    for name, content in templates.items():
+        path = os.path.join(templates_dir, name)
+        if not os.path.exists(path):
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(content)
 
 if __name__ == "__main__":
     # Create templates if they don't exist yet
@@ -970,6 +970,20 @@ if __name__ == "__main__":
     
     print("Direct admin access enabled. Default credentials: admin / admin123")
     
+    # Bring the database up to the current schema
+    conn = get_db_connection()
+    if conn:
+        try:
+            apply_migrations(conn)
+        finally:
+            conn.close()
+    
+    # Verify the dashboard counters against real row counts once a day
+    counters.start_background_reconciler()
+    
+    # Finish (or resume) purges of deleted users
+    purge.start_background_purger()
+    
     # Ensure admin account exists
     if ensure_admin_exists():
         print("Admin account verified or created.")
@@ -0,0 +1,291 @@
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import sharding
+import etags
+from db_utils import blood_pressure_from_row, datetime_to_ms
+from migrations import ADMIN_LISTING_INDEXES, ROW_COUNTERS
+
+# Shared engine for the admin data listings (medical records, activity, BMI,
+# health monitoring and prescriptions)
+#
+# Rows are filtered by user, type and date range and paged newest first on
+# (<ts>_ms, user_id, id) with an opaque "<ts>:<user_id>:<id>" cursor, so every
+# page is an index range scan whatever its depth (migration 11). user_id is
+# part of the key because row ids are only unique per shard. Usernames are
+# looked up for the page's rows only instead of joining users on every row.
+#
+# Totals come from the trigger-maintained counters when unfiltered and from a
+# COUNT capped at COUNT_CAP otherwise, so the count never costs more than a
+# bounded index scan.
+#
+# Pages carry an ETag built from the listed table's and users' change tokens
+# (migration 14), so an unchanged page is answered 304 without running any of
+# the queries above.
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+COUNT_CAP = 1000
+
+# Health status of a reading, matching the thresholds in admin_health_monitoring.html.
+# COALESCE turns "unknown" (a NULL column) into "not triggered".
+_HEALTH_ALERT = '''COALESCE(heart_rate > 120 OR heart_rate < 50 OR bp_systolic > 160 OR bp_diastolic > 100
+    OR oxygen_level < 90 OR body_temperature > 38 OR glucose_level > 200, 0)'''
+_HEALTH_WARNING = '''COALESCE(heart_rate > 100 OR heart_rate < 60 OR bp_systolic > 140 OR bp_diastolic > 90
+    OR oxygen_level < 95 OR body_temperature > 37.5 OR glucose_level > 140, 0)'''
+HEALTH_STATUS_FILTERS = {
+    'alert': _HEALTH_ALERT,
+    'warning': f"{_HEALTH_WARNING} AND NOT {_HEALTH_ALERT}",
+    'normal': f"NOT {_HEALTH_WARNING}",
+}
+
+# listing -> columns the page renders (nothing else is read)
+LISTING_COLUMNS = {
+    'medical_records': 'id, user_id, record_name, record_type, record_date, uploaded_at',
+    'activity_tracking': 'id, user_id, activity_type, duration, steps, calories_burned, activity_date, created_at',
+    'bmi_history': 'id, user_id, height, weight, bmi, bmi_category, recorded_at',
+    'health_monitoring': '''id, user_id, heart_rate, blood_pressure, bp_systolic, bp_diastolic, oxygen_level,
+                            body_temperature, glucose_level, created_at''',
+    'medical_prescriptions': '''id, user_id, doctor_name, specialization, patient_name, diagnosis,
+                                medications, instructions, follow_up, created_at''',
+}
+
+# Trigger-maintained counter for each listed table, where one exists
+_TABLE_COUNTERS = {table: name for name, (table, condition) in ROW_COUNTERS.items() if condition is None}
+
+
+def parse_cursor(cursor):
+    """Decode "<ts>:<user_id>:<id>"; None for a missing or malformed cursor"""
+    try:
+        ts, user_id, row_id = (int(part) for part in cursor.split(':'))
+        return ts, user_id, row_id
+    except (AttributeError, ValueError):
+        return None
+
+
+def make_cursor(row):
+    return f"{row['ts_ms']}:{row['user_id']}:{row['id']}"
+
+
+def _day_start_ms(value, days=0):
+    try:
+        day = datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return None
+    return datetime_to_ms(day + timedelta(days=days))
+
+
+def resolve_user(conn, value):
+    """A user filter is a numeric id or an exact username; None when it matches nobody"""
+    value = (value or '').strip()
+    if value.isdigit():
+        return int(value)
+    row = conn.execute("SELECT id FROM users WHERE username = ?", (value,)).fetchone()
+    return row[0] if row else None
+
+
+# Helper function to turn the listing filters into a WHERE clause
+def build_filters(listing, user_id=None, type_value=None, date_from=None, date_to=None):
+    """
+    WHERE clause and parameters for one listing
+
+    Args:
+        user_id: only this user's rows
+        type_value: value of the listing's type column, or a health status
+                    for health_monitoring
+        date_from, date_to: inclusive YYYY-MM-DD bounds (UTC days)
+    """
+    ts_column, type_column = ADMIN_LISTING_INDEXES[listing]
+    clauses, params = [f"{ts_column} IS NOT NULL"], []
+
+    if user_id is not None:
+        clauses.append("user_id = ?")
+        params.append(user_id)
+    if type_value:
+        if listing == 'health_monitoring':
+            if type_value in HEALTH_STATUS_FILTERS:
+                clauses.append(HEALTH_STATUS_FILTERS[type_value])
+        elif type_column:
+            clauses.append(f"{type_column} = ?")
+            params.append(type_value)
+
+    start_ms = _day_start_ms(date_from)
+    if start_ms is not None:
+        clauses.append(f"{ts_column} >= ?")
+        params.append(start_ms)
+    end_ms = _day_start_ms(date_to, days=1)
+    if end_ms is not None:
+        clauses.append(f"{ts_column} < ?")
+        params.append(end_ms)
+
+    return ' AND '.join(clauses), params
+
+
+def page_sql(listing, where, forward=True):
+    """
+    Page query for one listing. Params: where params, then (ts, ts, user_id, id)
+    of the cursor when the caller appends a cursor bound, then the limit.
+
+    The bare `ts <= ?` term gives SQLite the range start on the index; the row
+    value comparison only breaks ties at that timestamp.
+    """
+    ts_column, _ = ADMIN_LISTING_INDEXES[listing]
+    op, order = ('<', 'DESC') if forward else ('>', 'ASC')
+    return f'''
+        SELECT {LISTING_COLUMNS[listing]}, {ts_column} AS ts_ms
+        FROM {listing}
+        WHERE {where} {{cursor}}
+        ORDER BY {ts_column} {order}, user_id {order}, id {order}
+        LIMIT ?
+    ''', f"AND {ts_column} {op}= ? AND ({ts_column}, user_id, id) {op} (?, ?, ?)"
+
+
+def _sort_key(row):
+    return (row['ts_ms'], row['user_id'], row['id'])
+
+
+def _connect_central():
+    conn = sqlite3.connect(sharding.central_db_path)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA busy_timeout = 5000')
+    return conn
+
+
+def _run(sql, params, user_id=None, sort_key=None, reverse=False, limit=None):
+    """Run a listing query wherever the rows live: central, one user's shard or every shard"""
+    if sharding.sharding_enabled() and user_id is None:
+        return sharding.fan_out_query(sql, params, sort_key=sort_key, reverse=reverse, limit=limit)
+    conn = sharding.connect_for_user(user_id) if sharding.sharding_enabled() else _connect_central()
+    try:
+        return [dict(row) for row in conn.execute(sql, params).fetchall()]
+    finally:
+        conn.close()
+
+
+def estimate_total(listing, where, params, user_id=None, filtered=True):
+    """
+    (total, exact) for a listing. Unfiltered listings read the row counter;
+    otherwise rows are counted up to COUNT_CAP per database and (COUNT_CAP,
+    False) means "at least that many".
+    """
+    counter = _TABLE_COUNTERS.get(listing)
+    if not filtered and counter:
+        rows = _run("SELECT value FROM stats_counters WHERE name = ?", [counter])
+        if rows:
+            return sum(row['value'] for row in rows), True
+
+    rows = _run(f'''
+        SELECT COUNT(*) AS n FROM (SELECT 1 FROM {listing} WHERE {where} LIMIT {COUNT_CAP + 1})
+    ''', params, user_id=user_id)
+    total = sum(row['n'] for row in rows)
+    if total > COUNT_CAP:
+        return COUNT_CAP, False
+    return total, True
+
+
+# Helper function to read one page of an admin listing
+def fetch_page(listing, args, per_page=DEFAULT_PAGE_SIZE, with_total=True):
+    """
+    One page of `listing` for the request args
+
+    Args (from the query string):
+        user: user id or username; type: type or status value;
+        from, to: YYYY-MM-DD; after / before: cursor of the adjacent page;
+        per_page: page size (at most MAX_PAGE_SIZE)
+
+    Returns a dict with rows, filters (as given), query (the non-empty
+    filters), next_after, prev_before, total and total_exact (None when
+    with_total is False).
+    """
+    per_page = min(max(args.get('per_page', per_page, type=int) or per_page, 1), MAX_PAGE_SIZE)
+    filters = {name: (args.get(name) or '').strip() for name in ('user', 'type', 'from', 'to')}
+    # Non-empty filters, carried over into the pagination links
+    query = {name: value for name, value in filters.items() if value}
+
+    user_id = None
+    if filters['user']:
+        conn = _connect_central()
+        try:
+            user_id = resolve_user(conn, filters['user'])
+        finally:
+            conn.close()
+        if user_id is None:
+            return empty_page(filters, query)
+
+    where, params = build_filters(listing, user_id, filters['type'], filters['from'], filters['to'])
+
+    after = parse_cursor(args.get('after'))
+    before = parse_cursor(args.get('before')) if after is None else None
+    bound = before or after
+    sql, cursor_clause = page_sql(listing, where, forward=before is None)
+    page_params = list(params)
+    if bound:
+        page_params += [bound[0], *bound]
+    page_params.append(per_page + 1)
+
+    rows = _run(sql.format(cursor=cursor_clause if bound else ''), page_params, user_id=user_id,
+                sort_key=_sort_key, reverse=before is None, limit=per_page + 1)
+
+    # The extra row only tells us whether there is another page in this direction
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before is not None:
+        rows.reverse()
+    has_next = has_more if before is None else True
+    has_prev = has_more if before is not None else after is not None
+
+    attach_usernames(rows)
+    if listing == 'health_monitoring':
+        rows = [blood_pressure_from_row(row) for row in rows]
+
+    total = total_exact = None
+    if with_total:
+        filtered = user_id is not None or any(filters[name] for name in ('type', 'from', 'to'))
+        total, total_exact = estimate_total(listing, where, params, user_id, filtered)
+
+    return {
+        'rows': rows,
+        'filters': filters,
+        'query': query,
+        'next_after': make_cursor(rows[-1]) if rows and has_next else None,
+        'prev_before': make_cursor(rows[0]) if rows and has_prev else None,
+        'total': total,
+        'total_exact': total_exact,
+    }
+
+
+def page_etag(listing, args, viewer=None):
+    """
+    ETag of the page `args` select; changes with any write to the listed
+    table and with users being added, renamed or deleted. None before
+    migration 14.
+    """
+    user_id = None
+    user = (args.get('user') or '').strip()
+    if sharding.sharding_enabled() and user.isdigit():
+        # Only that user's shard can change the page
+        user_id = int(user)
+    token = etags.table_token([listing, 'users'], user_id)
+    return etags.make_etag(token, 'admin-listing', listing, viewer, sorted(args.items(multi=True)))
+
+
+def empty_page(filters=None, query=None):
+    return {'rows': [], 'filters': filters or {}, 'query': query or {}, 'next_after': None,
+            'prev_before': None, 'total': 0, 'total_exact': True}
+
+
+def attach_usernames(rows):
+    """Set row['username'] with one primary-key lookup for the page's users"""
+    user_ids = sorted({row['user_id'] for row in rows})
+    names = {}
+    if user_ids:
+        conn = _connect_central()
+        try:
+            names = dict(conn.execute(f'''
+                SELECT id, username FROM users WHERE id IN ({','.join('?' * len(user_ids))})
+            ''', user_ids).fetchall())
+        finally:
+            conn.close()
+    for row in rows:
+        row['username'] = names.get(row['user_id'])
+    return rows
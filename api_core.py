@@ -0,0 +1,201 @@
+import heapq
+import json
+
+import archiver
+import etags
+import search
+import timeseries_blocks
+from db_utils import blood_pressure_from_row, now_ms, ms_to_iso, get_metric_ids, query_metric_range
+
+# JSON API routes shared by both entry points
+#
+# The bodies of the read APIs and /predict, written once: the Flask routes
+# (app.py) and the native ASGI handlers (asgi.py) only differ in how they get
+# a connection and send the reply. Argument parsers take the query args (any
+# mapping with .get) and raise ApiError for a bad request; the route
+# functions take a connection and return (status, payload, etag), where a
+# 304 has no payload and etag is None for responses without one.
+#
+# Usage:
+#   try:
+#       start_ms, end_ms, limit = api_core.metric_range(request.args)
+#   except api_core.ApiError as e:
+#       status, payload, etag = e.result
+#   ...
+#   status, payload, etag = api_core.metric_history(conn, user_id, metric, start_ms, end_ms, limit)
+
+# Health history windows start on a whole minute, so the response (and its
+# ETag) stays the same for a minute unless the user's data changes
+HISTORY_WINDOW_STEP_MS = 60 * 1000
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+MAX_METRIC_POINTS = 100000
+MAX_SEARCH_RESULTS = 100
+
+
+class ApiError(Exception):
+    """A request rejected before any data is read; `result` is its (status, payload, etag)"""
+
+    def __init__(self, status, message, payload=None):
+        super().__init__(message)
+        self.result = (status, payload or {'success': False, 'error': message}, None)
+
+
+# Helper function to build an error result
+def error(status, message):
+    return status, {'success': False, 'error': message}, None
+
+
+def history_window_start(days):
+    """Start of a `days` long history window, rounded down to HISTORY_WINDOW_STEP_MS"""
+    start_ms = now_ms() - days * DAY_MS
+    return start_ms - start_ms % HISTORY_WINDOW_STEP_MS
+
+
+# Helper function to read a user's health history (live and archived) since start_ms
+def read_health_history(conn, user_id, start_ms):
+    # Older rows may have been moved to the archive database
+    history = []
+    for item in archiver.iter_health_history(conn, user_id, start_ms):
+        if item.get('user_id') != user_id:
+            continue
+
+        blood_pressure_from_row(item)
+        item['created_at'] = ms_to_iso(item['created_at_ms']) or item.get('created_at')
+        history.append(item)
+    return history
+
+
+def health_history_start(args):
+    """Window start for /api/health-history (?days=, default 7)"""
+    try:
+        days = int(args.get('days', 7))
+    except ValueError:
+        days = 7
+    return history_window_start(days)
+
+
+def health_history(conn, user_id, start_ms, if_none_match):
+    """A user's health history since start_ms; 304 when `if_none_match` (werkzeug ETags) still matches"""
+    if not conn.execute("SELECT id FROM users WHERE id = ?", (user_id,)).fetchone():
+        return error(401, 'Invalid user session')
+
+    # Archiving deletes the live rows, so the live table's token covers both
+    etag = etags.make_etag(etags.user_token(conn, user_id, ['health_monitoring']),
+                           'health-history', user_id, start_ms)
+    if etag is not None and if_none_match.contains_weak(etag):
+        return 304, None, etag
+
+    return 200, {'success': True, 'history': read_health_history(conn, user_id, start_ms)}, etag
+
+
+def metric_range(args):
+    """(start_ms, end_ms, limit) for /api/health-data/<metric> (?start=&end=&days=&limit=)"""
+    try:
+        end_ms = int(args.get('end', now_ms()))
+        days = int(args.get('days', 7))
+        start_ms = int(args.get('start', end_ms - days * DAY_MS))
+        limit = min(int(args.get('limit', 10000)), MAX_METRIC_POINTS)
+    except ValueError:
+        raise ApiError(400, 'Invalid range parameters')
+    return start_ms, end_ms, limit
+
+
+def metric_history(conn, user_id, metric, start_ms, end_ms, limit):
+    """Points of one metric in [start_ms, end_ms], live and archived, oldest first"""
+    metric_id = get_metric_ids(conn).get(metric)
+    if metric_id is None:
+        return error(404, f'Unknown metric: {metric}')
+
+    points = query_metric_range(conn, user_id, metric_id, start_ms, end_ms, limit)
+    archived = archiver.query_archived_metric_range(conn, user_id, metric_id, start_ms, end_ms, limit)
+    if archived:
+        points = list(heapq.merge(archived, points))[:limit]
+    return 200, {
+        'success': True,
+        'metric': metric,
+        'points': [{'ts': ts, 'time': ms_to_iso(ts), 'value': value} for ts, value in points]
+    }, None
+
+
+def wearable_range(args):
+    """(start_ms, end_ms) for /api/wearables/<metric> (default the last hour)"""
+    try:
+        end_ms = int(args.get('end', now_ms()))
+        start_ms = int(args.get('start', end_ms - timeseries_blocks.BLOCK_MS))
+    except ValueError:
+        raise ApiError(400, 'Invalid range parameters')
+    return start_ms, end_ms
+
+
+def wearable_samples(conn, user_id, metric, start_ms, end_ms):
+    """Wearable samples in [start_ms, end_ms]; only overlapping blocks are decoded"""
+    metric_id = get_metric_ids(conn).get(metric)
+    if metric_id is None:
+        return error(404, f'Unknown metric: {metric}')
+
+    timestamps, values = timeseries_blocks.read_range(conn, user_id, metric_id, start_ms, end_ms)
+    return 200, {
+        'success': True,
+        'metric': metric,
+        'timestamps': timestamps.tolist(),
+        'values': values.tolist()
+    }, None
+
+
+def search_params(args):
+    """(query, sources, limit) for /api/search (?q=&type=&limit=); sources None means all"""
+    query = args.get('q', '').strip()
+    source = args.get('type', 'all')
+    try:
+        limit = min(int(args.get('limit', 20)), MAX_SEARCH_RESULTS)
+    except ValueError:
+        limit = 20
+
+    if source != 'all' and source not in search.SEARCH_SOURCES:
+        raise ApiError(400, 'Unsupported search type')
+    return query, None if source == 'all' else [source], limit
+
+
+def search_records(conn, user_id, query, sources, limit):
+    """Ranked full-text search over the user's own prescriptions and medical records"""
+    if not query:
+        return 200, {'success': True, 'results': []}, None
+    results = search.search(conn, query, sources=sources, user_id=user_id, limit=limit)
+    return 200, {'success': True, 'results': results}, None
+
+
+def prediction_symptoms(data):
+    """Symptom names from a /predict body ({"itching": 1, ...})"""
+    if not data or not isinstance(data, dict):
+        raise ApiError(400, 'No data received', {'error': 'No data received'})
+    print(f"Received symptom data: {data}")
+    return list(data.keys())
+
+
+def prediction_writer(user_id, symptoms, prediction):
+    """fn(conn) saving a model_registry.predict result, for write_queue"""
+    predicted_disease, confidence, description, precautions = prediction
+    params = (user_id, json.dumps(symptoms), predicted_disease, float(confidence),
+              json.dumps(precautions), now_ms())
+
+    def save(conn):
+        conn.execute('''
+            INSERT INTO disease_predictions
+            (user_id, symptoms, predicted_disease, confidence_score, recommendations, predicted_at, predicted_at_ms)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?)
+        ''', params)
+
+    return save
+
+
+def prediction_payload(symptoms, prediction):
+    predicted_disease, confidence, description, precautions = prediction
+    return {
+        'predicted_disease': predicted_disease,
+        'confidence': confidence,
+        'description': description,
+        'precautions': precautions,
+        'top_symptoms': [{"symptom": symptom.replace("_", " ").title()} for symptom in symptoms[:5]]
+    }
@@ -1,25 +1,40 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, g
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, g, Response, stream_with_context
 import sqlite3
 import os
 import json
 import traceback
 from datetime import datetime, timedelta
-import pandas as pd
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 import sys
 import re
+import itertools
+import time
+import threading
 from flask.json.tag import TaggedJSONSerializer
 from itsdangerous import URLSafeTimedSerializer
 import flask
-import pickle
-
-
+from db_utils import parse_blood_pressure, blood_pressure_from_row, now_ms, ms_to_iso, get_metric_ids
+from migrations import apply_migrations
+import timeseries_blocks
+import sharding
+from compression import CompressionMiddleware
+import static_assets
+import render_cache
+import model_registry
+import archiver
+import purge
+import etags
+import live_events
+import reminder_scheduler
+import write_queue
+import rate_limit
+import api_core
 from flask_cors import CORS
-CORS(app)
 
 
 app = Flask(__name__)
+CORS(app)
 app.secret_key = "health_assistant_fixed_secret_key_updated_2"
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
 app.config['SESSION_TYPE'] = 'filesystem'
@@ -27,6 +42,29 @@ app.config['SESSION_COOKIE_SECURE'] = False
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 
+# gzip/brotli for HTML, JSON and static text (see compression.py)
+app.wsgi_app = CompressionMiddleware(app.wsgi_app)
+
+# 503 for requests that queued too long before reaching a worker (see rate_limit.py)
+app.wsgi_app = rate_limit.LoadSheddingMiddleware(app.wsgi_app)
+
+# Fingerprinted static URLs with long-lived caching (see static_assets.py)
+static_assets.init_app(app)
+
+# Number of rows pulled from the cursor per fetchmany() call when streaming exports
+HISTORY_STREAM_CHUNK_SIZE = 500
+
+# With several server processes, whichever holds this lock runs the archiver
+# and purger; the others retry every BACKGROUND_JOBS_RETRY_SECONDS
+BACKGROUND_JOBS_LOCK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.background_jobs.lock')
+BACKGROUND_JOBS_RETRY_SECONDS = 30
+
+# Answers to a medication reminder recorded in medication_history
+MEDICATION_OUTCOMES = ('taken', 'skipped', 'delayed')
+
+# Upper bound on samples accepted by one wearable ingest request
+MAX_WEARABLE_SAMPLES = 100000
+
 # Helper function to check if all navigation links have corresponding routes
 def check_navigation_routes():
     nav_links = [
@@ -67,11 +105,15 @@ def login_required(f):
 
 def get_db_connection():
     try:
-        db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'health.db')
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        conn.execute('PRAGMA foreign_keys = ON')
-        conn.execute('PRAGMA busy_timeout = 5000')
+        if sharding.sharding_enabled() and 'user_id' in session and not session.get('is_admin', False):
+            # Route the user's tables to their shard; users/auth stay central
+            conn = sharding.connect_for_user(session['user_id'])
+        else:
+            db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'health.db')
+            conn = sqlite3.connect(db_path)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA foreign_keys = ON')
+            conn.execute('PRAGMA busy_timeout = 5000')
         
         if session.get('is_admin', False):
             return conn
@@ -97,6 +139,16 @@ def get_db_connection():
         print(f"Database connection error: {str(e)}")
         return None
 
+# Helper function to commit a write through the group-commit queue (see write_queue.py)
+def queued_write(fn):
+    """
+    Run fn(conn) on the writer of the database get_db_connection() would use
+    and return its result once committed. fn runs outside the request, so it
+    must not read session or request itself.
+    """
+    user_id = None if session.get('is_admin', False) else session.get('user_id')
+    return write_queue.write(fn, user_id)
+
 def sanitize_user_data(data, user_id=None):
     if user_id is None and 'user_id' in session:
         user_id = session.get('user_id')
@@ -120,11 +172,17 @@ def sanitize_user_data(data, user_id=None):
         
     return data
 
+# Helper function to turn an api_core (status, payload, etag) result into a response
+def api_response(status, payload, etag=None):
+    if status == 304:
+        return etags.with_etag(Response(status=304), etag)
+    return etags.with_etag(jsonify(payload), etag), status
+
 @app.route('/')
 def home():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    return render_template('index.html')
+    return render_cache.render_page('index.html')
 
 @app.route('/home')
 def home_redirect():
@@ -133,52 +191,52 @@ def home_redirect():
 @app.route('/health_monitor')
 @login_required
 def health_monitor():
-    return render_template('health_monitor.html')
+    return render_cache.render_page('health_monitor.html')
 
 @app.route('/health_advice')
 @login_required
 def health_advice():
-    return render_template('health_advice.html')
+    return render_cache.render_page('health_advice.html')
 
 @app.route('/disease_prediction')
 @login_required
 def disease_prediction():
-    return render_template('disease_prediction.html')
+    return render_cache.render_page('disease_prediction.html')
 
 @app.route('/activity')
 @login_required
 def activity():
-    return render_template('activity_tracking.html')
+    return render_cache.render_page('activity_tracking.html')
 
 @app.route('/medication_reminder')
 @login_required
 def medication_reminder():
-    return render_template('medication_reminder.html')
+    return render_cache.render_page('medication_reminder.html')
 
 @app.route('/bmi')
 @login_required
 def bmi():
-    return render_template('bmi_calculator.html')
+    return render_cache.render_page('bmi_calculator.html')
 
 @app.route('/medical_prescription')
 @login_required
 def medical_prescription():
-    return render_template('medical_prescription.html')
+    return render_cache.render_page('medical_prescription.html')
 
 @app.route('/record_management')
 @login_required
 def record_management():
-    return render_template('record_management.html')
+    return render_cache.render_page('record_management.html')
 
 @app.route('/emergency')
 @login_required
 def emergency():
-    return render_template('emergency_support.html')
+    return render_cache.render_page('emergency_support.html')
 
 @app.route('/tips')
 @login_required
 def tips():
-    return render_template('tips_section.html')
+    return render_cache.render_page('tips_section.html')
 
 @app.route('/api/health-monitoring', methods=['POST'])
 @login_required
@@ -194,11 +252,9 @@ def save_health_data():
         if 'heart_rate' not in data or 'blood_pressure' not in data or 'oxygen_level' not in data:
             return jsonify({'success': False, 'error': 'Missing required fields'}), 400
         
-        blood_pressure = data.get('blood_pressure')
-        if isinstance(blood_pressure, dict):
-            blood_pressure = json.dumps(blood_pressure)
+        bp_systolic, bp_diastolic, blood_pressure = parse_blood_pressure(data.get('blood_pressure'))
         
-        print(f"Processed blood pressure: {blood_pressure}")
+        print(f"Processed blood pressure: {bp_systolic}/{bp_diastolic}")
         
         if not os.path.exists('health.db'):
             print("Database file not found, creating new one")
@@ -225,22 +281,20 @@ def save_health_data():
                     return jsonify({'success': False, 'error': 'Database connection failed after table creation'}), 500
                 cursor = conn.cursor()
             
+            recorded_ms = now_ms()
             params = (
                 user_id,
                 data.get('heart_rate'),
                 blood_pressure,
+                bp_systolic,
+                bp_diastolic,
                 data.get('oxygen_level'),
                 data.get('body_temperature'),
                 data.get('glucose_level'),
-                data.get('notes')
+                data.get('notes'),
+                recorded_ms
             )
             
-            cursor.execute('''
-                INSERT INTO health_monitoring 
-                (user_id, heart_rate, blood_pressure, oxygen_level, body_temperature, glucose_level, notes)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', params)
-            
             metrics = [
                 ('heart_rate', data.get('heart_rate')),
                 ('oxygen_level', data.get('oxygen_level'))
@@ -252,22 +306,34 @@ def save_health_data():
             if data.get('body_temperature'):
                 metrics.append(('body_temperature', data.get('body_temperature')))
                 
-            if isinstance(data.get('blood_pressure'), dict):
-                bp = data.get('blood_pressure')
-                if 'systolic' in bp:
-                    metrics.append(('blood_pressure_systolic', bp['systolic']))
-                if 'diastolic' in bp:
-                    metrics.append(('blood_pressure_diastolic', bp['diastolic']))
+            if bp_systolic is not None:
+                metrics.append(('blood_pressure_systolic', bp_systolic))
+            if bp_diastolic is not None:
+                metrics.append(('blood_pressure_diastolic', bp_diastolic))
             
-            for metric, value in metrics:
-                cursor.execute('''
-                    INSERT INTO health_data (user_id, metric, value)
-                    VALUES (?, ?, ?)
-                ''', (user_id, metric, value))
+            metric_ids = get_metric_ids(conn)
+            samples = [(user_id, metric_ids[metric], recorded_ms, value)
+                       for metric, value in metrics if value is not None]
             
-            conn.commit()
+            def save(conn):
+                reading_id = conn.execute('''
+                    INSERT INTO health_monitoring 
+                    (user_id, heart_rate, blood_pressure, bp_systolic, bp_diastolic, oxygen_level, body_temperature, glucose_level, notes, created_at_ms)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', params).lastrowid
+                conn.executemany('''
+                    INSERT OR REPLACE INTO health_data (user_id, metric_id, ts, value)
+                    VALUES (?, ?, ?, ?)
+                ''', samples)
+                return reading_id
+            
+            reading_id = queued_write(save)
+            live_events.publish_reading(conn, user_id, reading_id)
             return jsonify({'success': True, 'message': 'Health data saved successfully'})
             
+        except write_queue.WriteQueueFull as e:
+            print(f"Shedding health data write: {str(e)}")
+            return jsonify({'success': False, 'error': 'Server busy, please retry'}), 503, {'Retry-After': '1'}
         except sqlite3.Error as e:
             conn.rollback()
             print(f"Database error: {str(e)}")
@@ -281,274 +347,642 @@ def save_health_data():
         print(f"Error trace: {error_trace}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/health-monitoring/stream', methods=['GET'])
+@login_required
+def stream_health_monitoring():
+    """
+    Server-Sent Events stream of the user's new readings ('reading' events)
+    and rolled-up averages ('summary' events); see live_events.py.
+
+    Each open stream holds a server thread here (a gthread worker thread
+    under gunicorn, see gunicorn.conf.py); asgi.py, which the Procfile runs,
+    serves the same stream from its event loop, where idle streams cost
+    almost nothing.
+    """
+    user_id = session.get('user_id')
+    last_id = live_events.parse_last_event_id(request.headers.get('Last-Event-ID'))
+    # Subscribe before reading the catch-up so nothing saved in between is missed
+    subscription = live_events.subscribe(live_events.ThreadSubscription(user_id))
+
+    def read(fn, *args):
+        conn = get_db_connection()
+        if not conn:
+            raise sqlite3.OperationalError('Database connection failed')
+        try:
+            return fn(conn, user_id, *args)
+        finally:
+            conn.close()
+
+    try:
+        data, last_id = read(live_events.catch_up, last_id)
+    except Exception:
+        live_events.unsubscribe(subscription)
+        raise
+
+    def generate(data, last_id):
+        try:
+            yield f"retry: {live_events.RETRY_MS}\n\n".encode() + data
+            while True:
+                message = subscription.get()
+                if message is None:
+                    data = live_events.HEARTBEAT
+                else:
+                    data, last_id = live_events.encode_message(message, last_id)
+                if subscription.take_lost():
+                    more, last_id = read(live_events.catch_up, last_id)
+                    data += more
+                if data:
+                    yield data
+        finally:
+            live_events.unsubscribe(subscription)
+
+    return Response(stream_with_context(generate(data, last_id)), headers=live_events.STREAM_HEADERS)
+
 @app.route('/api/health-history', methods=['GET'])
 @login_required
 def get_health_history():
     try:
         user_id = session.get('user_id')
-        days = request.args.get('days', '7')
-        
+        start_ms = api_core.health_history_start(request.args)
+
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'success': False, 'error': 'Database connection failed'}), 500
+
+        try:
+            return api_response(*api_core.health_history(conn, user_id, start_ms, request.if_none_match))
+
+        except sqlite3.Error as e:
+            print(f"Database error: {str(e)}")
+            return jsonify({'success': False, 'error': f'Database error: {str(e)}'}), 500
+        finally:
+            conn.close()
+            
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"Error fetching health history: {str(e)}")
+        print(f"Error trace: {error_trace}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/health-history/stream', methods=['GET'])
+@login_required
+def stream_health_history():
+    """
+    Stream a user's health history without materializing it in memory.
+
+    Rows are read from the cursor HISTORY_STREAM_CHUNK_SIZE at a time and
+    serialized chunk by chunk, so memory stays flat regardless of how many
+    years of history are exported.
+
+    Query args:
+        days: size of the window in days (omit or 0 for the full history)
+        format: 'ndjson' (default, one JSON object per line) or 'json'
+                (a single chunked {"success": true, "history": [...]} document)
+    """
+    try:
+        user_id = session.get('user_id')
+        days = request.args.get('days', '0')
+        output_format = request.args.get('format', 'ndjson')
+
         try:
             days = int(days)
         except ValueError:
-            days = 7
-            
-        start_date = datetime.now() - timedelta(days=days)
-        
+            days = 0
+
+        if output_format not in ('ndjson', 'json'):
+            return jsonify({'success': False, 'error': 'Unsupported format'}), 400
+
         conn = get_db_connection()
         if not conn:
             return jsonify({'success': False, 'error': 'Database connection failed'}), 500
-            
+
         cursor = conn.cursor()
-        
+        cursor.execute("SELECT id FROM users WHERE id = ?", (user_id,))
+        if not cursor.fetchone():
+            conn.close()
+            return jsonify({'success': False, 'error': 'Invalid user session'}), 401
+
+        start_ms = now_ms() - days * 24 * 60 * 60 * 1000 if days > 0 else None
+        if start_ms is not None:
+            start_ms -= start_ms % api_core.HISTORY_WINDOW_STEP_MS
+
+        etag = etags.make_etag(etags.user_token(conn, user_id, ['health_monitoring']),
+                               'health-history-stream', user_id, start_ms, output_format)
+        cached = etags.not_modified(etag)
+        if cached:
+            conn.close()
+            return cached
+
+        rows_iter = archiver.iter_health_history(conn, user_id, start_ms, HISTORY_STREAM_CHUNK_SIZE)
+
+        def generate():
+            first = True
+            try:
+                if output_format == 'json':
+                    yield '{"success": true, "history": ['
+
+                while True:
+                    rows = list(itertools.islice(rows_iter, HISTORY_STREAM_CHUNK_SIZE))
+                    if not rows:
+                        break
+
+                    # Rebuild blood pressure values only for the rows in this chunk
+                    chunk = []
+                    for item in rows:
+                        if item.get('user_id') != user_id:
+                            continue
+
+                        blood_pressure_from_row(item)
+                        item['created_at'] = ms_to_iso(item['created_at_ms']) or item.get('created_at')
+                        chunk.append(json.dumps(item))
+
+                    if not chunk:
+                        continue
+
+                    if output_format == 'json':
+                        yield ('' if first else ',') + ','.join(chunk)
+                    else:
+                        yield '\n'.join(chunk) + '\n'
+                    first = False
+
+                if output_format == 'json':
+                    yield ']}'
+            except sqlite3.Error as e:
+                print(f"Database error while streaming health history: {str(e)}")
+            finally:
+                conn.close()
+
+        mimetype = 'application/x-ndjson' if output_format == 'ndjson' else 'application/json'
+        return etags.with_etag(Response(stream_with_context(generate()), mimetype=mimetype), etag)
+
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"Error streaming health history: {str(e)}")
+        print(f"Error trace: {error_trace}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/health-data/<metric>', methods=['GET'])
+@login_required
+def get_metric_history(metric):
+    """
+    Time-range query for a single metric, e.g. /api/health-data/heart_rate?days=30
+
+    Query args:
+        start, end: UTC epoch milliseconds (default: the last `days` days up to now)
+        days: window size used when start is omitted (default 7)
+        limit: maximum number of points (default 10000)
+    """
+    try:
+        user_id = session.get('user_id')
+
         try:
-            cursor.execute("SELECT id FROM users WHERE id = ?", (user_id,))
-            if not cursor.fetchone():
-                return jsonify({'success': False, 'error': 'Invalid user session'}), 401
-            
-            cursor.execute('''
-                SELECT * FROM health_monitoring
-                WHERE user_id = ? AND created_at >= ?
-                ORDER BY created_at DESC
-            ''', (user_id, start_date.strftime('%Y-%m-%d %H:%M:%S')))
-            
-            history = []
-            for row in cursor.fetchall():
-                item = dict(row)
-                if item.get('user_id') != user_id:
-                    continue
-                    
-                if item.get('blood_pressure'):
-                    try:
-                        item['blood_pressure'] = json.loads(item['blood_pressure'])
-                    except:
-                        pass
-                history.append(item)
-            
-            history = sanitize_user_data(history, user_id)
-            return jsonify({'success': True, 'history': history})
-            
+            start_ms, end_ms, limit = api_core.metric_range(request.args)
+        except api_core.ApiError as e:
+            return api_response(*e.result)
+
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'success': False, 'error': 'Database connection failed'}), 500
+
+        try:
+            return api_response(*api_core.metric_history(conn, user_id, metric, start_ms, end_ms, limit))
         except sqlite3.Error as e:
             print(f"Database error: {str(e)}")
             return jsonify({'success': False, 'error': f'Database error: {str(e)}'}), 500
         finally:
             conn.close()
-            
+
     except Exception as e:
         error_trace = traceback.format_exc()
-        print(f"Error fetching health history: {str(e)}")
+        print(f"Error fetching metric history: {str(e)}")
         print(f"Error trace: {error_trace}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/predict', methods=['POST'])
+@app.route('/api/wearables/samples', methods=['POST'])
 @login_required
-def predict_disease():
+@rate_limit.limit('wearable_ingest')
+def ingest_wearable_samples():
+    """
+    Bulk ingest of high-frequency wearable samples into compressed hourly blocks
+
+    Body: {"metric": "heart_rate", "timestamps": [ms, ...], "values": [v, ...]}
+    or    {"metric": "heart_rate", "samples": [[ms, v], ...]}
+    """
     try:
         user_id = session.get('user_id')
         data = request.json
+        if not data or 'metric' not in data:
+            return jsonify({'success': False, 'error': 'Missing required fields'}), 400
+
+        if 'samples' in data:
+            samples = data.get('samples') or []
+            timestamps = [sample[0] for sample in samples]
+            values = [sample[1] for sample in samples]
+        else:
+            timestamps = data.get('timestamps') or []
+            values = data.get('values') or []
+
+        if len(timestamps) != len(values):
+            return jsonify({'success': False, 'error': 'timestamps and values must have the same length'}), 400
+        if len(timestamps) > MAX_WEARABLE_SAMPLES:
+            return jsonify({'success': False, 'error': f'At most {MAX_WEARABLE_SAMPLES} samples per request'}), 413
+
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'success': False, 'error': 'Database connection failed'}), 500
+
+        try:
+            metric_id = get_metric_ids(conn).get(data['metric'])
+            if metric_id is None:
+                return jsonify({'success': False, 'error': f"Unknown metric: {data['metric']}"}), 404
+
+            blocks = queued_write(lambda conn: timeseries_blocks.append_samples(
+                conn, user_id, metric_id, timestamps, values))
+            return jsonify({'success': True, 'samples': len(timestamps), 'blocks': blocks})
+        except write_queue.WriteQueueFull as e:
+            print(f"Shedding wearable samples write: {str(e)}")
+            return jsonify({'success': False, 'error': 'Server busy, please retry'}), 503, {'Retry-After': '1'}
+        except (ValueError, TypeError) as e:
+            conn.rollback()
+            return jsonify({'success': False, 'error': f'Invalid samples: {str(e)}'}), 400
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Database error: {str(e)}")
+            return jsonify({'success': False, 'error': f'Database error: {str(e)}'}), 500
+        finally:
+            conn.close()
+
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"Error ingesting wearable samples: {str(e)}")
+        print(f"Error trace: {error_trace}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/wearables/<metric>', methods=['GET'])
+@login_required
+def get_wearable_samples(metric):
+    """
+    Range read over compressed wearable blocks; only overlapping blocks are decoded
+
+    Query args: start, end (UTC epoch ms; default the last hour)
+    """
+    try:
+        user_id = session.get('user_id')
+
+        try:
+            start_ms, end_ms = api_core.wearable_range(request.args)
+        except api_core.ApiError as e:
+            return api_response(*e.result)
+
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'success': False, 'error': 'Database connection failed'}), 500
+
+        try:
+            return api_response(*api_core.wearable_samples(conn, user_id, metric, start_ms, end_ms))
+        except sqlite3.Error as e:
+            print(f"Database error: {str(e)}")
+            return jsonify({'success': False, 'error': f'Database error: {str(e)}'}), 500
+        finally:
+            conn.close()
+
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"Error reading wearable samples: {str(e)}")
+        print(f"Error trace: {error_trace}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/search', methods=['GET'])
+@login_required
+def search_records():
+    """
+    Ranked full-text search over the user's own prescriptions and medical records
+
+    Query args:
+        q: search text; every word is matched as a prefix ("metf" finds metformin)
+        type: 'prescriptions', 'records' or 'all' (default)
+        limit: maximum number of results (default 20, at most 100)
+    """
+    try:
+        user_id = session.get('user_id')
+
+        try:
+            query, sources, limit = api_core.search_params(request.args)
+        except api_core.ApiError as e:
+            return api_response(*e.result)
+
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'success': False, 'error': 'Database connection failed'}), 500
+
+        try:
+            return api_response(*api_core.search_records(conn, user_id, query, sources, limit))
+        except sqlite3.Error as e:
+            print(f"Database error: {str(e)}")
+            return jsonify({'success': False, 'error': f'Database error: {str(e)}'}), 500
+        finally:
+            conn.close()
+
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"Error searching records: {str(e)}")
+        print(f"Error trace: {error_trace}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Helper function to validate a medication reminder payload
+def reminder_fields(data, partial=False):
+    """
+    Column values from a create (or, with partial=True, update) payload as
+    (fields, error). The form's 'twice-daily' is stored as 'twice_daily'.
+    """
+    fields = {}
+    for name in ('medication_name', 'reminder_time'):
+        if name in data or not partial:
+            value = str(data.get(name) or '').strip()
+            if not value:
+                return None, f'{name} is required'
+            fields[name] = value
+    if 'reminder_time' in fields and not re.match(r'^([01]\d|2[0-3]):[0-5]\d$', fields['reminder_time']):
+        return None, 'reminder_time must be HH:MM'
+
+    if 'frequency' in data or not partial:
+        frequency = str(data.get('frequency') or 'daily').strip().lower().replace('-', '_')
+        if frequency not in reminder_scheduler.FREQUENCIES:
+            return None, f"frequency must be one of {', '.join(reminder_scheduler.FREQUENCIES)}"
+        fields['frequency'] = frequency
+    if 'days_of_week' in data:
+        days = data.get('days_of_week') or []
+        if not isinstance(days, list) or any(str(day)[:3].title() not in reminder_scheduler.WEEKDAYS for day in days):
+            return None, 'days_of_week must be a list such as ["Mon", "Thu"]'
+        fields['days_of_week'] = json.dumps([str(day)[:3].title() for day in days]) if days else None
+    for name in ('start_date', 'end_date'):
+        if name in data:
+            value = data.get(name) or None
+            if value is not None and reminder_scheduler.parse_date(value) is None:
+                return None, f'{name} must be YYYY-MM-DD'
+            fields[name] = value
+    for name in ('dosage', 'notes'):
+        if name in data:
+            fields[name] = data.get(name)
+    if 'is_active' in data:
+        fields['is_active'] = 1 if data.get('is_active') else 0
+    return fields, None
+
+# Helper function to convert a medication_reminders row for the API
+def reminder_to_dict(row):
+    item = dict(row)
+    item['days_of_week'] = reminder_scheduler.weekday_names(item.get('days_of_week'))
+    next_at = None
+    if item.get('is_active'):
+        reminder = reminder_scheduler.reminder_from_row(row)
+        next_at = reminder.next_occurrence(datetime.now()) if reminder else None
+    item['next_at'] = next_at.isoformat() if next_at else None
+    return item
+
+@app.route('/api/medication-reminders', methods=['GET'])
+@login_required
+def get_medication_reminders():
+    try:
+        user_id = session.get('user_id')
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'success': False, 'error': 'Database connection failed'}), 500
         
+        try:
+            cursor = conn.execute('''
+                SELECT * FROM medication_reminders
+                WHERE user_id = ?
+                ORDER BY reminder_time, id
+            ''', (user_id,))
+            reminders = [reminder_to_dict(row) for row in cursor.fetchall()]
+            return jsonify({'success': True, 'reminders': reminders})
+        except sqlite3.Error as e:
+            print(f"Database error: {str(e)}")
+            return jsonify({'success': False, 'error': f'Database error: {str(e)}'}), 500
+        finally:
+            conn.close()
+
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"Error fetching medication reminders: {str(e)}")
+        print(f"Error trace: {error_trace}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/medication-reminders', methods=['POST'])
+@login_required
+def create_medication_reminder():
+    try:
+        user_id = session.get('user_id')
+        data = request.json
         if not data:
-            return jsonify({'error': 'No data received'}), 400
+            return jsonify({'success': False, 'error': 'No data received'}), 400
+        
+        fields, error = reminder_fields(data)
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
         
-        print(f"Received symptom data: {data}")
-        selected_symptoms = list(data.keys())
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'success': False, 'error': 'Database connection failed'}), 500
         
         try:
-            model_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'health_assistant_model.pkl')
-            if os.path.exists(model_path):
-                model = pickle.load(open(model_path, 'rb'))
-                label_encoder = pickle.load(open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'label_encoder.pkl'), 'rb'))
-                disease_precautions = pickle.load(open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'disease_precautions.pkl'), 'rb'))
-                disease_descriptions = pickle.load(open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'disease_descriptions.pkl'), 'rb'))
-                feature_names = pickle.load(open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'feature_names.pkl'), 'rb'))
-                display_to_data = pickle.load(open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'display_to_data.pkl'), 'rb'))
-                
-                features = [0] * len(feature_names)
-                for symptom in data.keys():
-                    if symptom in display_to_data:
-                        data_symptom = display_to_data[symptom]
-                        if data_symptom in feature_names:
-                            idx = feature_names.index(data_symptom)
-                            features[idx] = 1
-                    elif symptom in feature_names:
-                        idx = feature_names.index(symptom)
-                        features[idx] = 1
-                
-                prediction = model.predict([features])
-                predicted_disease = label_encoder.inverse_transform(prediction)[0]
-                confidence = max(model.predict_proba([features])[0])
-                
-                description = disease_descriptions.get(predicted_disease, "No description available")
-                precautions = disease_precautions.get(predicted_disease, ["Consult a doctor"])
-                
-                print(f"Model prediction: {predicted_disease} with confidence {confidence}")
-            else:
-                raise FileNotFoundError("Model file not found")
-        except Exception as e:
-            print(f"Error using model: {str(e)}, using dataset-based prediction")
+            fields['user_id'] = user_id
+            columns = list(fields)
+
+            def save(conn):
+                return conn.execute(f'''
+                    INSERT INTO medication_reminders ({', '.join(columns)})
+                    VALUES ({', '.join('?' * len(columns))})
+                ''', [fields[column] for column in columns]).lastrowid
+
+            reminder_id = queued_write(save)
+            reminder_scheduler.reminder_changed(user_id, reminder_id)
             
-            try:
-                dataset_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Disease_Symptom_Dataset.csv')
-                description_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'symptom_Description.csv')
-                precaution_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'symptom_precaution.csv')
-                severity_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Symptom-severity.csv')
-                
-                disease_data = pd.read_csv(dataset_path)
-                descriptions = pd.read_csv(description_path)
-                precautions_data = pd.read_csv(precaution_path)
-                severity_data = pd.read_csv(severity_path)
-                
-                for col in disease_data.columns[1:]:
-                    if col.startswith('Symptom'):
-                        disease_data[col] = disease_data[col].str.strip() if disease_data[col].dtype == 'object' else disease_data[col]
-                
-                disease_matches = {}
-                symptom_severity = {}
-                
-                for _, row in severity_data.iterrows():
-                    symptom_severity[row['Symptom']] = row['weight']
-                
-                selected_severity = 0
-                for symptom in selected_symptoms:
-                    if symptom in symptom_severity:
-                        selected_severity += symptom_severity[symptom]
-                
-                for _, row in disease_data.iterrows():
-                    disease = row['Disease']
-                    disease_symptoms = []
-                    for col in disease_data.columns[1:]:
-                        if pd.notna(row[col]) and row[col] != '':
-                            disease_symptoms.append(row[col].strip() if isinstance(row[col], str) else row[col])
-                    
-                    match_count = 0
-                    severity_score = 0
-                    for symptom in selected_symptoms:
-                        if symptom in disease_symptoms:
-                            match_count += 1
-                            if symptom in symptom_severity:
-                                severity_score += symptom_severity[symptom]
-                    
-                    if len(disease_symptoms) > 0:
-                        match_percentage = match_count / len(disease_symptoms)
-                        if disease not in disease_matches or match_percentage > disease_matches[disease]['match_percentage']:
-                            disease_matches[disease] = {
-                                'match_count': match_count,
-                                'match_percentage': match_percentage,
-                                'severity_score': severity_score,
-                                'total_symptoms': len(disease_symptoms)
-                            }
-                
-                if disease_matches:
-                    sorted_matches = sorted(
-                        disease_matches.items(), 
-                        key=lambda x: (x[1]['match_percentage'], x[1]['severity_score']), 
-                        reverse=True
-                    )
-                    
-                    top_matches = sorted_matches[:3]
-                    best_match = top_matches[0]
-                    predicted_disease = best_match[0]
-                    match_data = best_match[1]
-                    
-                    confidence = min(0.95, match_data['match_percentage'] * 0.7 + 
-                                    (match_data['severity_score'] / (selected_severity + 0.1)) * 0.3)
-                    
-                    disease_info = descriptions[descriptions['Disease'] == predicted_disease]
-                    if not disease_info.empty:
-                        description = disease_info.iloc[0]['Description']
-                    else:
-                        description = f"Information about {predicted_disease} is not available."
-                    
-                    precaution_info = precautions_data[precautions_data['Disease'] == predicted_disease]
-                    if not precaution_info.empty:
-                        precautions = []
-                        for i in range(1, 5):
-                            precaution = precaution_info.iloc[0].get(f'Precaution_{i}')
-                            if pd.notna(precaution) and precaution:
-                                precautions.append(precaution)
-                    else:
-                        precautions = ["Consult a healthcare professional"]
-                    
-                    print(f"Dataset-based prediction: {predicted_disease} with confidence {confidence:.2f}")
-                else:
-                    predicted_disease = "Unknown Condition"
-                    confidence = 0.3
-                    description = "Based on the symptoms provided, we couldn't determine a specific condition. Please consult a healthcare professional."
-                    precautions = ["Consult a doctor", "Monitor your symptoms", "Rest and stay hydrated"]
-            except Exception as dataset_error:
-                print(f"Error using dataset for prediction: {str(dataset_error)}, using fallback prediction")
-                symptom_count = len(data)
-                
-                if "skin_rash" in data and "itching" in data:
-                    predicted_disease = "Fungal infection"
-                    confidence = 0.75
-                    description = "A fungal infection is caused by fungi that take over an area of the body."
-                    precautions = ["Keep the affected area clean and dry", "Use antifungal medications", "Maintain good hygiene"]
-                elif "high_fever" in data and "headache" in data and "chills" in data:
-                    predicted_disease = "Malaria"
-                    confidence = 0.80
-                    description = "Malaria is a serious disease caused by a parasite that is transmitted by the bite of infected mosquitoes."
-                    precautions = ["Consult a doctor immediately", "Take prescribed medications", "Use mosquito repellent"]
-                elif "continuous_sneezing" in data and "chills" in data:
-                    predicted_disease = "Allergy"
-                    confidence = 0.70
-                    description = "An allergy is an immune system response to a foreign substance that's not typically harmful to your body."
-                    precautions = ["Avoid allergens", "Take antihistamines", "Use nasal sprays if prescribed"]
-                elif "vomiting" in data and "stomach_pain" in data:
-                    predicted_disease = "GERD"
-                    confidence = 0.65
-                    description = "Gastroesophageal reflux disease (GERD) occurs when stomach acid frequently flows back into the tube connecting your mouth and stomach."
-                    precautions = ["Avoid spicy and fatty foods", "Don't lie down after eating", "Elevate your head while sleeping"]
-                elif "fatigue" in data and "weight_loss" in data and "restlessness" in data:
-                    predicted_disease = "Diabetes"
-                    confidence = 0.75
-                    description = "Diabetes is a disease that occurs when your blood glucose is too high."
-                    precautions = ["Monitor blood sugar regularly", "Follow a balanced diet", "Exercise regularly"]
-                elif symptom_count > 5:
-                    predicted_disease = "Influenza"
-                    confidence = 0.65
-                    description = "Influenza is a viral infection that attacks your respiratory system."
-                    precautions = ["Rest and drink plenty of fluids", "Take over-the-counter pain relievers", "Stay home to avoid spreading infection"]
-                elif "fatigue" in data and "mild_fever" in data:
-                    predicted_disease = "Common Cold"
-                    confidence = 0.70
-                    description = "The common cold is a viral infection of your nose and throat."
-                    precautions = ["Rest and stay hydrated", "Use saline nasal drops", "Take over-the-counter cold medications"]
-                else:
-                    predicted_disease = "General Viral Infection"
-                    confidence = 0.50
-                    description = "A viral infection is any illness caused by a virus."
-                    precautions = ["Rest well", "Stay hydrated", "Take fever reducers if needed"]
+            row = conn.execute("SELECT * FROM medication_reminders WHERE id = ?", (reminder_id,)).fetchone()
+            return jsonify({'success': True, 'reminder': reminder_to_dict(row)})
+        except write_queue.WriteQueueFull as e:
+            print(f"Shedding medication reminder write: {str(e)}")
+            return jsonify({'success': False, 'error': 'Server busy, please retry'}), 503, {'Retry-After': '1'}
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Database error: {str(e)}")
+            return jsonify({'success': False, 'error': f'Database error: {str(e)}'}), 500
+        finally:
+            conn.close()
+
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"Error creating medication reminder: {str(e)}")
+        print(f"Error trace: {error_trace}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/medication-reminders/<int:reminder_id>', methods=['PUT'])
+@login_required
+def update_medication_reminder(reminder_id):
+    try:
+        user_id = session.get('user_id')
+        data = request.json
+        if not data:
+            return jsonify({'success': False, 'error': 'No data received'}), 400
         
-        try:
-            conn = get_db_connection()
-            if conn:
-                cursor = conn.cursor()
-                symptoms_json = json.dumps(list(data.keys()))
-                
-                cursor.execute('''
-                    INSERT INTO disease_predictions 
-                    (user_id, symptoms, predicted_disease, confidence_score, recommendations, predicted_at)
-                    VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-                ''', (user_id, symptoms_json, predicted_disease, confidence, json.dumps(precautions)))
-                
-                conn.commit()
-                conn.close()
-        except Exception as e:
-            print(f"Failed to save prediction: {str(e)}")
+        fields, error = reminder_fields(data, partial=True)
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
         
-        top_symptoms = [{"symptom": symptom.replace("_", " ").title()} for symptom in list(data.keys())[:5]]
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'success': False, 'error': 'Database connection failed'}), 500
         
-        response = {
-            'predicted_disease': predicted_disease,
-            'confidence': confidence,
-            'description': description,
-            'precautions': precautions,
-            'top_symptoms': top_symptoms
-        }
+        try:
+            if fields:
+                assignments = ', '.join(f'{column} = ?' for column in fields)
+
+                def save(conn):
+                    return conn.execute(f'''
+                        UPDATE medication_reminders SET {assignments}
+                        WHERE id = ? AND user_id = ?
+                    ''', list(fields.values()) + [reminder_id, user_id]).rowcount
+
+                if queued_write(save) == 0:
+                    return jsonify({'success': False, 'error': 'Reminder not found'}), 404
+                reminder_scheduler.reminder_changed(user_id, reminder_id)
+            
+            row = conn.execute("SELECT * FROM medication_reminders WHERE id = ? AND user_id = ?",
+                               (reminder_id, user_id)).fetchone()
+            if row is None:
+                return jsonify({'success': False, 'error': 'Reminder not found'}), 404
+            return jsonify({'success': True, 'reminder': reminder_to_dict(row)})
+        except write_queue.WriteQueueFull as e:
+            print(f"Shedding medication reminder write: {str(e)}")
+            return jsonify({'success': False, 'error': 'Server busy, please retry'}), 503, {'Retry-After': '1'}
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Database error: {str(e)}")
+            return jsonify({'success': False, 'error': f'Database error: {str(e)}'}), 500
+        finally:
+            conn.close()
+
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"Error updating medication reminder: {str(e)}")
+        print(f"Error trace: {error_trace}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/medication-reminders/<int:reminder_id>', methods=['DELETE'])
+@login_required
+def delete_medication_reminder(reminder_id):
+    try:
+        user_id = session.get('user_id')
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'success': False, 'error': 'Database connection failed'}), 500
+        
+        try:
+            deleted = queued_write(lambda conn: conn.execute(
+                "DELETE FROM medication_reminders WHERE id = ? AND user_id = ?", (reminder_id, user_id)).rowcount)
+            if deleted == 0:
+                return jsonify({'success': False, 'error': 'Reminder not found'}), 404
+            reminder_scheduler.reminder_changed(user_id, reminder_id)
+            return jsonify({'success': True, 'message': 'Reminder deleted'})
+        except write_queue.WriteQueueFull as e:
+            print(f"Shedding medication reminder write: {str(e)}")
+            return jsonify({'success': False, 'error': 'Server busy, please retry'}), 503, {'Retry-After': '1'}
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Database error: {str(e)}")
+            return jsonify({'success': False, 'error': f'Database error: {str(e)}'}), 500
+        finally:
+            conn.close()
+
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"Error deleting medication reminder: {str(e)}")
+        print(f"Error trace: {error_trace}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/medication-reminders/<int:reminder_id>/outcome', methods=['POST'])
+@login_required
+def record_medication_outcome(reminder_id):
+    """
+    Record whether a reminded dose was taken, skipped or delayed. With the
+    history_id from the 'reminder' event, that medication_history row is
+    updated; otherwise a new row is recorded.
+    """
+    try:
+        user_id = session.get('user_id')
+        data = request.json or {}
+        status = data.get('status')
+        if status not in MEDICATION_OUTCOMES:
+            return jsonify({'success': False, 'error': f"status must be one of {', '.join(MEDICATION_OUTCOMES)}"}), 400
         
-        return jsonify(response)
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'success': False, 'error': 'Database connection failed'}), 500
         
+        try:
+            reminder = conn.execute("SELECT * FROM medication_reminders WHERE id = ? AND user_id = ?",
+                                    (reminder_id, user_id)).fetchone()
+            if reminder is None:
+                return jsonify({'success': False, 'error': 'Reminder not found'}), 404
+            
+            history_id = data.get('history_id')
+            notes = data.get('notes')
+            recorded_ms = now_ms()
+
+            def save(conn):
+                if history_id:
+                    updated = conn.execute('''
+                        UPDATE medication_history
+                        SET status = ?, notes = COALESCE(?, notes), taken_at = CURRENT_TIMESTAMP, taken_at_ms = ?
+                        WHERE id = ? AND user_id = ? AND reminder_id = ?
+                    ''', (status, notes, recorded_ms, history_id, user_id, reminder_id)).rowcount
+                    if updated:
+                        return history_id
+                return conn.execute('''
+                    INSERT INTO medication_history
+                    (user_id, reminder_id, medication_name, dosage, taken_at_ms, status, notes)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (user_id, reminder_id, reminder['medication_name'], reminder['dosage'],
+                      recorded_ms, status, notes)).lastrowid
+
+            return jsonify({'success': True, 'history_id': queued_write(save)})
+        except write_queue.WriteQueueFull as e:
+            print(f"Shedding medication reminder write: {str(e)}")
+            return jsonify({'success': False, 'error': 'Server busy, please retry'}), 503, {'Retry-After': '1'}
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Database error: {str(e)}")
+            return jsonify({'success': False, 'error': f'Database error: {str(e)}'}), 500
+        finally:
+            conn.close()
+
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"Error recording medication outcome: {str(e)}")
+        print(f"Error trace: {error_trace}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/predict', methods=['POST'])
+@login_required
+@rate_limit.limit('predict')
+def predict_disease():
+    try:
+        user_id = session.get('user_id')
+
+        try:
+            selected_symptoms = api_core.prediction_symptoms(request.get_json(silent=True))
+        except api_core.ApiError as e:
+            return api_response(*e.result)
+
+        prediction = model_registry.predict(selected_symptoms)
+
+        try:
+            queued_write(api_core.prediction_writer(user_id, selected_symptoms, prediction))
+        except Exception as e:
+            print(f"Failed to save prediction: {str(e)}")
+
+        return jsonify(api_core.prediction_payload(selected_symptoms, prediction))
+
     except Exception as e:
         error_trace = traceback.format_exc()
         print(f"Error in disease prediction: {str(e)}")
@@ -572,22 +1006,31 @@ def login():
         cursor = conn.cursor()
         
         try:
-            cursor.execute("SELECT id, username, email, password_hash FROM users WHERE username = ? OR email = ?", 
-                          (username, username))
+            # Accounts deleted by an admin stay in users until their purge finishes
+            cursor.execute("""
+                SELECT id, username, email, password_hash FROM users
+                WHERE (username = ? OR email = ?) AND deleted_at_ms IS NULL
+            """, (username, username))
             user_data = cursor.fetchone()
             
             if user_data and check_password_hash(user_data['password_hash'], password):
+                # Record the login before the session exists, so a failed write leaves the user logged out
+                login_user_id = user_data['id']
+                write_queue.write(lambda conn: conn.execute(
+                    "UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?", (login_user_id,)))
+                
                 session.clear()
                 session['user_id'] = user_data['id']
                 session['username'] = user_data['username']
                 session.permanent = True
                 
-                cursor.execute("UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?", (user_data['id'],))
-                conn.commit()
-                
                 return redirect(url_for('home'))
             else:
                 flash('Invalid username or password', 'error')
+        except write_queue.WriteQueueFull as e:
+            print(f"Shedding login: {str(e)}")
+            flash('The server is busy, please try again', 'error')
+            return render_template('login.html'), 503, {'Retry-After': '1'}
         except Exception as e:
             print(f"Login error: {str(e)}")
             flash('An error occurred during login', 'error')
@@ -625,14 +1068,10 @@ def signup():
                 return render_template('signup.html')
                 
             password_hash = generate_password_hash(password)
-            cursor.execute(
+            user_id = write_queue.write(lambda conn: conn.execute(
                 "INSERT INTO users (username, email, password_hash, created_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
                 (username, email, password_hash)
-            )
-            conn.commit()
-            
-            cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
-            user_id = cursor.fetchone()['id']
+            ).lastrowid)
             
             session.clear()
             session['user_id'] = user_id
@@ -641,6 +1080,10 @@ def signup():
         
             flash('Account created successfully!', 'success')
             return redirect(url_for('home'))
+        except write_queue.WriteQueueFull as e:
+            print(f"Shedding signup: {str(e)}")
+            flash('The server is busy, please try again', 'error')
+            return render_template('signup.html'), 503, {'Retry-After': '1'}
         except Exception as e:
             conn.rollback()
             print(f"Error creating user: {str(e)}")
@@ -686,14 +1129,84 @@ def admin_required(f):
                 conn.close()
     return decorated_function
 
+@app.route('/api/render-cache/stats', methods=['GET'])
+@admin_required
+def render_cache_stats():
+    return jsonify({'success': True, 'stats': render_cache.stats()})
+
+@app.route('/api/rate-limit/stats', methods=['GET'])
+@admin_required
+def rate_limit_stats():
+    return jsonify({'success': True, 'stats': rate_limit.stats()})
+
 def initialize_app():
     print("Initializing Health Assistant application...")
     check_navigation_routes()
     print("Database integrity check skipped - use fix_admin_redirect.py to repair database if needed")
+    db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'health.db')
+    if os.path.exists(db_path):
+        conn = sqlite3.connect(db_path)
+        try:
+            apply_migrations(conn)
+        finally:
+            conn.close()
+    model_registry.preload()
     app.config['DB_CHECK_RESULT'] = {'status': 'skipped', 'message': 'Database check skipped'}
 
+_background_jobs_lock = None
+
+def start_background_jobs(lock_path=None):
+    """
+    Start the archiver, purger and reminder scheduler threads. With
+    `lock_path`, only the process holding an exclusive lock on that file runs
+    them: every worker of a
+    multi-process server calls this, one of them wins the lock, and another
+    takes over (within BACKGROUND_JOBS_RETRY_SECONDS) if that worker exits.
+    """
+    if lock_path is None:
+        archiver.start_background_archiver()
+        purge.start_background_purger()
+        reminder_scheduler.start_reminder_scheduler()
+        return
+    
+    import fcntl
+    
+    def acquire():
+        global _background_jobs_lock
+        lock_file = open(lock_path, 'a')
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                time.sleep(BACKGROUND_JOBS_RETRY_SECONDS)
+        # Held for the life of the process; closing the file would release it
+        _background_jobs_lock = lock_file
+        print(f"Process {os.getpid()} runs the background jobs")
+        archiver.start_background_archiver()
+        purge.start_background_purger()
+        reminder_scheduler.start_reminder_scheduler()
+    
+    threading.Thread(target=acquire, name='background-jobs-lock', daemon=True).start()
+
+# Application factory used by wsgi.py (and `python app.py`)
+def create_app(config=None, background_jobs=True):
+    """
+    Configure and initialize the app: `config` overrides app.config, then
+    migrations run and the model registry is loaded. background_jobs=False
+    leaves starting the background jobs to the caller (the production
+    server starts them after forking its workers).
+    """
+    if config:
+        app.config.update(config)
+    initialize_app()
+    if background_jobs:
+        start_background_jobs()
+    return app
+
 @app.route('/get_health_advice', methods=['POST'])
 @login_required
+@rate_limit.limit('health_advice')
 def get_health_advice():
     try:
         data = request.json
@@ -831,19 +1344,7 @@ def submit_prescription():
             # Get form data
             data = request.get_json()
             
-            conn = get_db_connection()
-            if not conn:
-                return jsonify({'success': False, 'message': 'Database connection error'}), 500
-                
-            cursor = conn.cursor()
-            
-            # Insert prescription data
-            cursor.execute('''
-                INSERT INTO medical_prescriptions 
-                (user_id, doctor_name, specialization, patient_name, patient_age, 
-                patient_gender, allergies, diagnosis, medications, instructions, follow_up)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
+            params = (
                 session['user_id'],
                 data.get('doctor_name', ''),
                 data.get('specialization', ''),
@@ -854,21 +1355,31 @@ def submit_prescription():
                 data.get('diagnosis', ''),
                 data.get('medications', ''),
                 data.get('instructions', ''),
-                data.get('follow_up', '')
-            ))
+                data.get('follow_up', ''),
+                now_ms()
+            )
             
-            conn.commit()
-            conn.close()
+            # Insert prescription data
+            def save(conn):
+                conn.execute('''
+                    INSERT INTO medical_prescriptions 
+                    (user_id, doctor_name, specialization, patient_name, patient_age, 
+                    patient_gender, allergies, diagnosis, medications, instructions, follow_up, created_at_ms)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', params)
+            
+            queued_write(save)
             
             return jsonify({'success': True, 'message': 'Prescription saved successfully'}), 200
+        except write_queue.WriteQueueFull:
+            return jsonify({'success': False, 'message': 'Server busy, please retry'}), 503, {'Retry-After': '1'}
         except Exception as e:
             return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
     
     return jsonify({'success': False, 'message': 'Invalid request method'}), 405
 
 if __name__ == "__main__":
-    check_navigation_routes()
-    initialize_app()
+    create_app()
     # app.run(debug=True, port=5000) 
     port = int(os.environ.get('PORT', 5000))
     app.run(debug=False, host='0.0.0.0', port=port)
\ No newline at end of file
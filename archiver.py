@@ -0,0 +1,405 @@
+import sqlite3
+import os
+import sys
+import json
+import time
+import zlib
+import heapq
+import threading
+
+from db_utils import now_ms
+from migrations import ARCHIVE_SCAN_INDEXES
+
+# Hot/cold archival of old time-series rows
+#
+# Rows older than ARCHIVE_AFTER_DAYS are moved out of the live database into
+# a sibling archive file (health.db -> health_archive.db, each shard gets its
+# own), which is ATTACHed only while archiving or when a history query's
+# window reaches back into it. Moves happen in small chunks, each one a
+# single transaction across both files, with a pause between chunks so the
+# live writer lock is only held briefly.
+#
+# Wide rows are stored as zlib-compressed JSON using a preset dictionary of
+# the table's column names, which is what most of a small JSON row is. The
+# column list each row was compressed with is kept in archive_dictionaries
+# (rows point at it by dict_id), so rows archived before a migration added
+# columns still decompress afterwards. Rows from before dict_id existed are
+# tried against the current columns and then shorter prefixes of them (added
+# columns only ever go at the end); zlib's dictionary checksum rejects the
+# wrong ones.
+#
+# Readers merge archived rows back in wherever an archived table is shown:
+# iter_health_history, query_archived_metric_range and, through
+# read_archived_rows / archived_summary, the timeline (timeline.py).
+#
+# Usage:
+#   python archiver.py [--days N]    archive once and exit
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get('HEALTH_ARCHIVE_AFTER_DAYS', '365'))
+ARCHIVE_CHUNK_SIZE = 500
+ARCHIVE_PAUSE_SECONDS = 0.05
+ARCHIVE_INTERVAL_SECONDS = 60 * 60
+
+# table -> epoch-ms column the age cutoff is applied to (indexed by migration 6)
+ARCHIVED_TABLES = ARCHIVE_SCAN_INDEXES
+
+ARCHIVE_STATE_TABLE = '''
+CREATE TABLE IF NOT EXISTS archive.archive_state (
+    table_name TEXT PRIMARY KEY,
+    newest_ts INTEGER NOT NULL,   -- newest archived timestamp, epoch ms
+    rows_archived INTEGER NOT NULL DEFAULT 0
+)
+'''
+
+ARCHIVE_DICTIONARIES_TABLE = '''
+CREATE TABLE IF NOT EXISTS archive.archive_dictionaries (
+    id INTEGER PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    columns TEXT NOT NULL,        -- JSON list, in the order the zdict was built from
+    UNIQUE (table_name, columns)
+)
+'''
+
+ARCHIVE_ROW_TABLE = '''
+CREATE TABLE IF NOT EXISTS archive.{table} (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    payload BLOB NOT NULL,
+    dict_id INTEGER               -- archive_dictionaries.id; NULL for rows archived before it existed
+)
+'''
+
+# health_data rows are already four small numbers; compressing them one by
+# one would only add overhead, so they are archived as-is.
+ARCHIVE_HEALTH_DATA_TABLE = '''
+CREATE TABLE IF NOT EXISTS archive.health_data (
+    user_id INTEGER NOT NULL,
+    metric_id INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (user_id, metric_id, ts)
+) WITHOUT ROWID
+'''
+
+
+def archive_path_for(db_path):
+    root, ext = os.path.splitext(db_path)
+    return f"{root}_archive{ext or '.db'}"
+
+
+def main_db_path(conn):
+    for row in conn.execute("PRAGMA database_list").fetchall():
+        if row[1] == 'main':
+            return row[2]
+    return None
+
+
+def _zdict(columns):
+    return json.dumps({column: None for column in columns}).encode()
+
+
+def compress_row(row, zdict):
+    compressor = zlib.compressobj(9, zdict=zdict)
+    return compressor.compress(json.dumps(row).encode()) + compressor.flush()
+
+
+def decompress_row(payload, zdict):
+    decompressor = zlib.decompressobj(zdict=zdict)
+    return json.loads(decompressor.decompress(payload) + decompressor.flush())
+
+
+def attach_archive(conn):
+    """ATTACH the archive file for this connection's main database as `archive`"""
+    attached = {row[1] for row in conn.execute("PRAGMA database_list").fetchall()}
+    if 'archive' not in attached:
+        conn.execute("ATTACH DATABASE ? AS archive", (archive_path_for(main_db_path(conn)),))
+        conn.execute(ARCHIVE_STATE_TABLE)
+        conn.execute(ARCHIVE_DICTIONARIES_TABLE)
+        for table in ARCHIVED_TABLES:
+            if table == 'health_data':
+                conn.execute(ARCHIVE_HEALTH_DATA_TABLE)
+            else:
+                conn.execute(ARCHIVE_ROW_TABLE.format(table=table))
+                columns = [row[1] for row in conn.execute(f"PRAGMA archive.table_info({table})").fetchall()]
+                if 'dict_id' not in columns:
+                    conn.execute(f"ALTER TABLE archive.{table} ADD COLUMN dict_id INTEGER")
+                conn.execute(f"CREATE INDEX IF NOT EXISTS archive.idx_{table}_user_ts ON {table} (user_id, ts)")
+        conn.commit()
+
+
+def archive_reaches(conn, table, start_ms):
+    """True when rows at or after start_ms may live in the archive for `table`"""
+    path = archive_path_for(main_db_path(conn))
+    if not os.path.exists(path):
+        return False
+    attach_archive(conn)
+    row = conn.execute("SELECT newest_ts FROM archive.archive_state WHERE table_name = ?", (table,)).fetchone()
+    return row is not None and row[0] >= start_ms
+
+
+def archived_counts(conn):
+    """Rows moved to the archive so far as {table: count}; {} when nothing is archived"""
+    path = archive_path_for(main_db_path(conn))
+    if not os.path.exists(path):
+        return {}
+    attach_archive(conn)
+    return {row[0]: row[1] for row in conn.execute(
+        "SELECT table_name, rows_archived FROM archive.archive_state").fetchall()}
+
+
+def _table_columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA main.table_info({table})").fetchall()]
+
+
+def dictionary_id(conn, table, columns):
+    """archive_dictionaries id for `table` compressed with `columns`, registering it if new"""
+    key = json.dumps(columns)
+    conn.execute("INSERT OR IGNORE INTO archive.archive_dictionaries (table_name, columns) VALUES (?, ?)",
+                 (table, key))
+    return conn.execute("SELECT id FROM archive.archive_dictionaries WHERE table_name = ? AND columns = ?",
+                        (table, key)).fetchone()[0]
+
+
+class RowDecoder:
+    """Decompresses one archived table's payloads with the dictionary each row was written with"""
+
+    def __init__(self, conn, table):
+        self.conn = conn
+        self.table = table
+        self.zdicts = {}
+        self.legacy = None
+
+    def _zdict_for(self, dict_id):
+        if dict_id not in self.zdicts:
+            row = self.conn.execute("SELECT columns FROM archive.archive_dictionaries WHERE id = ?",
+                                    (dict_id,)).fetchone()
+            if row is None:
+                raise ValueError(f"Unknown archive dictionary {dict_id} for {self.table}")
+            self.zdicts[dict_id] = _zdict(json.loads(row[0]))
+        return self.zdicts[dict_id]
+
+    def _decode_legacy(self, payload):
+        if self.legacy is not None:
+            try:
+                return decompress_row(payload, self.legacy)
+            except zlib.error:
+                pass
+        columns = _table_columns(self.conn, self.table)
+        for length in range(len(columns), 0, -1):
+            zdict = _zdict(columns[:length])
+            try:
+                row = decompress_row(payload, zdict)
+            except zlib.error:
+                continue
+            self.legacy = zdict
+            return row
+        raise ValueError(f"No dictionary decompresses this archived {self.table} row")
+
+    def decode(self, payload, dict_id):
+        if dict_id is None:
+            return self._decode_legacy(payload)
+        return decompress_row(payload, self._zdict_for(dict_id))
+
+
+# Helper function to move one table's old rows into the archive in chunks
+def archive_table(conn, table, cutoff_ms, chunk_size=ARCHIVE_CHUNK_SIZE, pause=ARCHIVE_PAUSE_SECONDS):
+    ts_column = ARCHIVED_TABLES[table]
+    columns = _table_columns(conn, table)
+    if ts_column not in columns:
+        return 0
+    zdict = _zdict(columns)
+    dict_id = None if table == 'health_data' else dictionary_id(conn, table, columns)
+    conn.commit()
+    moved = 0
+
+    while True:
+        rows = conn.execute(f'''
+            SELECT * FROM main.{table}
+            WHERE {ts_column} < ?
+            ORDER BY {ts_column}
+            LIMIT ?
+        ''', (cutoff_ms, chunk_size)).fetchall()
+        if not rows:
+            break
+
+        rows = [dict(zip(columns, row)) for row in rows]
+        newest = max(row[ts_column] for row in rows)
+        try:
+            if table == 'health_data':
+                conn.executemany('''
+                    INSERT OR IGNORE INTO archive.health_data (user_id, metric_id, ts, value)
+                    VALUES (?, ?, ?, ?)
+                ''', [(row['user_id'], row['metric_id'], row['ts'], row['value']) for row in rows])
+                conn.executemany('''
+                    DELETE FROM main.health_data WHERE user_id = ? AND metric_id = ? AND ts = ?
+                ''', [(row['user_id'], row['metric_id'], row['ts']) for row in rows])
+            else:
+                conn.executemany(f'''
+                    INSERT OR IGNORE INTO archive.{table} (id, user_id, ts, payload, dict_id)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', [(row['id'], row['user_id'], row[ts_column], compress_row(row, zdict), dict_id)
+                      for row in rows])
+                conn.executemany(f"DELETE FROM main.{table} WHERE id = ?", [(row['id'],) for row in rows])
+
+            conn.execute('''
+                INSERT INTO archive.archive_state (table_name, newest_ts, rows_archived)
+                VALUES (?, ?, ?)
+                ON CONFLICT(table_name) DO UPDATE SET
+                    newest_ts = MAX(newest_ts, excluded.newest_ts),
+                    rows_archived = rows_archived + excluded.rows_archived
+            ''', (table, newest, len(rows)))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        moved += len(rows)
+        if len(rows) < chunk_size:
+            break
+        time.sleep(pause)
+
+    if moved:
+        print(f"Archived {moved} {table} rows older than {cutoff_ms}")
+    return moved
+
+
+def archive_database(db_path, days=ARCHIVE_AFTER_DAYS):
+    """Archive every ARCHIVED_TABLES row older than `days` days in one database file"""
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA busy_timeout = 5000')
+    try:
+        attach_archive(conn)
+        cutoff_ms = now_ms() - days * 24 * 60 * 60 * 1000
+        return sum(archive_table(conn, table, cutoff_ms) for table in ARCHIVED_TABLES
+                   if conn.execute("SELECT 1 FROM main.sqlite_master WHERE type='table' AND name = ?", (table,)).fetchone())
+    finally:
+        conn.close()
+
+
+def archive_all(days=ARCHIVE_AFTER_DAYS):
+    import sharding
+    paths = [sharding.central_db_path]
+    if sharding.sharding_enabled():
+        paths += [sharding.shard_path(index) for index in range(sharding.SHARD_COUNT)]
+    return sum(archive_database(path, days) for path in paths if os.path.exists(path))
+
+
+_archiver_thread = None
+
+
+def start_background_archiver(days=ARCHIVE_AFTER_DAYS, interval=ARCHIVE_INTERVAL_SECONDS):
+    """Run archive_all every `interval` seconds on a daemon thread (no-op when days <= 0)"""
+    global _archiver_thread
+    if days <= 0 or (_archiver_thread and _archiver_thread.is_alive()):
+        return _archiver_thread
+
+    def run():
+        while True:
+            try:
+                archive_all(days)
+            except Exception as e:
+                print(f"Archiver error: {str(e)}")
+            time.sleep(interval)
+
+    _archiver_thread = threading.Thread(target=run, name='health-archiver', daemon=True)
+    _archiver_thread.start()
+    return _archiver_thread
+
+
+# Helper function to read health_monitoring history across live and archived rows
+def iter_health_history(conn, user_id, start_ms=None, chunk_size=500):
+    """
+    Yield a user's health_monitoring rows as dicts, newest first
+
+    Live rows are read with fetchmany; archived rows are only read when the
+    window reaches the archive, and the two ordered streams are merged.
+    """
+    params = (user_id,) if start_ms is None else (user_id, start_ms)
+    where = "user_id = ?" if start_ms is None else "user_id = ? AND created_at_ms >= ?"
+
+    def live():
+        cursor = conn.execute(f"SELECT * FROM health_monitoring WHERE {where} ORDER BY created_at_ms DESC", params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                if row is not None:
+                    yield dict(row)
+
+    if not archive_reaches(conn, 'health_monitoring', start_ms or 0):
+        yield from live()
+        return
+
+    decoder = RowDecoder(conn, 'health_monitoring')
+    archive_where = where.replace('created_at_ms', 'ts')
+
+    def archived():
+        cursor = conn.execute(f'''
+            SELECT payload, dict_id FROM archive.health_monitoring
+            WHERE {archive_where} ORDER BY ts DESC
+        ''', params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                if row is not None:
+                    yield decoder.decode(row[0], row[1])
+
+    yield from heapq.merge(live(), archived(), key=lambda item: item.get('created_at_ms') or 0, reverse=True)
+
+
+def read_archived_rows(conn, table, user_id, limit, before=None):
+    """
+    A user's archived `table` rows as dicts, newest first by (ts, id), at
+    most `limit` of them; with before=(ts, id) only rows strictly older.
+    Every dict has 'ts' set. [] when nothing of the table is archived.
+    """
+    if not archive_reaches(conn, table, 0):
+        return []
+    sql = f"SELECT id, ts, payload, dict_id FROM archive.{table} WHERE user_id = ?"
+    params = [user_id]
+    if before is not None:
+        sql += " AND (ts, id) < (?, ?)"
+        params += list(before)
+    sql += " ORDER BY ts DESC, id DESC LIMIT ?"
+    params.append(limit)
+
+    decoder = RowDecoder(conn, table)
+    rows = []
+    for row in conn.execute(sql, params).fetchall():
+        item = decoder.decode(row[2], row[3])
+        item['id'], item['ts'] = row[0], row[1]
+        rows.append(item)
+    return rows
+
+
+def archived_summary(conn, table, user_id):
+    """(count, newest ts) of a user's archived `table` rows; (0, None) when there are none"""
+    if not archive_reaches(conn, table, 0):
+        return 0, None
+    row = conn.execute(f"SELECT COUNT(*), MAX(ts) FROM archive.{table} WHERE user_id = ?", (user_id,)).fetchone()
+    return row[0], row[1]
+
+
+def query_archived_metric_range(conn, user_id, metric_id, start_ms, end_ms, limit=10000):
+    """Archived counterpart of db_utils.query_metric_range; [] when the window is all live"""
+    if not archive_reaches(conn, 'health_data', start_ms):
+        return []
+    rows = conn.execute('''
+        SELECT ts, value FROM archive.health_data
+        WHERE user_id = ? AND metric_id = ? AND ts BETWEEN ? AND ?
+        ORDER BY ts
+        LIMIT ?
+    ''', (user_id, metric_id, start_ms, end_ms, limit)).fetchall()
+    return [(row[0], row[1]) for row in rows]
+
+
+if __name__ == "__main__":
+    days = ARCHIVE_AFTER_DAYS
+    if '--days' in sys.argv:
+        days = int(sys.argv[sys.argv.index('--days') + 1])
+    total = archive_all(days)
+    print(f"Archived {total} rows")
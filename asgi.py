@@ -0,0 +1,418 @@
+import asyncio
+import io
+import json
+import math
+import multiprocessing
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from itsdangerous import BadSignature
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_cookie, parse_etags
+
+import api_core
+import app as web
+import compression
+import live_events
+import model_registry
+import sharding
+import write_queue
+import rate_limit
+
+# Async (ASGI) entry point
+#
+# The read APIs and /predict are served natively on an asyncio event loop: a
+# request waiting on the database or the model is a suspended coroutine, not
+# a blocked worker, so one process can hold thousands of requests in flight.
+# The live readings stream (/api/health-monitoring/stream) is native too, so
+# an open but idle health monitor tab does not tie up a thread.
+#
+# Database work runs on DB_THREADS threads. Each thread keeps its own
+# connections (central, and one per shard) open for its whole life, so no
+# request pays for connect + PRAGMAs, and a busy_timeout wait only parks one
+# of those threads. Predictions run in a separate pool of INFERENCE_WORKERS
+# processes, so CPU-bound inference never holds a database thread, the event
+# loop or the GIL of the serving process.
+#
+# The native handlers call the same route functions as the Flask routes
+# (api_core.py); every other route (pages, writes, history exports, the admin
+# JSON) is the Flask app itself, run through a WSGI bridge on WSGI_THREADS
+# threads, so both entry points share one implementation.
+#
+# Settings (environment): ASGI_DB_THREADS, ASGI_INFERENCE_WORKERS,
+# ASGI_WSGI_THREADS, ASGI_MAX_BODY_BYTES
+#
+# Usage:
+#   uvicorn asgi:app --host 0.0.0.0 --port 8000 [--workers N]
+#   python benchmark_async_api.py --help     latency under contention, sync vs async
+
+DB_THREADS = int(os.environ.get('ASGI_DB_THREADS', '16'))
+INFERENCE_WORKERS = int(os.environ.get('ASGI_INFERENCE_WORKERS', str(min(4, os.cpu_count() or 1))))
+WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', '32'))
+MAX_BODY_BYTES = int(os.environ.get('ASGI_MAX_BODY_BYTES', str(32 * 1024 * 1024)))
+
+flask_app = web.create_app(background_jobs=False)
+
+_END = object()
+
+
+class DatabaseExecutor:
+    """Thread pool whose threads each keep their own open connections"""
+
+    def __init__(self, threads=DB_THREADS):
+        self.pool = ThreadPoolExecutor(threads, thread_name_prefix='asgi-db')
+        self.local = threading.local()
+
+    def _connection(self, user_id):
+        connections = self.local.__dict__.setdefault('connections', {})
+        shard = sharding.shard_for_user(user_id) if sharding.sharding_enabled() and user_id is not None else None
+        conn = connections.get(shard)
+        if conn is None:
+            if shard is None:
+                conn = sqlite3.connect(sharding.central_db_path)
+                conn.row_factory = sqlite3.Row
+                conn.execute('PRAGMA foreign_keys = ON')
+                conn.execute('PRAGMA busy_timeout = 5000')
+            else:
+                conn = sharding.connect_shard(shard)
+            connections[shard] = conn
+        return conn
+
+    def _call(self, fn, user_id, args):
+        conn = self._connection(user_id)
+        try:
+            return fn(conn, *args)
+        finally:
+            # Never keep a read snapshot (or a failed write) open between requests
+            conn.rollback()
+
+    async def run(self, fn, user_id, *args):
+        """fn(conn, *args) on a database thread, with the connection for `user_id`'s data"""
+        return await asyncio.get_running_loop().run_in_executor(self.pool, self._call, fn, user_id, args)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
+
+
+class ApiRequest:
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = MultiDict(parse_qsl(scope.get('query_string', b'').decode('latin-1'), keep_blank_values=True))
+        self.headers = {}
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').lower()
+            value = value.decode('latin-1')
+            self.headers[name] = f"{self.headers[name]}, {value}" if name in self.headers else value
+        self.body = body
+        self.session = {}
+
+    @property
+    def shard_user(self):
+        """User whose shard holds the data; admins read central, like get_db_connection"""
+        return None if self.session.get('is_admin', False) else self.session.get('user_id')
+
+    def json(self):
+        try:
+            return json.loads(self.body or b'null')
+        except ValueError:
+            return None
+
+
+def read_session(request):
+    """The Flask session from the request's cookie; empty when absent, tampered with or expired"""
+    value = parse_cookie(request.headers.get('cookie', '')).get(flask_app.config['SESSION_COOKIE_NAME'])
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    if not value or serializer is None:
+        return {}
+    try:
+        return serializer.loads(value, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+
+# Helper function to turn a payload into a (compressed) JSON response
+def json_reply(request, status, payload, etag=None):
+    """(status, headers, body) of a JSON response, serialized like Flask's jsonify"""
+    # CORS(app) allows every origin on the Flask routes
+    headers = [(b'content-type', b'application/json'), (b'vary', b'Cookie, Accept-Encoding'),
+               (b'access-control-allow-origin', b'*')]
+    if etag is not None:
+        headers += [(b'etag', f'W/"{etag}"'.encode()), (b'cache-control', b'private, no-cache')]
+        if parse_etags(request.headers.get('if-none-match')).contains_weak(etag):
+            return 304, headers, b''
+
+    body = f"{flask_app.json.dumps(payload, separators=(',', ':'))}\n".encode()
+    encoding = compression.negotiate_encoding(request.headers.get('accept-encoding'))
+    if encoding and len(body) >= compression.COMPRESS_MIN_SIZE:
+        body = compression.compress(body, encoding)
+        headers.append((b'content-encoding', encoding.encode()))
+    return status, headers + [(b'content-length', str(len(body)).encode())], body
+
+
+async def health_history(request, user_id):
+    start_ms = api_core.health_history_start(request.args)
+    # Same tag as the Flask route, so either entry point can revalidate it
+    if_none_match = parse_etags(request.headers.get('if-none-match'))
+    result = await db.run(api_core.health_history, request.shard_user, user_id, start_ms, if_none_match)
+    return json_reply(request, *result)
+
+
+async def metric_history(request, user_id, metric):
+    start_ms, end_ms, limit = api_core.metric_range(request.args)
+    result = await db.run(api_core.metric_history, request.shard_user, user_id, metric, start_ms, end_ms, limit)
+    return json_reply(request, *result)
+
+
+async def wearable_samples(request, user_id, metric):
+    start_ms, end_ms = api_core.wearable_range(request.args)
+    result = await db.run(api_core.wearable_samples, request.shard_user, user_id, metric, start_ms, end_ms)
+    return json_reply(request, *result)
+
+
+async def search_records(request, user_id):
+    query, sources, limit = api_core.search_params(request.args)
+    result = await db.run(api_core.search_records, request.shard_user, user_id, query, sources, limit)
+    return json_reply(request, *result)
+
+
+async def predict_disease(request, user_id):
+    wait = rate_limit.check(user_id, 'predict')
+    if wait:
+        status, headers, body = json_reply(request, 429, {'success': False, 'error': 'Too many requests, please slow down'})
+        return status, headers + [(b'retry-after', str(math.ceil(wait)).encode())], body
+    symptoms = api_core.prediction_symptoms(request.json())
+
+    loop = asyncio.get_running_loop()
+    prediction = await loop.run_in_executor(inference_pool, model_registry.predict, symptoms)
+
+    try:
+        # Group-committed with the Flask routes' writes; never blocks the loop on a full queue
+        save = api_core.prediction_writer(user_id, symptoms, prediction)
+        await asyncio.wrap_future(write_queue.submit(save, request.shard_user, timeout=0))
+    except Exception as e:
+        print(f"Failed to save prediction: {str(e)}")
+
+    return json_reply(request, 200, api_core.prediction_payload(symptoms, prediction))
+
+
+async def health_monitoring_stream(request, user_id, receive, send):
+    """Live readings (see live_events.py); an idle stream is one suspended coroutine"""
+    loop = asyncio.get_running_loop()
+    stream = asyncio.current_task()
+    last_id = live_events.parse_last_event_id(request.headers.get('last-event-id'))
+    # Subscribe before reading the catch-up so nothing saved in between is missed
+    subscription = live_events.subscribe(live_events.AsyncSubscription(user_id, loop))
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        stream.cancel()
+
+    watcher = loop.create_task(watch_disconnect())
+    try:
+        data, last_id = await db.run(live_events.catch_up, request.shard_user, user_id, last_id)
+        headers = [(name.lower().encode(), value.encode()) for name, value in live_events.STREAM_HEADERS]
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+        data = f"retry: {live_events.RETRY_MS}\n\n".encode() + data
+        while True:
+            if data:
+                await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+            message = await subscription.get()
+            if message is None:
+                data = live_events.HEARTBEAT
+            else:
+                data, last_id = live_events.encode_message(message, last_id)
+            if subscription.take_lost():
+                more, last_id = await db.run(live_events.catch_up, request.shard_user, user_id, last_id)
+                data += more
+    except asyncio.CancelledError:
+        # The client went away
+        pass
+    finally:
+        live_events.unsubscribe(subscription)
+        watcher.cancel()
+
+
+# (method, path pattern, handler); every handler needs a logged-in user
+NATIVE_ROUTES = [
+    ('GET', re.compile(r'^/api/health-history$'), health_history),
+    ('GET', re.compile(r'^/api/health-data/(?P<metric>[^/]+)$'), metric_history),
+    ('GET', re.compile(r'^/api/wearables/(?P<metric>[^/]+)$'), wearable_samples),
+    ('GET', re.compile(r'^/api/search$'), search_records),
+    ('POST', re.compile(r'^/predict$'), predict_disease),
+]
+
+# Handlers that send their own (streamed) response
+STREAM_ROUTES = [
+    ('GET', re.compile(r'^/api/health-monitoring/stream$'), health_monitoring_stream),
+]
+
+
+def match_route(method, path):
+    """(handler, path params, streams) for a native route, else (None, None, False)"""
+    for routes, streams in ((NATIVE_ROUTES, False), (STREAM_ROUTES, True)):
+        for route_method, pattern, handler in routes:
+            match = pattern.match(path)
+            if match and method == route_method:
+                return handler, match.groupdict(), streams
+    return None, None, False
+
+
+def wsgi_environ(scope, body):
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    server = scope.get('server') or ('localhost', 80)
+    environ['SERVER_NAME'], environ['SERVER_PORT'] = server[0], str(server[1] or 80)
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+# Helper function to serve one request with the Flask app on a bridge thread
+async def serve_wsgi(scope, body, send, received_at):
+    loop = asyncio.get_running_loop()
+    environ = wsgi_environ(scope, body)
+    # Lets the Flask app's load shedding count the wait for a bridge thread
+    environ[rate_limit.REQUEST_START_KEY] = received_at
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        return lambda data: response.setdefault('written', []).append(data)
+
+    def begin():
+        result = flask_app(environ, start_response)
+        chunks = iter(result)
+        # Streamed responses may only call start_response on their first chunk
+        first = next(chunks, _END)
+        return result, chunks, first
+
+    result, chunks, chunk = await loop.run_in_executor(wsgi_pool, begin)
+    try:
+        await send({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+        for data in response.get('written', []):
+            await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+        while chunk is not _END:
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            chunk = await loop.run_in_executor(wsgi_pool, next, chunks, _END)
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(result, 'close'):
+            await loop.run_in_executor(wsgi_pool, result.close)
+
+
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY_BYTES:
+            return False
+        if not message.get('more_body'):
+            return bytes(body)
+
+
+async def send_reply(send, status, headers, body):
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def lifespan(receive, send):
+    global db, inference_pool, wsgi_pool
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            db = DatabaseExecutor()
+            wsgi_pool = ThreadPoolExecutor(WSGI_THREADS, thread_name_prefix='asgi-wsgi')
+            inference_pool = ProcessPoolExecutor(INFERENCE_WORKERS, mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=model_registry.preload)
+            # Start the inference workers (and load the model in each) before taking traffic
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(loop.run_in_executor(inference_pool, os.getpid) for _ in range(INFERENCE_WORKERS)))
+            web.start_background_jobs(lock_path=web.BACKGROUND_JOBS_LOCK_PATH)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            inference_pool.shutdown(wait=True, cancel_futures=True)
+            wsgi_pool.shutdown(wait=False)
+            db.shutdown()
+            write_queue.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    received_at = time.time()
+    request_start = next((value.decode('latin-1') for name, value in scope['headers'] if name == b'x-request-start'), None)
+    if rate_limit.should_shed({'HTTP_X_REQUEST_START': request_start}):
+        headers = [(name.lower().encode(), value.encode()) for name, value in rate_limit.SHED_HEADERS]
+        return await send_reply(send, 503, headers, rate_limit.SHED_BODY)
+
+    body = await read_body(receive)
+    if body is None:
+        return
+    if body is False:
+        return await send_reply(send, 413, [(b'content-type', b'application/json')],
+                                b'{"error": "Request body too large", "success": false}\n')
+
+    handler, params, streams = match_route(scope['method'], scope['path'])
+    if handler is None:
+        return await serve_wsgi(scope, body, send, received_at)
+
+    request = ApiRequest(scope, body)
+    request.session = read_session(request)
+    user_id = request.session.get('user_id')
+    if user_id is None:
+        # Same as login_required
+        return await send_reply(send, 302, [(b'location', b'/login'), (b'content-length', b'0')], b'')
+    if streams:
+        return await handler(request, user_id, receive, send, **params)
+    try:
+        status, headers, reply = await handler(request, user_id, **params)
+    except api_core.ApiError as e:
+        status, headers, reply = json_reply(request, *e.result)
+    except sqlite3.Error as e:
+        print(f"Database error: {str(e)}")
+        status, headers, reply = json_reply(request, 500, {'success': False, 'error': f'Database error: {str(e)}'})
+    except Exception as e:
+        print(f"Error handling {scope['path']}: {str(e)}")
+        print(f"Error trace: {traceback.format_exc()}")
+        status, headers, reply = json_reply(request, 500, {'success': False, 'error': str(e)})
+    await send_reply(send, status, headers, reply)
+
+
+db = inference_pool = wsgi_pool = None
@@ -0,0 +1,202 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+# Latency under contention: Flask (sync) vs. asgi.py (async) JSON APIs
+#
+# Logs in to each server, then keeps --concurrency requests in flight for
+# --seconds against a mix of health-history, metric range, search and
+# /predict calls, and prints throughput and p50/p95/p99 latency per endpoint.
+# Meanwhile a writer thread holds the database write lock for --lock-ms every
+# --lock-interval-ms (BEGIN IMMEDIATE on --db), the way a long import or
+# archiving batch would, so requests that write queue behind it.
+#
+# Start both servers on the same database first, e.g.
+#   gunicorn -c gunicorn.conf.py wsgi:app              (sync, port 8000)
+#   uvicorn asgi:app --port 8001                       (async)
+#
+# Usage: python benchmark_async_api.py --sync-url http://127.0.0.1:8000 --async-url http://127.0.0.1:8001
+#            --username USER --password PASS [--concurrency 200] [--seconds 20] [--lock-ms 200]
+
+ENDPOINTS = [
+    # (label, method, path, weight)
+    ('health-history', 'GET', '/api/health-history?days=30', 4),
+    ('metric-range', 'GET', '/api/health-data/heart_rate?days=30', 3),
+    ('search', 'GET', '/api/search?' + urlencode({'q': 'metf'}), 2),
+    ('predict', 'POST', '/predict', 1),
+]
+
+PREDICT_SYMPTOMS = ['itching', 'skin_rash', 'chills', 'high_fever', 'headache', 'fatigue', 'vomiting',
+                    'stomach_pain', 'continuous_sneezing', 'mild_fever']
+
+
+class Connection:
+    """Minimal keep-alive HTTP/1.1 client on asyncio streams"""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=b'', headers=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}", f"Content-Length: {len(body)}"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        response_headers = {}
+        while True:
+            line = (await self.reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            response_headers.setdefault(name.strip().lower(), []).append(value.strip())
+
+        if 'content-length' in response_headers:
+            data = await self.reader.readexactly(int(response_headers['content-length'][0]))
+        elif response_headers.get('transfer-encoding', [''])[0].lower() == 'chunked':
+            data = b''
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                data += await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        else:
+            data = await self.reader.read()
+            self.close()
+
+        if response_headers.get('connection', [''])[0].lower() == 'close':
+            self.close()
+        return status, response_headers, data
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def login(url, username, password):
+    """Session cookie header value for `username`"""
+    parts = urlsplit(url)
+    conn = Connection(parts.hostname, parts.port or 80)
+    body = urlencode({'username': username, 'password': password}).encode()
+    status, headers, _ = await conn.request('POST', '/login', body,
+                                            {'Content-Type': 'application/x-www-form-urlencoded'})
+    conn.close()
+    cookies = [value.split(';')[0] for value in headers.get('set-cookie', [])]
+    if status != 302 or not any(cookie.startswith('session=') for cookie in cookies):
+        raise RuntimeError(f"Login to {url} failed (HTTP {status})")
+    return '; '.join(cookies)
+
+
+async def run_load(url, cookie, concurrency, seconds, seed=42):
+    """{label: [latency seconds]} and error count for `seconds` of load at `concurrency`"""
+    parts = urlsplit(url)
+    rng = random.Random(seed)
+    weighted = [endpoint for endpoint in ENDPOINTS for _ in range(endpoint[3])]
+    latencies = {label: [] for label, _, _, _ in ENDPOINTS}
+    errors = 0
+    deadline = time.perf_counter() + seconds
+
+    async def worker():
+        nonlocal errors
+        conn = Connection(parts.hostname, parts.port or 80)
+        while time.perf_counter() < deadline:
+            label, method, path, _ = rng.choice(weighted)
+            headers = {'Cookie': cookie}
+            body = b''
+            if method == 'POST':
+                body = json.dumps({symptom: 1 for symptom in rng.sample(PREDICT_SYMPTOMS, 3)}).encode()
+                headers['Content-Type'] = 'application/json'
+            started = time.perf_counter()
+            try:
+                status, _, _ = await conn.request(method, path, body, headers)
+            except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+                conn.close()
+                errors += 1
+                continue
+            if status >= 400:
+                errors += 1
+                continue
+            latencies[label].append(time.perf_counter() - started)
+        conn.close()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors
+
+
+def hold_write_lock(db_path, lock_ms, interval_ms, stop):
+    """Take the database write lock for lock_ms every interval_ms until `stop` is set"""
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    while not stop.wait(interval_ms / 1000):
+        conn.execute('BEGIN IMMEDIATE')
+        time.sleep(lock_ms / 1000)
+        conn.execute('COMMIT')
+    conn.close()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def report(label, latencies, errors, seconds):
+    total = sum(len(values) for values in latencies.values())
+    print(f"\n{label}: {total:,} requests in {seconds}s ({total / seconds:,.0f} req/s), {errors} errors")
+    print(f"  {'endpoint':<16} {'count':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for endpoint, values in list(latencies.items()) + [('all', [v for vs in latencies.values() for v in vs])]:
+        values = sorted(values)
+        print(f"  {endpoint:<16} {len(values):>8,} {percentile(values, 0.50) * 1000:>9.1f} "
+              f"{percentile(values, 0.95) * 1000:>9.1f} {percentile(values, 0.99) * 1000:>9.1f}")
+    return total / seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Latency under contention: sync (WSGI) vs. async (ASGI) APIs')
+    parser.add_argument('--sync-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--async-url', default='http://127.0.0.1:8001')
+    parser.add_argument('--username', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--seconds', type=int, default=20)
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'health.db'),
+                        help="database both servers use (for the lock-holding writer)")
+    parser.add_argument('--lock-ms', type=int, default=200, help="how long the writer holds the lock (0: no writer)")
+    parser.add_argument('--lock-interval-ms', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    print(f"{args.concurrency} requests in flight for {args.seconds}s per server; "
+          f"writer holds the lock {args.lock_ms} ms every {args.lock_interval_ms} ms")
+    throughput = {}
+    for label, url in (('sync', args.sync_url), ('async', args.async_url)):
+        cookie = asyncio.run(login(url, args.username, args.password))
+        stop = threading.Event()
+        writer = None
+        if args.lock_ms > 0:
+            writer = threading.Thread(target=hold_write_lock, daemon=True,
+                                      args=(args.db, args.lock_ms, args.lock_interval_ms, stop))
+            writer.start()
+        try:
+            latencies, errors = asyncio.run(run_load(url, cookie, args.concurrency, args.seconds))
+        finally:
+            stop.set()
+            if writer is not None:
+                writer.join()
+        throughput[label] = report(f"{label} ({url})", latencies, errors, args.seconds)
+
+    if throughput['sync']:
+        print(f"\nThroughput async/sync: {throughput['async'] / throughput['sync']:.2f}x")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
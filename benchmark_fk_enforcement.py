@@ -0,0 +1,115 @@
+import sqlite3
+import os
+import sys
+import time
+import random
+import tempfile
+import argparse
+
+# Insert throughput benchmark: verify_user_id_* triggers vs. plain foreign keys
+#
+# Loads the same rows into health_monitoring twice, once with the old
+# BEFORE INSERT trigger on top of the FOREIGN KEY constraint and once with
+# only the (indexed) foreign key, and prints rows/second for each.
+#
+# Usage: python benchmark_fk_enforcement.py [--rows 1000000] [--users 1000]
+
+USERS_TABLE = '''
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL
+)
+'''
+
+HEALTH_MONITORING_TABLE = '''
+CREATE TABLE health_monitoring (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    heart_rate INTEGER,
+    bp_systolic INTEGER,
+    bp_diastolic INTEGER,
+    oxygen_level INTEGER,
+    created_at_ms INTEGER,
+    FOREIGN KEY (user_id) REFERENCES users(id){on_delete}
+)
+'''
+
+VERIFY_TRIGGER = '''
+CREATE TRIGGER verify_user_id_health_monitoring
+BEFORE INSERT ON health_monitoring
+FOR EACH ROW
+BEGIN
+    SELECT CASE
+        WHEN NEW.user_id NOT IN (SELECT id FROM users)
+        THEN RAISE(ABORT, 'Invalid user_id in health_monitoring')
+    END;
+END;
+'''
+
+
+def build_database(path, with_trigger, user_count):
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.execute(USERS_TABLE)
+    conn.execute(HEALTH_MONITORING_TABLE.format(on_delete='' if with_trigger else ' ON DELETE CASCADE'))
+    conn.execute('CREATE INDEX idx_health_monitoring_user_created_at_ms ON health_monitoring (user_id, created_at_ms)')
+    if with_trigger:
+        conn.execute(VERIFY_TRIGGER)
+    conn.executemany("INSERT INTO users (username) VALUES (?)",
+                     [(f"user_{i}",) for i in range(user_count)])
+    conn.commit()
+    return conn
+
+
+def generate_rows(count, user_count, seed=42):
+    rng = random.Random(seed)
+    base_ms = int(time.time() * 1000) - count * 1000
+    for i in range(count):
+        yield (rng.randint(1, user_count), rng.randint(55, 110), rng.randint(100, 150),
+               rng.randint(60, 100), rng.randint(92, 100), base_ms + i * 1000)
+
+
+def run(label, with_trigger, rows, users, batch_size):
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = build_database(os.path.join(tmp, 'bench.db'), with_trigger, users)
+        pending = []
+        started = time.perf_counter()
+        for row in generate_rows(rows, users):
+            pending.append(row)
+            if len(pending) >= batch_size:
+                conn.executemany('''
+                    INSERT INTO health_monitoring
+                    (user_id, heart_rate, bp_systolic, bp_diastolic, oxygen_level, created_at_ms)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', pending)
+                conn.commit()
+                pending = []
+        if pending:
+            conn.executemany('''
+                INSERT INTO health_monitoring
+                (user_id, heart_rate, bp_systolic, bp_diastolic, oxygen_level, created_at_ms)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', pending)
+            conn.commit()
+        elapsed = time.perf_counter() - started
+        conn.close()
+
+    print(f"{label:<28} {rows:>10,} rows in {elapsed:7.2f}s  ({rows / elapsed:>10,.0f} rows/s)")
+    return elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Insert throughput: verify_user_id triggers vs. foreign keys')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    print(f"SQLite {sqlite3.sqlite_version}, {args.users} users, batches of {args.batch_size}")
+    before = run('trigger + foreign key', True, args.rows, args.users, args.batch_size)
+    after = run('foreign key only', False, args.rows, args.users, args.batch_size)
+    print(f"Speed-up: {before / after:.2f}x")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+import gzip
+import threading
+import zlib
+from collections import OrderedDict
+
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Response compression for the Flask apps
+#
+# WSGI middleware that negotiates brotli (when the brotli package is
+# installed) or gzip from Accept-Encoding and compresses text responses
+# (HTML, JSON, CSS, JavaScript, CSV, ...) of at least COMPRESS_MIN_SIZE bytes.
+#
+# Responses with a Content-Length are compressed in one go. Streamed
+# responses (generators without a length) are compressed chunk by chunk and
+# flushed after every chunk, so clients still receive rows as they are
+# produced. Compressed bodies of cacheable responses (public, with an ETag or
+# Last-Modified, e.g. static files) are kept in a bounded LRU cache keyed on
+# the URL, encoding and validator, so hot payloads are not recompressed.
+#
+# Usage:
+#   app.wsgi_app = CompressionMiddleware(app.wsgi_app)
+
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSION_CACHE_BYTES = 16 * 1024 * 1024
+
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/x-ndjson', 'application/javascript', 'application/xml',
+    'image/svg+xml',
+}
+
+# Small messages that must reach the client as soon as they are written
+UNCOMPRESSED_TYPES = {'text/event-stream'}
+
+# Statuses whose body must not be touched
+_PASSTHROUGH_STATUSES = {'204', '206', '304'}
+
+
+def is_compressible(content_type):
+    mimetype = (content_type or '').split(';')[0].strip().lower()
+    if mimetype in UNCOMPRESSED_TYPES:
+        return False
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+
+
+def negotiate_encoding(accept_encoding):
+    """'br', 'gzip' or None for an Accept-Encoding header value"""
+    accepted = parse_accept_header(accept_encoding)
+    if brotli is not None and accepted.quality('br') > 0:
+        return 'br'
+    if accepted.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _compressor(encoding):
+    """(compress, flush, finish) functions of an incremental compressor"""
+    if encoding == 'br':
+        stream = brotli.Compressor(quality=BROTLI_QUALITY)
+        return stream.process, stream.flush, stream.finish
+    stream = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return stream.compress, lambda: stream.flush(zlib.Z_SYNC_FLUSH), stream.flush
+
+
+class CompressedCache:
+    """LRU of compressed bodies bounded by their total size"""
+
+    def __init__(self, max_bytes=COMPRESSION_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes // 8:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, min_size=COMPRESS_MIN_SIZE, cache=None):
+        self.app = app
+        self.min_size = min_size
+        self.cache = cache if cache is not None else CompressedCache()
+
+    def __call__(self, environ, start_response):
+        encoding = None
+        if environ.get('REQUEST_METHOD') != 'HEAD':
+            encoding = negotiate_encoding(environ.get('HTTP_ACCEPT_ENCODING'))
+        response = {}
+
+        def capture(status, headers, exc_info=None):
+            if exc_info is not None and response.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response.update(status=status, headers=list(headers), exc_info=exc_info)
+            return written.append
+
+        written = []
+        app_iter = self.app(environ, capture)
+        status, headers = response['status'], response['headers']
+        header = {name.lower(): value for name, value in headers}
+
+        compressible = (is_compressible(header.get('content-type'))
+                        and status[:3] not in _PASSTHROUGH_STATUSES
+                        and 'content-encoding' not in header)
+        if compressible:
+            headers = _add_vary(headers)
+        length = header.get('content-length')
+        if not compressible or encoding is None or (length is not None and int(length) < self.min_size):
+            response['sent'] = True
+            write = start_response(status, headers, response['exc_info'])
+            # Hand over anything the app wrote with write() before returning
+            for data in written:
+                write(data)
+            return app_iter
+
+        if length is not None:
+            return self._compress_whole(environ, start_response, response, headers, header, written,
+                                        app_iter, encoding)
+        return self._compress_stream(start_response, response, headers, written, app_iter, encoding)
+
+    # Helper function to compress a response whose length is known
+    def _compress_whole(self, environ, start_response, response, headers, header, written, app_iter, encoding):
+        key = _cache_key(environ, header, encoding)
+        body = self.cache.get(key) if key else None
+        if body is None:
+            try:
+                data = b''.join(written) + b''.join(app_iter)
+            finally:
+                _close(app_iter)
+            body = compress(data, encoding)
+            if key:
+                self.cache.put(key, body)
+        else:
+            _close(app_iter)
+
+        response['sent'] = True
+        start_response(response['status'], _encoded_headers(headers, encoding, len(body)), response['exc_info'])
+        return [body]
+
+    def _compress_stream(self, start_response, response, headers, written, app_iter, encoding):
+        min_size = self.min_size
+        chunks = _chain(written, app_iter)
+
+        def generate():
+            try:
+                # Hold back output until it is worth compressing
+                pending, size = [], 0
+                for chunk in chunks:
+                    pending.append(chunk)
+                    size += len(chunk)
+                    if size >= min_size:
+                        break
+                else:
+                    body = b''.join(pending)
+                    response['sent'] = True
+                    start_response(response['status'], headers + [('Content-Length', str(len(body)))],
+                                   response['exc_info'])
+                    yield body
+                    return
+
+                response['sent'] = True
+                start_response(response['status'], _encoded_headers(headers, encoding), response['exc_info'])
+                process, flush, finish = _compressor(encoding)
+                yield process(b''.join(pending)) + flush()
+                for chunk in chunks:
+                    if chunk:
+                        yield process(chunk) + flush()
+                yield finish()
+            finally:
+                _close(app_iter)
+
+        return generate()
+
+
+def _chain(written, app_iter):
+    yield from written
+    yield from app_iter
+
+
+def _close(app_iter):
+    if hasattr(app_iter, 'close'):
+        app_iter.close()
+
+
+def _add_vary(headers):
+    for index, (name, value) in enumerate(headers):
+        if name.lower() == 'vary':
+            if 'accept-encoding' not in value.lower():
+                headers[index] = (name, f"{value}, Accept-Encoding")
+            return headers
+    return headers + [('Vary', 'Accept-Encoding')]
+
+
+def _encoded_headers(headers, encoding, length=None):
+    result = []
+    for name, value in headers:
+        lowered = name.lower()
+        if lowered == 'content-length':
+            continue
+        if lowered == 'etag' and not value.startswith('W/'):
+            # The compressed body is a different representation of the same resource
+            value = f"W/{value}"
+        result.append((name, value))
+    result.append(('Content-Encoding', encoding))
+    if length is not None:
+        result.append(('Content-Length', str(length)))
+    return result
+
+
+def _cache_key(environ, header, encoding):
+    """Cache key for a public response with a validator, else None"""
+    cache_control = header.get('cache-control', '').lower()
+    if 'private' in cache_control or 'no-store' in cache_control or 'set-cookie' in header:
+        return None
+    validator = header.get('etag') or header.get('last-modified')
+    if not validator:
+        return None
+    return (environ.get('PATH_INFO'), environ.get('QUERY_STRING'), encoding, validator, header.get('content-length'))
@@ -0,0 +1,169 @@
+import sqlite3
+import sys
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+
+import sharding
+import archiver
+from migrations import ROW_COUNTERS, PURGE_AWARE_COUNTERS, seed_row_counter
+
+# Dashboard counters maintained incrementally by triggers (migration 9)
+#
+# stats_counters holds one row per ROW_COUNTERS (and, from migration 16,
+# PURGE_AWARE_COUNTERS) name and daily_activity one row per (UTC day, name)
+# counting inserts, so the admin dashboard reads a handful of rows instead of
+# scanning tables. With sharding enabled every
+# shard keeps counters for the rows it holds and the totals are summed.
+#
+# reconcile() compares each counter with a real COUNT(*) and repairs drift
+# (e.g. rows written before the triggers existed, or edits made with the
+# triggers dropped).
+#
+# Usage:
+#   python counters.py reconcile [--check]   verify (and unless --check, fix)
+
+RECONCILE_INTERVAL_SECONDS = 24 * 60 * 60
+
+
+def _databases():
+    """Connections for the central database and, when sharding, every shard"""
+    conn = sqlite3.connect(sharding.central_db_path)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA busy_timeout = 5000')
+    yield conn
+    if sharding.sharding_enabled():
+        for index in range(sharding.SHARD_COUNT):
+            yield sharding.connect_shard(index)
+
+
+def read_counters(conn):
+    """Current counter values from one database as {name: value}"""
+    try:
+        rows = conn.execute("SELECT name, value FROM main.stats_counters").fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    return {row[0]: row[1] for row in rows}
+
+
+def read_daily_activity(conn, days=7):
+    """Inserts per day for the last `days` UTC days as {name: {day: count}}"""
+    since = (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    try:
+        rows = conn.execute("SELECT day, name, value FROM main.daily_activity WHERE day >= ?", (since,)).fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    activity = {}
+    for day, name, value in rows:
+        activity.setdefault(name, {})[day] = value
+    return activity
+
+
+def dashboard_stats(days=7):
+    """
+    Totals and recent activity for the admin dashboard
+
+    Returns (totals, recent): totals maps counter name -> value (including
+    rows moved to the archive) and recent maps counter name -> inserts over
+    the last `days` days. Reads O(counters + days) rows per database.
+    """
+    totals, recent = {}, {}
+    for conn in _databases():
+        try:
+            for name, value in read_counters(conn).items():
+                totals[name] = totals.get(name, 0) + value
+            # Archived rows left the live tables but still count towards totals
+            archived = archiver.archived_counts(conn)
+            for name, (table, _) in ROW_COUNTERS.items():
+                if table in archived:
+                    totals[name] = totals.get(name, 0) + archived[table]
+            for name, per_day in read_daily_activity(conn, days).items():
+                recent[name] = recent.get(name, 0) + sum(per_day.values())
+        finally:
+            conn.close()
+    return totals, recent
+
+
+# Helper function to verify counters against real row counts
+def reconcile(conn, fix=True):
+    """
+    Compare every counter in one database with COUNT(*) of its table
+
+    Each counter is checked inside its own BEGIN IMMEDIATE transaction so no
+    write can land between the count and the correction. Returns a list of
+    (name, counter value, actual count) for counters that had drifted.
+    """
+    present = {row[0] for row in conn.execute(
+        "SELECT name FROM main.sqlite_master WHERE type = 'table'").fetchall()}
+    if 'stats_counters' not in present:
+        return []
+
+    drifted = []
+    for name, (table, condition) in {**ROW_COUNTERS, **PURGE_AWARE_COUNTERS}.items():
+        if table not in present:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM main.stats_counters WHERE name = ?", (name,)).fetchone()
+            if row is None and name in PURGE_AWARE_COUNTERS:
+                # Migration 16 not applied yet; there are no triggers to keep it current
+                conn.commit()
+                continue
+            stored = row[0] if row else None
+            where = f"WHERE {condition.format(row=table)}" if condition else ''
+            actual = conn.execute(f"SELECT COUNT(*) FROM main.{table} {where}").fetchone()[0]
+            if stored != actual:
+                drifted.append((name, stored, actual))
+                if fix:
+                    seed_row_counter(conn, name, table, condition)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return drifted
+
+
+def reconcile_all(fix=True):
+    drifted = []
+    for conn in _databases():
+        try:
+            database = conn.execute("PRAGMA database_list").fetchone()[2]
+            for name, stored, actual in reconcile(conn, fix):
+                print(f"Counter {name} in {database}: stored {stored}, actual {actual}"
+                      f"{' (fixed)' if fix else ''}")
+                drifted.append((database, name, stored, actual))
+        finally:
+            conn.close()
+    return drifted
+
+
+_reconciler_thread = None
+
+
+def start_background_reconciler(interval=RECONCILE_INTERVAL_SECONDS):
+    """Run reconcile_all every `interval` seconds on a daemon thread"""
+    global _reconciler_thread
+    if _reconciler_thread and _reconciler_thread.is_alive():
+        return _reconciler_thread
+
+    def run():
+        while True:
+            try:
+                reconcile_all()
+            except Exception as e:
+                print(f"Counter reconciliation error: {str(e)}")
+            time.sleep(interval)
+
+    _reconciler_thread = threading.Thread(target=run, name='counter-reconciler', daemon=True)
+    _reconciler_thread.start()
+    return _reconciler_thread
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != 'reconcile':
+        print("Usage: python counters.py reconcile [--check]")
+        sys.exit(1)
+    check_only = '--check' in sys.argv
+    drifted = reconcile_all(fix=not check_only)
+    print(f"{len(drifted)} counters {'out of date' if check_only else 'corrected'}")
+    sys.exit(1 if drifted and check_only else 0)
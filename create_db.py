@@ -7,12 +7,14 @@ import os
 import sys
 import hashlib
 import shutil
+from migrations import apply_migrations, METRICS, METRICS_TABLE, HEALTH_DATA_TABLE, METRIC_BLOCKS_TABLE
 
 # Get the database path
 db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'health.db')
 
 # Connect to the database (it will be created if it doesn't exist)
 conn = sqlite3.connect(db_path)
+conn.execute('PRAGMA foreign_keys = ON')
 cursor = conn.cursor()
 
 print("Connected to database:", db_path)
@@ -41,17 +43,17 @@ CREATE TABLE IF NOT EXISTS users (
 )
 ''')
 
-# Create the health_data table for tracking individual metrics over time
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS health_data (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER NOT NULL,
-    metric TEXT NOT NULL,  -- e.g., "steps", "heart_rate", "weight"
-    value REAL NOT NULL,   -- e.g., 5000 steps, 72 bpm, 70.5 kg
-    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id)
-)
-''')
+# Create the metric dictionary used by health_data
+cursor.execute(METRICS_TABLE)
+cursor.executemany("INSERT OR IGNORE INTO metrics (id, name, unit) VALUES (?, ?, ?)", METRICS)
+
+# Create the health_data table for tracking individual metrics over time.
+# One row per (user, metric, millisecond) with the primary key as the only
+# index, so per-metric range reads are index-only scans.
+cursor.execute(HEALTH_DATA_TABLE.format(name='health_data'))
+
+# Create the hourly compressed sample blocks for wearable streams
+cursor.execute(METRIC_BLOCKS_TABLE)
 
 # Create table for health monitoring with comprehensive health metrics
 cursor.execute('''
@@ -59,7 +61,9 @@ CREATE TABLE IF NOT EXISTS health_monitoring (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id INTEGER NOT NULL,
     heart_rate INTEGER,
-    blood_pressure TEXT,  -- Stored as JSON with systolic and diastolic values
+    blood_pressure TEXT,  -- Legacy JSON / free-text value, only kept when it can't be parsed
+    bp_systolic INTEGER,
+    bp_diastolic INTEGER,
     oxygen_level INTEGER,
     body_temperature REAL,
     glucose_level REAL,
@@ -68,7 +72,8 @@ CREATE TABLE IF NOT EXISTS health_monitoring (
     sleep_hours REAL,
     notes TEXT,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id)
+    created_at_ms INTEGER,  -- UTC epoch milliseconds
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 )
 ''')
 
@@ -87,7 +92,7 @@ CREATE TABLE IF NOT EXISTS medication_reminders (
     notes TEXT,
     is_active BOOLEAN DEFAULT 1,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id)
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 )
 ''')
 
@@ -100,10 +105,11 @@ CREATE TABLE IF NOT EXISTS medication_history (
     medication_name TEXT NOT NULL,
     dosage TEXT,
     taken_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    taken_at_ms INTEGER,  -- UTC epoch milliseconds
     status TEXT NOT NULL,  -- "taken", "skipped", "delayed"
     notes TEXT,
-    FOREIGN KEY (user_id) REFERENCES users(id),
-    FOREIGN KEY (reminder_id) REFERENCES medication_reminders(id)
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (reminder_id) REFERENCES medication_reminders(id) ON DELETE SET NULL
 )
 ''')
 
@@ -121,7 +127,8 @@ CREATE TABLE IF NOT EXISTS medical_records (
     provider TEXT,  -- Doctor or hospital name
     notes TEXT,
     uploaded_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id)
+    uploaded_at_ms INTEGER,  -- UTC epoch milliseconds
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 )
 ''')
 
@@ -141,7 +148,8 @@ CREATE TABLE IF NOT EXISTS medical_prescriptions (
     instructions TEXT,
     follow_up TEXT,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id)
+    created_at_ms INTEGER,  -- UTC epoch milliseconds
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 )
 ''')
 
@@ -162,7 +170,8 @@ CREATE TABLE IF NOT EXISTS activity_tracking (
     end_time TIME,
     notes TEXT,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id)
+    created_at_ms INTEGER,  -- UTC epoch milliseconds
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 )
 ''')
 
@@ -176,8 +185,9 @@ CREATE TABLE IF NOT EXISTS bmi_history (
     bmi REAL,
     bmi_category TEXT,  -- "Underweight", "Normal", "Overweight", "Obese"
     recorded_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    recorded_at_ms INTEGER,  -- UTC epoch milliseconds
     notes TEXT,
-    FOREIGN KEY (user_id) REFERENCES users(id)
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 )
 ''')
 
@@ -192,7 +202,8 @@ CREATE TABLE IF NOT EXISTS disease_predictions (
     recommendations TEXT,
     saved_to_records BOOLEAN DEFAULT 0,
     predicted_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id)
+    predicted_at_ms INTEGER,  -- UTC epoch milliseconds
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 )
 ''')
 
@@ -209,7 +220,7 @@ CREATE TABLE IF NOT EXISTS health_goals (
     frequency TEXT DEFAULT 'daily',  -- "daily", "weekly", "monthly"
     is_active BOOLEAN DEFAULT 1,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id)
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 )
 ''')
 
@@ -222,7 +233,7 @@ CREATE TABLE IF NOT EXISTS chatbot_interactions (
     response TEXT NOT NULL,
     interaction_type TEXT,  -- "health_advice", "medication_help", "general", etc.
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id)
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 )
 ''')
 
@@ -238,131 +249,13 @@ CREATE TABLE IF NOT EXISTS emergency_contacts (
     address TEXT,
     is_primary BOOLEAN DEFAULT 0,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id)
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 )
 ''')
 
-# Create triggers to enforce user_id consistency
-# These triggers ensure that all tables with user_id have proper foreign key constraints
-cursor.execute('''
-CREATE TRIGGER IF NOT EXISTS verify_user_id_health_monitoring 
-BEFORE INSERT ON health_monitoring 
-FOR EACH ROW 
-BEGIN
-    SELECT CASE 
-        WHEN NEW.user_id NOT IN (SELECT id FROM users) 
-        THEN RAISE(ABORT, 'Invalid user_id in health_monitoring')
-    END;
-END;
-''')
-
-cursor.execute('''
-CREATE TRIGGER IF NOT EXISTS verify_user_id_health_data 
-BEFORE INSERT ON health_data 
-FOR EACH ROW 
-BEGIN
-    SELECT CASE 
-        WHEN NEW.user_id NOT IN (SELECT id FROM users) 
-        THEN RAISE(ABORT, 'Invalid user_id in health_data')
-    END;
-END;
-''')
-
-cursor.execute('''
-CREATE TRIGGER IF NOT EXISTS verify_user_id_medication_reminders 
-BEFORE INSERT ON medication_reminders 
-FOR EACH ROW 
-BEGIN
-    SELECT CASE 
-        WHEN NEW.user_id NOT IN (SELECT id FROM users) 
-        THEN RAISE(ABORT, 'Invalid user_id in medication_reminders')
-    END;
-END;
-''')
-
-cursor.execute('''
-CREATE TRIGGER IF NOT EXISTS verify_user_id_medical_records 
-BEFORE INSERT ON medical_records 
-FOR EACH ROW 
-BEGIN
-    SELECT CASE 
-        WHEN NEW.user_id NOT IN (SELECT id FROM users) 
-        THEN RAISE(ABORT, 'Invalid user_id in medical_records')
-    END;
-END;
-''')
-
-cursor.execute('''
-CREATE TRIGGER IF NOT EXISTS verify_user_id_activity_tracking 
-BEFORE INSERT ON activity_tracking 
-FOR EACH ROW 
-BEGIN
-    SELECT CASE 
-        WHEN NEW.user_id NOT IN (SELECT id FROM users) 
-        THEN RAISE(ABORT, 'Invalid user_id in activity_tracking')
-    END;
-END;
-''')
-
-cursor.execute('''
-CREATE TRIGGER IF NOT EXISTS verify_user_id_bmi_history 
-BEFORE INSERT ON bmi_history 
-FOR EACH ROW 
-BEGIN
-    SELECT CASE 
-        WHEN NEW.user_id NOT IN (SELECT id FROM users) 
-        THEN RAISE(ABORT, 'Invalid user_id in bmi_history')
-    END;
-END;
-''')
-
-cursor.execute('''
-CREATE TRIGGER IF NOT EXISTS verify_user_id_disease_predictions 
-BEFORE INSERT ON disease_predictions 
-FOR EACH ROW 
-BEGIN
-    SELECT CASE 
-        WHEN NEW.user_id NOT IN (SELECT id FROM users) 
-        THEN RAISE(ABORT, 'Invalid user_id in disease_predictions')
-    END;
-END;
-''')
-
-cursor.execute('''
-CREATE TRIGGER IF NOT EXISTS verify_user_id_health_goals 
-BEFORE INSERT ON health_goals 
-FOR EACH ROW 
-BEGIN
-    SELECT CASE 
-        WHEN NEW.user_id NOT IN (SELECT id FROM users) 
-        THEN RAISE(ABORT, 'Invalid user_id in health_goals')
-    END;
-END;
-''')
-
-cursor.execute('''
-CREATE TRIGGER IF NOT EXISTS verify_user_id_chatbot_interactions 
-BEFORE INSERT ON chatbot_interactions 
-FOR EACH ROW 
-BEGIN
-    SELECT CASE 
-        WHEN NEW.user_id NOT IN (SELECT id FROM users) 
-        THEN RAISE(ABORT, 'Invalid user_id in chatbot_interactions')
-    END;
-END;
-''')
-
-cursor.execute('''
-CREATE TRIGGER IF NOT EXISTS verify_user_id_emergency_contacts 
-BEFORE INSERT ON emergency_contacts 
-FOR EACH ROW 
-BEGIN
-    SELECT CASE 
-        WHEN NEW.user_id NOT IN (SELECT id FROM users) 
-        THEN RAISE(ABORT, 'Invalid user_id in emergency_contacts')
-    END;
-END;
-''')
+# user_id consistency is enforced by the FOREIGN KEY constraints above
+# (connections run with PRAGMA foreign_keys = ON). Indexes on user_id are
+# created by migrations.py so those checks and cascading deletes stay cheap.
 
 # Add a demo user if none exists
 cursor.execute("SELECT COUNT(*) FROM users")
@@ -403,10 +296,8 @@ if cursor.fetchone()[0] == 0:
         morning_entry = {
             'user_id': user_id,
             'heart_rate': random.randint(65, 85),
-            'blood_pressure': json.dumps({
-                'systolic': random.randint(110, 130),
-                'diastolic': random.randint(70, 90)
-            }),
+            'bp_systolic': random.randint(110, 130),
+            'bp_diastolic': random.randint(70, 90),
             'oxygen_level': random.randint(95, 99),
             'body_temperature': round(random.uniform(97.8, 99.0), 1),
             'glucose_level': round(random.uniform(80.0, 120.0), 1) if random.random() > 0.5 else None,
@@ -422,10 +313,8 @@ if cursor.fetchone()[0] == 0:
             evening_entry = {
                 'user_id': user_id,
                 'heart_rate': random.randint(60, 80),
-                'blood_pressure': json.dumps({
-                    'systolic': random.randint(110, 135),
-                    'diastolic': random.randint(70, 90)
-                }),
+                'bp_systolic': random.randint(110, 135),
+                'bp_diastolic': random.randint(70, 90),
                 'oxygen_level': random.randint(95, 99),
                 'body_temperature': round(random.uniform(97.8, 99.0), 1),
                 'glucose_level': round(random.uniform(90.0, 130.0), 1) if random.random() > 0.5 else None,
@@ -439,13 +328,14 @@ if cursor.fetchone()[0] == 0:
             # Insert evening entry
             cursor.execute('''
             INSERT INTO health_monitoring 
-            (user_id, heart_rate, blood_pressure, oxygen_level, body_temperature, 
+            (user_id, heart_rate, bp_systolic, bp_diastolic, oxygen_level, body_temperature, 
              glucose_level, cholesterol_level, stress_level, sleep_hours, notes, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (
                 evening_entry['user_id'],
                 evening_entry['heart_rate'],
-                evening_entry['blood_pressure'],
+                evening_entry['bp_systolic'],
+                evening_entry['bp_diastolic'],
                 evening_entry['oxygen_level'],
                 evening_entry['body_temperature'],
                 evening_entry['glucose_level'],
@@ -459,13 +349,14 @@ if cursor.fetchone()[0] == 0:
         # Insert morning entry
         cursor.execute('''
         INSERT INTO health_monitoring 
-        (user_id, heart_rate, blood_pressure, oxygen_level, body_temperature,
+        (user_id, heart_rate, bp_systolic, bp_diastolic, oxygen_level, body_temperature,
          glucose_level, cholesterol_level, stress_level, sleep_hours, notes, created_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             morning_entry['user_id'],
             morning_entry['heart_rate'],
-            morning_entry['blood_pressure'],
+            morning_entry['bp_systolic'],
+            morning_entry['bp_diastolic'],
             morning_entry['oxygen_level'],
             morning_entry['body_temperature'],
             morning_entry['glucose_level'],
@@ -608,8 +499,9 @@ for template in admin_templates:
         with open(template_path, 'w') as f:
             f.write(f"<!DOCTYPE html>\n<html><head><title>{template}</title></head><body><h1>Placeholder for {template}</h1></body></html>")
 
-# Commit all changes and close the connection
+# Commit all changes, bring older databases up to the current schema and close the connection
 conn.commit()
+apply_migrations(conn)
 conn.close()
 
 print("Database setup complete!")
\ No newline at end of file
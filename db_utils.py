@@ -0,0 +1,119 @@
+import json
+import re
+import time
+from datetime import datetime, timezone
+
+# Shared helpers for reading and writing health rows.
+# Used by app.py, admin_direct_access.py and fixed_function.py so that every
+# entry point agrees on how values are stored in the database.
+
+_BP_TEXT_PATTERN = re.compile(r'^\s*(\d{2,3})\s*/\s*(\d{2,3})\s*$')
+
+
+def _to_int(value):
+    try:
+        return int(round(float(value)))
+    except (TypeError, ValueError):
+        return None
+
+
+# Helper function to split an incoming blood pressure value into typed columns
+def parse_blood_pressure(value):
+    """
+    Normalize a blood pressure value from an API payload or a legacy JSON column
+
+    Args:
+        value: dict with systolic/diastolic keys, a JSON string of that dict,
+               or free text such as "120/80"
+
+    Returns:
+        Tuple (systolic, diastolic, raw_text). systolic and diastolic are ints
+        (or None); raw_text is only set when the value could not be parsed so
+        that nothing the user entered is lost.
+    """
+    if value is None or value == '':
+        return None, None, None
+
+    if isinstance(value, str):
+        match = _BP_TEXT_PATTERN.match(value)
+        if match:
+            return int(match.group(1)), int(match.group(2)), None
+        try:
+            value = json.loads(value)
+        except (TypeError, ValueError):
+            return None, None, value
+
+    if isinstance(value, dict):
+        systolic = _to_int(value.get('systolic'))
+        diastolic = _to_int(value.get('diastolic'))
+        if systolic is not None or diastolic is not None:
+            return systolic, diastolic, None
+        return None, None, json.dumps(value)
+
+    return None, None, str(value)
+
+
+# Helper function to rebuild the blood pressure shape API consumers expect
+def blood_pressure_from_row(item):
+    """
+    Set item['blood_pressure'] to {'systolic': .., 'diastolic': ..} in place
+
+    Prefers the typed bp_systolic/bp_diastolic columns and falls back to the
+    legacy JSON text for rows the backfill has not reached yet.
+    """
+    systolic = item.get('bp_systolic')
+    diastolic = item.get('bp_diastolic')
+
+    if systolic is not None or diastolic is not None:
+        item['blood_pressure'] = {'systolic': systolic, 'diastolic': diastolic}
+    elif item.get('blood_pressure'):
+        try:
+            item['blood_pressure'] = json.loads(item['blood_pressure'])
+        except (TypeError, ValueError):
+            pass
+    return item
+
+
+# Helper functions for the integer epoch-millisecond timestamp columns
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def datetime_to_ms(value):
+    """Convert a datetime to UTC epoch milliseconds (naive values are treated as local time)"""
+    return int(value.timestamp() * 1000)
+
+
+def ms_to_iso(value):
+    """Format UTC epoch milliseconds as an ISO 8601 string, e.g. 2025-05-07T20:52:57Z"""
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value / 1000, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+# Cache of metric name -> id from the metrics lookup table
+_metric_ids = {}
+
+
+def get_metric_ids(conn):
+    """Return the metric name -> id mapping, loading it from the database once per process"""
+    if not _metric_ids:
+        for row in conn.execute("SELECT id, name FROM metrics").fetchall():
+            _metric_ids[row[1]] = row[0]
+    return _metric_ids
+
+
+def query_metric_range(conn, user_id, metric_id, start_ms, end_ms, limit=10000):
+    """
+    Read one metric for one user between start_ms and end_ms (inclusive)
+
+    Served entirely from health_data's (user_id, metric_id, ts) primary key.
+    Returns a list of (ts, value) tuples in ascending time order.
+    """
+    rows = conn.execute('''
+        SELECT ts, value FROM health_data
+        WHERE user_id = ? AND metric_id = ? AND ts BETWEEN ? AND ?
+        ORDER BY ts
+        LIMIT ?
+    ''', (user_id, metric_id, start_ms, end_ms, limit)).fetchall()
+    return [(row[0], row[1]) for row in rows]
@@ -0,0 +1,108 @@
+import hashlib
+import sqlite3
+
+from flask import request, Response
+
+import sharding
+
+# Conditional GET support
+#
+# Responses that only depend on stored rows carry a weak ETag derived from
+# change tokens the database keeps up to date on every write: the
+# (version, last write time) of user_data_versions (per user and table,
+# migration 10) for a user's own data, and of table_data_versions (per table,
+# migration 14) for the admin listings. Reading a token is a primary-key
+# lookup, so a request whose If-None-Match still matches gets a 304 before
+# any data row is read or serialized.
+#
+# Usage:
+#   token = etags.user_token(conn, user_id, ['health_monitoring'])
+#   etag = etags.make_etag(token, 'health-history', user_id, days)
+#   cached = etags.not_modified(etag)
+#   if cached:
+#       return cached
+#   ...
+#   return etags.with_etag(response, etag)
+
+
+def _token_rows(conn, sql, params):
+    try:
+        return [(row[0], row[1], row[2]) for row in conn.execute(sql, params).fetchall()]
+    except sqlite3.OperationalError:
+        # Database not migrated yet
+        return None
+
+
+def user_token(conn, user_id, tables):
+    """
+    Change token of one user's rows in `tables` on `conn` (for a sharded
+    user, their shard). None when the database has no version table.
+    """
+    rows = _token_rows(conn, f'''
+        SELECT table_name, version, updated_ms FROM user_data_versions
+        WHERE user_id = ? AND table_name IN ({','.join('?' * len(tables))})
+    ''', [user_id, *tables])
+    return None if rows is None else tuple(sorted(rows))
+
+
+def table_token(tables, user_id=None):
+    """
+    Change token of whole tables, read wherever their rows live: central,
+    one user's shard or every shard (users is always read from central).
+    None when a database has no version table.
+    """
+    def read(conn, names):
+        return _token_rows(conn, f'''
+            SELECT table_name, version, updated_ms FROM main.table_data_versions
+            WHERE table_name IN ({','.join('?' * len(names))})
+        ''', names)
+
+    central_tables = [table for table in tables
+                      if not sharding.sharding_enabled() or table not in sharding.SHARDED_TABLES]
+    sharded_tables = [table for table in tables if table not in central_tables]
+
+    conn = sqlite3.connect(sharding.central_db_path)
+    try:
+        rows = read(conn, central_tables) if central_tables else []
+    finally:
+        conn.close()
+    if rows is None or not sharded_tables:
+        return None if rows is None else tuple(sorted(rows))
+
+    indexes = [sharding.shard_for_user(user_id)] if user_id is not None else range(sharding.SHARD_COUNT)
+    for index in indexes:
+        conn = sharding.connect_shard(index)
+        try:
+            shard_rows = read(conn, sharded_tables)
+        finally:
+            conn.close()
+        if shard_rows is None:
+            return None
+        rows += [(f"{index}:{table}", version, updated_ms) for table, version, updated_ms in shard_rows]
+    return tuple(sorted(rows))
+
+
+def make_etag(token, *parts):
+    """
+    Opaque tag for a response built from change `token` plus whatever else
+    (`parts`) shapes it. None when there is no token, so the response is sent
+    untagged rather than with a tag that never changes.
+    """
+    if token is None:
+        return None
+    return hashlib.sha1(repr((token,) + parts).encode()).hexdigest()[:32]
+
+
+def not_modified(etag):
+    """A 304 response when the request's If-None-Match matches `etag`, else None"""
+    if etag is None or not request.if_none_match.contains_weak(etag):
+        return None
+    return with_etag(Response(status=304), etag)
+
+
+def with_etag(response, etag):
+    """Attach `etag` (weak) to `response`; clients must revalidate before reusing it"""
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,357 @@
+import argparse
+import csv
+import io
+import itertools
+import sqlite3
+import sys
+from datetime import datetime, timedelta, timezone
+
+import archiver
+import sharding
+from db_utils import datetime_to_ms
+from migrations import USER_TABLES
+
+# Bulk export of tables to CSV or Parquet
+#
+# Rows are read in chunks of EXPORT_CHUNK_ROWS and written out as they
+# arrive, so memory stays bounded whatever the table size. Each database is
+# read inside one transaction; with WAL (migration 12) that is a consistent
+# snapshot which writers never wait for. With sharding enabled, per-user
+# tables are read shard by shard (one snapshot per shard).
+#
+# Tables the archiver moves old rows out of (archiver.ARCHIVED_TABLES) are
+# exported with their archived rows too: after a database's live rows, its
+# archive file is scanned in the same snapshot with the same filters, and
+# compressed rows are expanded back to the table's current columns (columns
+# added after a row was archived come out empty).
+#
+# Parquet needs pyarrow (the engine pandas uses for Parquet); it is only
+# imported when a Parquet export is requested.
+#
+# Usage:
+#   python exporter.py TABLE [--format csv|parquet] [--output FILE]
+#                      [--with-users] [--user ID] [--from YYYY-MM-DD] [--to YYYY-MM-DD]
+
+EXPORT_CHUNK_ROWS = 5000
+
+EXPORT_TABLES = ['users'] + USER_TABLES
+
+# Never leaves the database
+EXCLUDED_COLUMNS = {'users': {'password_hash'}}
+
+# Columns added by --with-users
+USER_COLUMNS = ['username', 'email']
+
+# table -> epoch-ms column --from/--to filter on. Tables missing here (users
+# among them: deleted_at_ms is not when a user was created) cannot be
+# filtered by date.
+EXPORT_TIMESTAMP_COLUMNS = {
+    'health_data': 'ts',
+    'health_monitoring': 'created_at_ms',
+    'medication_history': 'taken_at_ms',
+    'medical_records': 'uploaded_at_ms',
+    'medical_prescriptions': 'created_at_ms',
+    'activity_tracking': 'created_at_ms',
+    'bmi_history': 'recorded_at_ms',
+    'disease_predictions': 'predicted_at_ms',
+}
+
+EXPORT_FORMATS = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+# SQLite declared type affinity -> Parquet column type name
+_AFFINITY_TYPES = [('INT', 'int64'), ('BOOL', 'bool_'), ('CHAR', 'string'), ('CLOB', 'string'), ('TEXT', 'string'),
+                   ('BLOB', 'binary'), ('REAL', 'float64'), ('FLOA', 'float64'), ('DOUB', 'float64')]
+
+
+class ExportError(ValueError):
+    pass
+
+
+def _connect_central():
+    conn = sqlite3.connect(sharding.central_db_path)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA busy_timeout = 5000')
+    return conn
+
+
+def _connections(table, user_id=None):
+    """Connections holding `table`'s rows: central, one user's shard or every shard"""
+    if not sharding.sharding_enabled() or table not in sharding.SHARDED_TABLES:
+        yield _connect_central()
+    elif user_id is not None:
+        yield sharding.connect_for_user(user_id)
+    else:
+        for index in range(sharding.SHARD_COUNT):
+            yield sharding.connect_shard(index)
+
+
+def table_columns(conn, table):
+    """[(name, declared type)] of the exportable columns of `table`"""
+    columns = [(row[1], row[2] or '') for row in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+    excluded = EXCLUDED_COLUMNS.get(table, set())
+    return [(name, declared) for name, declared in columns if name not in excluded]
+
+
+def timestamp_column(table, columns):
+    """Epoch-ms column the date filter applies to (None when the table has none)"""
+    column = EXPORT_TIMESTAMP_COLUMNS.get(table)
+    return column if column in [name for name, _ in columns] else None
+
+
+def _day_start_ms(value, days=0):
+    try:
+        day = datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        raise ExportError(f"Invalid date '{value}', expected YYYY-MM-DD")
+    return datetime_to_ms(day + timedelta(days=days))
+
+
+# Helper function to build the export query for a table
+def build_export_query(conn, table, with_users=False, user_id=None, date_from=None, date_to=None):
+    """
+    (sql, params, columns) for one export; columns is [(name, declared type)]
+
+    Raises ExportError for tables that cannot be exported and filters the
+    table does not support.
+    """
+    if table not in EXPORT_TABLES:
+        raise ExportError(f"Table '{table}' cannot be exported")
+
+    columns = table_columns(conn, table)
+    if not columns:
+        raise ExportError(f"Table '{table}' does not exist")
+    names = [name for name, _ in columns]
+    key = 'id' if table == 'users' else 'user_id'
+
+    select = [f"t.{name}" for name in names]
+    joins = ''
+    if with_users and table != 'users':
+        select += [f"u.{name} AS {name}" for name in USER_COLUMNS]
+        columns = columns + [(name, 'TEXT') for name in USER_COLUMNS]
+        joins = "LEFT JOIN users u ON u.id = t.user_id"
+
+    clauses, params = _filter_clauses(table, columns, key, user_id, date_from, date_to)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    return f"SELECT {', '.join(select)} FROM {table} t {joins} {where}", params, columns
+
+
+def _filter_clauses(table, columns, key, user_id=None, date_from=None, date_to=None, ts_column=None):
+    clauses, params = [], []
+    if user_id is not None:
+        clauses.append(f"t.{key} = ?")
+        params.append(user_id)
+    if date_from or date_to:
+        if timestamp_column(table, columns) is None:
+            raise ExportError(f"Table '{table}' has no timestamp column to filter on")
+        ts_column = ts_column or timestamp_column(table, columns)
+        if date_from:
+            clauses.append(f"t.{ts_column} >= ?")
+            params.append(_day_start_ms(date_from))
+        if date_to:
+            clauses.append(f"t.{ts_column} < ?")
+            params.append(_day_start_ms(date_to, days=1))
+    return clauses, params
+
+
+# Helper function to read a table's archived rows in the export's column layout
+def iter_archived_chunks(conn, table, columns, with_users=False, user_id=None, date_from=None, date_to=None,
+                         chunk_size=EXPORT_CHUNK_ROWS):
+    """
+    Lists of up to `chunk_size` row tuples from the `archive` database
+    attached to `conn`, matching `columns` as build_export_query returned them
+    """
+    names = [name for name, _ in columns]
+    user_names = USER_COLUMNS if with_users and table != 'users' else []
+    table_names = names[:len(names) - len(user_names)]
+
+    # Archived rows keep user_id and their timestamp (as ts) outside the payload
+    clauses, params = _filter_clauses(table, columns, 'user_id', user_id, date_from, date_to, ts_column='ts')
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    compressed = table != 'health_data'
+    select = ['t.id', 't.payload', 't.dict_id'] if compressed else [f"t.{name}" for name in table_names]
+    select += [f"u.{name} AS {name}" for name in user_names]
+    joins = "LEFT JOIN users u ON u.id = t.user_id" if user_names else ''
+
+    decoder = archiver.RowDecoder(conn, table)
+    cursor = conn.execute(f"SELECT {', '.join(select)} FROM archive.{table} t {joins} {where}", params)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        if not compressed:
+            yield [tuple(row) for row in rows]
+            continue
+        chunk = []
+        for row in rows:
+            item = decoder.decode(row[1], row[2])
+            item['id'] = row[0]
+            chunk.append(tuple(item.get(name) for name in table_names) + tuple(row[3:]))
+        yield chunk
+
+
+def iter_chunks(table, with_users=False, user_id=None, date_from=None, date_to=None,
+                chunk_size=EXPORT_CHUNK_ROWS):
+    """
+    Yield the column list, then lists of up to `chunk_size` row tuples
+
+    Each database is read inside a single read transaction (a WAL snapshot)
+    which is ended as soon as its rows are exhausted or the consumer stops.
+    """
+    header_sent = False
+    for conn in _connections(table, user_id):
+        try:
+            sql, params, columns = build_export_query(conn, table, with_users, user_id, date_from, date_to)
+            if not header_sent:
+                yield columns
+                header_sent = True
+            # ATTACH is not allowed inside the transaction
+            archived = table in archiver.ARCHIVED_TABLES and archiver.archive_reaches(conn, table, 0)
+            conn.execute("BEGIN")
+            cursor = conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [tuple(row) for row in rows]
+            if archived:
+                yield from iter_archived_chunks(conn, table, columns, with_users, user_id, date_from, date_to,
+                                                chunk_size)
+        finally:
+            conn.rollback()
+            conn.close()
+
+
+def stream_csv(chunks):
+    """CSV text for iter_chunks output, one piece per chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for index, chunk in enumerate(chunks):
+        if index == 0:
+            writer.writerow([name for name, _ in chunk])
+        else:
+            writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands written bytes back to a generator"""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def parquet_schema(columns):
+    import pyarrow as pa
+
+    fields = []
+    for name, declared in columns:
+        type_name = next((arrow for affinity, arrow in _AFFINITY_TYPES if affinity in declared.upper()), 'string')
+        fields.append(pa.field(name, getattr(pa, type_name)()))
+    return pa.schema(fields)
+
+
+def stream_parquet(chunks):
+    """
+    Parquet bytes for iter_chunks output, one row group per chunk
+
+    The schema comes from the declared column types, so every row group has
+    the same types even when a chunk holds only NULLs for a column.
+    """
+    try:
+        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError("Parquet export requires pyarrow (pip install pyarrow)")
+
+    sink = _ChunkSink()
+    writer = None
+    try:
+        for index, chunk in enumerate(chunks):
+            if index == 0:
+                columns = chunk
+                schema = parquet_schema(columns)
+                writer = pq.ParquetWriter(sink, schema, compression='zstd')
+                continue
+            frame = pd.DataFrame.from_records(chunk, columns=[name for name, _ in columns])
+            # SQLite does not enforce declared types; text columns get text
+            for field in schema:
+                if field.type == pa.string():
+                    frame[field.name] = frame[field.name].map(
+                        lambda value: value if value is None or isinstance(value, str) else str(value))
+            writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False, safe=False))
+            yield sink.drain()
+    finally:
+        if writer is not None:
+            writer.close()
+    yield sink.drain()
+
+
+def export(table, fmt='csv', **filters):
+    """
+    Iterator of CSV text or Parquet bytes for `table` (see build_export_query
+    for filters). The first piece is produced before returning, so a bad
+    table, filter or missing pyarrow raises ExportError here rather than
+    midway through a response.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ExportError(f"Unknown export format '{fmt}'")
+    chunks = iter_chunks(table, **filters)
+    pieces = stream_csv(chunks) if fmt == 'csv' else stream_parquet(chunks)
+    first = next(pieces, None)
+    return itertools.chain([] if first is None else [first], pieces)
+
+
+def export_filename(table, fmt):
+    return f"{table}_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}.{fmt}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a table to CSV or Parquet")
+    parser.add_argument('table', choices=EXPORT_TABLES)
+    parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv')
+    parser.add_argument('--output', help="output file (default: stdout for CSV, TABLE_<time>.parquet)")
+    parser.add_argument('--with-users', action='store_true', help="add username and email columns")
+    parser.add_argument('--user', type=int, help="only this user's rows")
+    parser.add_argument('--from', dest='date_from', help="first day, YYYY-MM-DD (UTC)")
+    parser.add_argument('--to', dest='date_to', help="last day, YYYY-MM-DD (UTC)")
+    args = parser.parse_args()
+
+    output = args.output
+    if output is None and args.format == 'parquet':
+        output = export_filename(args.table, 'parquet')
+
+    try:
+        pieces = export(args.table, args.format, with_users=args.with_users, user_id=args.user,
+                        date_from=args.date_from, date_to=args.date_to)
+        if output is None:
+            for piece in pieces:
+                sys.stdout.write(piece)
+        else:
+            mode = 'w' if args.format == 'csv' else 'wb'
+            with open(output, mode, **({'newline': ''} if mode == 'w' else {})) as f:
+                for piece in pieces:
+                    f.write(piece)
+            print(f"Exported {args.table} to {output}", file=sys.stderr)
+    except ExportError as e:
+        print(f"Export error: {str(e)}", file=sys.stderr)
+        sys.exit(1)
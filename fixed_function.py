@@ -4,6 +4,7 @@ import traceback
 from flask import Flask, request, session, jsonify
 from datetime import datetime, timedelta
 from functools import wraps
+from db_utils import blood_pressure_from_row, now_ms, ms_to_iso
 
 # Create Flask app
 app = Flask(__name__)
@@ -23,6 +24,7 @@ def get_db_connection():
     try:
         conn = sqlite3.connect('health.db')
         conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA foreign_keys = ON')
         return conn
     except Exception as e:
         print(f"Database connection error: {str(e)}")
@@ -50,8 +52,8 @@ def get_health_history():
         except ValueError:
             days = 7
             
-        # Calculate start date
-        start_date = datetime.now() - timedelta(days=days)
+        # Calculate start of the window in UTC epoch milliseconds
+        start_ms = now_ms() - days * 24 * 60 * 60 * 1000
         
         conn = get_db_connection()
         if not conn:
@@ -69,9 +71,9 @@ def get_health_history():
             # Execute the query directly with explicit user_id filter for safety
             cursor.execute('''
             SELECT * FROM health_monitoring
-            WHERE user_id = ? AND created_at >= ?
-            ORDER BY created_at DESC
-            ''', (user_id, start_date.strftime('%Y-%m-%d %H:%M:%S')))
+            WHERE user_id = ? AND created_at_ms >= ?
+            ORDER BY created_at_ms DESC
+            ''', (user_id, start_ms))
             
             # Convert rows to dictionaries
             history = []
@@ -81,12 +83,9 @@ def get_health_history():
                 if item.get('user_id') != user_id:
                     continue
                     
-                # Handle blood pressure JSON
-                if item.get('blood_pressure'):
-                    try:
-                        item['blood_pressure'] = json.loads(item['blood_pressure'])
-                    except:
-                        pass
+                # Build blood pressure from the typed columns
+                blood_pressure_from_row(item)
+                item['created_at'] = ms_to_iso(item['created_at_ms']) or item.get('created_at')
                 history.append(item)
             
             # Apply the sanitize_user_data function as an additional layer of security
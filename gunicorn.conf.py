@@ -0,0 +1,54 @@
+import gc
+import multiprocessing
+import os
+
+# Gunicorn settings for the WSGI server (see wsgi.py)
+#
+# The Procfile serves asgi.py under uvicorn instead, where an open live
+# readings stream (/api/health-monitoring/stream) is a suspended coroutine.
+# Under gunicorn every open stream holds one worker thread for as long as the
+# tab stays open, so workers are threaded (gthread): a sync worker would be
+# pinned by a single tab and killed after `timeout`, while a gthread worker
+# only has to keep its main loop alive, however long its requests run. Size
+# WEB_CONCURRENCY x GUNICORN_THREADS above the number of monitor tabs expected.
+#
+# Every setting can be overridden from the environment:
+#   PORT                        port to listen on (default 5000)
+#   WEB_CONCURRENCY             worker processes (default 2 x CPUs + 1)
+#   GUNICORN_THREADS            threads per worker (default 8)
+#   GUNICORN_TIMEOUT            seconds before a worker whose main loop stopped is killed and replaced (default 30)
+#   GUNICORN_GRACEFUL_TIMEOUT   seconds a worker gets to finish its requests on reload/stop (default 30)
+#   GUNICORN_MAX_REQUESTS       recycle a worker after this many requests (default 0, never)
+#
+# The app is loaded once in the master and workers are forked from it
+# (preload_app). Graceful reload:
+#   kill -HUP <master>    replace workers one by one, finishing in-flight requests
+#                         (same preloaded code; settings are re-read)
+#   kill -USR2 <master>   start a new master with new code, then
+#   kill -QUIT <old master>  to retire the old one once the new one is up
+#
+# Usage:
+#   gunicorn -c gunicorn.conf.py wsgi:app
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+keepalive = 5
+preload_app = True
+
+
+def when_ready(server):
+    # Everything loaded so far lives as long as the master; keep the garbage
+    # collector from touching it, which would copy those pages into every worker
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Only one worker (whichever takes the lock) runs the archiver and purger
+    from app import start_background_jobs, BACKGROUND_JOBS_LOCK_PATH
+    start_background_jobs(lock_path=BACKGROUND_JOBS_LOCK_PATH)
@@ -0,0 +1,374 @@
+import asyncio
+import atexit
+import json
+import os
+import queue
+import socket
+import threading
+from abc import ABC, abstractmethod
+
+from db_utils import now_ms, ms_to_iso, blood_pressure_from_row
+
+# Live health readings for open health monitor tabs (Server-Sent Events)
+#
+# save_health_data publishes every new health_monitoring row, together with
+# the user's rolled-up averages, to an in-process hub. Each open
+# /api/health-monitoring/stream connection subscribes to the hub with a small
+# bounded queue, so an idle connection costs one queue and (under asgi.py) one
+# suspended coroutine, plus a heartbeat comment every HEARTBEAT_SECONDS.
+# Due medication reminders reach the same streams as 'reminder' events (see
+# reminder_scheduler.py).
+#
+# A reading's event id is its health_monitoring id. Browsers send the last one
+# they saw as Last-Event-ID when they reconnect, and the readings saved since
+# are replayed from the database; a subscriber that falls more than
+# SUBSCRIBER_QUEUE_SIZE messages behind is caught up the same way.
+#
+# With several server processes, a reading saved in one must reach tabs
+# connected to another. The socket broker stands in for a shared broker (e.g.
+# Redis pub/sub) on a single host: each process with subscribers binds a Unix
+# datagram socket in LIVE_EVENTS_DIR, and publishing sends the message to every
+# other socket there. Set LIVE_EVENTS_BROKER=memory to keep events in-process.
+# The same sockets carry server-side topics (publish_topic / on_topic), e.g.
+# reminder changes for the reminder scheduler's process.
+#
+# Usage:
+#   live_events.publish_reading(conn, user_id, reading_id)      after the commit
+
+HEARTBEAT_SECONDS = 15
+RETRY_MS = 3000
+SUBSCRIBER_QUEUE_SIZE = 64
+REPLAY_LIMIT = 500
+
+# Averages are rolled up over each window the health monitor page offers
+SUMMARY_WINDOWS_DAYS = (7, 30, 90, 180)
+
+LIVE_EVENTS_BROKER = os.environ.get('LIVE_EVENTS_BROKER', 'socket')
+LIVE_EVENTS_DIR = os.environ.get('LIVE_EVENTS_DIR',
+                                 os.path.join(os.path.dirname(os.path.abspath(__file__)), '.live_events'))
+MAX_DATAGRAM_BYTES = 64 * 1024
+
+HEARTBEAT = b': heartbeat\n\n'
+STREAM_HEADERS = [
+    ('Content-Type', 'text/event-stream'),
+    ('Cache-Control', 'no-cache'),
+    # Keep nginx and similar proxies from buffering the stream
+    ('X-Accel-Buffering', 'no'),
+]
+
+SUMMARY_QUERY = '''
+    SELECT COUNT(*) AS readings,
+           AVG(heart_rate) AS heart_rate,
+           AVG(bp_systolic) AS bp_systolic,
+           AVG(bp_diastolic) AS bp_diastolic,
+           AVG(glucose_level) AS glucose_level,
+           AVG(oxygen_level) AS oxygen_level,
+           AVG(body_temperature) AS body_temperature
+    FROM health_monitoring
+    WHERE user_id = ? AND created_at_ms >= ?
+'''
+
+
+def format_reading(row):
+    """A health_monitoring row as the health history API returns it"""
+    item = dict(row)
+    blood_pressure_from_row(item)
+    item['created_at'] = ms_to_iso(item['created_at_ms']) or item.get('created_at')
+    return item
+
+
+def read_readings(conn, user_id, after_id, limit=REPLAY_LIMIT):
+    cursor = conn.execute('''
+        SELECT * FROM health_monitoring
+        WHERE user_id = ? AND id > ?
+        ORDER BY id
+        LIMIT ?
+    ''', (user_id, after_id, limit))
+    return [format_reading(row) for row in cursor.fetchall() if row is not None]
+
+
+def read_summary(conn, user_id):
+    """Reading count and averages per SUMMARY_WINDOWS_DAYS window"""
+    now = now_ms()
+    summary = {}
+    for days in SUMMARY_WINDOWS_DAYS:
+        row = conn.execute(SUMMARY_QUERY, (user_id, now - days * 24 * 60 * 60 * 1000)).fetchone()
+        summary[str(days)] = {name: (round(value, 1) if isinstance(value, float) else value)
+                              for name, value in zip(row.keys(), row)}
+    return summary
+
+
+def latest_reading_id(conn, user_id):
+    row = conn.execute("SELECT MAX(id) FROM health_monitoring WHERE user_id = ?", (user_id,)).fetchone()
+    return row[0] or 0
+
+
+def parse_last_event_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def sse_event(event, data, event_id=None):
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {json.dumps(data)}"]
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+def encode_message(message, last_id):
+    """SSE bytes for a published message, skipping readings already sent; returns (bytes, last_id)"""
+    chunks = []
+    for reading in message.get('readings', []):
+        if reading['id'] > last_id:
+            chunks.append(sse_event('reading', reading, reading['id']))
+            last_id = reading['id']
+    if 'summary' in message:
+        chunks.append(sse_event('summary', message['summary']))
+    for reminder in message.get('reminders', []):
+        chunks.append(sse_event('reminder', reminder))
+    return b''.join(chunks), last_id
+
+
+# Helper function to read what a (re)connecting client has missed
+def catch_up(conn, user_id, last_id):
+    """
+    SSE bytes to send before live events, and the id to continue from.
+    Without a last_id (a new tab) only the current summary is sent.
+    """
+    if last_id is None:
+        message = {'summary': read_summary(conn, user_id)}
+        last_id = latest_reading_id(conn, user_id)
+    else:
+        message = {'readings': read_readings(conn, user_id, last_id), 'summary': read_summary(conn, user_id)}
+    return encode_message(message, last_id)
+
+
+class Subscription(ABC):
+    """One open stream; push() may be called from any thread"""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.lost = False
+
+    @abstractmethod
+    def push(self, message):
+        """Queue `message` for the stream without blocking; set self.lost when it has to be dropped"""
+
+    def take_lost(self):
+        """True (once) when messages were dropped since the last call"""
+        lost, self.lost = self.lost, False
+        return lost
+
+
+class ThreadSubscription(Subscription):
+    """Subscription read by a blocking (WSGI) response generator"""
+
+    def __init__(self, user_id):
+        super().__init__(user_id)
+        self.queue = queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+
+    def push(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.lost = True
+
+    def get(self, timeout=HEARTBEAT_SECONDS):
+        """Next message, or None after `timeout` seconds without one"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription(Subscription):
+    """Subscription read by a coroutine on `loop`"""
+
+    def __init__(self, user_id, loop):
+        super().__init__(user_id)
+        self.loop = loop
+        self.queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.lost = True
+
+    def push(self, message):
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # The event loop has already shut down
+            pass
+
+    async def get(self, timeout=HEARTBEAT_SECONDS):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class Hub:
+    """Open subscriptions by user_id, and callbacks for server-side topics"""
+
+    def __init__(self):
+        self.subscribers = {}
+        self.topics = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, subscription):
+        with self.lock:
+            self.subscribers.setdefault(subscription.user_id, set()).add(subscription)
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[subscription.user_id]
+
+    def dispatch(self, user_id, message):
+        with self.lock:
+            subscribers = list(self.subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            subscription.push(message)
+
+    def on_topic(self, topic, callback):
+        with self.lock:
+            self.topics.setdefault(topic, []).append(callback)
+
+    def dispatch_topic(self, topic, message):
+        with self.lock:
+            callbacks = list(self.topics.get(topic, ()))
+        for callback in callbacks:
+            callback(message)
+
+    def count(self):
+        with self.lock:
+            return sum(len(subscribers) for subscribers in self.subscribers.values())
+
+
+class SocketBroker:
+    """Fan-out to the other server processes on this host over Unix datagram sockets"""
+
+    def __init__(self, hub, directory=LIVE_EVENTS_DIR):
+        self.hub = hub
+        self.directory = directory
+        self.sock = None
+        self.path = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def listen(self):
+        """Bind this process's socket and start delivering what other processes publish"""
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            # Also after a fork: the parent's socket is not ours to read
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            self.pid = os.getpid()
+            self.path = os.path.join(self.directory, f"{self.pid}.sock")
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.sock.bind(self.path)
+            atexit.register(self._remove, self.path)
+            threading.Thread(target=self._receive, args=(self.sock,), name='live-events-broker', daemon=True).start()
+
+    def _receive(self, sock):
+        while True:
+            try:
+                data = sock.recv(MAX_DATAGRAM_BYTES)
+                envelope = json.loads(data)
+                if 'topic' in envelope:
+                    self.hub.dispatch_topic(envelope['topic'], envelope['message'])
+                else:
+                    self.hub.dispatch(envelope['user_id'], envelope['message'])
+            except OSError:
+                return
+            except (ValueError, KeyError) as e:
+                print(f"Live events broker: ignoring malformed message: {str(e)}")
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def send(self, envelope):
+        """Relay {'user_id' or 'topic': ..., 'message': ...} to the other processes"""
+        data = json.dumps(envelope).encode()
+        if len(data) > MAX_DATAGRAM_BYTES:
+            print(f"Live events broker: message too large to relay ({len(data)} bytes)")
+            return
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        own = f"{os.getpid()}.sock"
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+            sender.setblocking(False)
+            for name in names:
+                if not name.endswith('.sock') or name == own:
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    sender.sendto(data, path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Left behind by a process that is gone
+                    self._remove(path)
+                except BlockingIOError:
+                    # That process is not keeping up; its streams catch up from the database
+                    print(f"Live events broker: dropped a message for {name}")
+
+
+_hub = Hub()
+_broker = SocketBroker(_hub) if LIVE_EVENTS_BROKER == 'socket' and hasattr(socket, 'AF_UNIX') else None
+
+
+def subscribe(subscription):
+    if _broker is not None:
+        _broker.listen()
+    _hub.subscribe(subscription)
+    return subscription
+
+
+def unsubscribe(subscription):
+    _hub.unsubscribe(subscription)
+
+
+def publish(user_id, message):
+    """Deliver `message` to the user's streams in this and every other server process"""
+    _hub.dispatch(user_id, message)
+    if _broker is not None:
+        _broker.send({'user_id': user_id, 'message': message})
+
+
+def on_topic(topic, callback):
+    """Call callback(message) for every message published on `topic` by any server process"""
+    if _broker is not None:
+        _broker.listen()
+    _hub.on_topic(topic, callback)
+
+
+def publish_topic(topic, message):
+    _hub.dispatch_topic(topic, message)
+    if _broker is not None:
+        _broker.send({'topic': topic, 'message': message})
+
+
+def publish_reading(conn, user_id, reading_id):
+    """Publish a newly committed health_monitoring row and the user's updated averages"""
+    try:
+        readings = read_readings(conn, user_id, reading_id - 1, limit=1)
+        publish(user_id, {'readings': readings, 'summary': read_summary(conn, user_id)})
+    except Exception as e:
+        # The reading is saved either way; open tabs pick it up when they reconnect
+        print(f"Failed to publish reading {reading_id}: {str(e)}")
+
+
+def stats():
+    return {'subscribers': _hub.count(), 'broker': 'socket' if _broker is not None else 'memory'}
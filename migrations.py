@@ -0,0 +1,816 @@
+import sqlite3
+import os
+import re
+import sys
+
+# Schema migrations for health.db
+#
+# Each migration is a function taking an open connection. They are applied in
+# order and the number of applied migrations is tracked in PRAGMA user_version,
+# so running this module (or calling apply_migrations) repeatedly is safe.
+# Migrations must also be idempotent on their own because create_db.py already
+# creates fresh databases with the current column layout.
+
+db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'health.db')
+
+# Rows updated per transaction by the backfill jobs. Small batches keep the
+# write lock short so the app stays responsive while a backfill runs.
+BACKFILL_BATCH_SIZE = 1000
+
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def table_exists(conn, table):
+    row = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name = ?", (table,)).fetchone()
+    return row is not None
+
+
+def add_column_if_missing(conn, table, column, declaration):
+    if column not in table_columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+        print(f"Added column {table}.{column}")
+
+
+# Helper function to run an UPDATE over a table in rowid-range batches
+def backfill_in_batches(conn, table, set_clause, where_clause, batch_size=BACKFILL_BATCH_SIZE):
+    """
+    Apply `UPDATE table SET set_clause WHERE where_clause` one id range at a time
+
+    Each batch is committed separately so the backfill can run against a live
+    database and can be interrupted and resumed at any point.
+    """
+    max_id = conn.execute(f"SELECT MAX(rowid) FROM {table}").fetchone()[0]
+    if max_id is None:
+        return 0
+
+    updated = 0
+    last_id = 0
+    while last_id < max_id:
+        cursor = conn.execute(f'''
+            UPDATE {table} SET {set_clause}
+            WHERE rowid > ? AND rowid <= ? AND ({where_clause})
+        ''', (last_id, last_id + batch_size))
+        conn.commit()
+        updated += cursor.rowcount
+        last_id += batch_size
+
+    if updated:
+        print(f"Backfilled {updated} rows in {table}")
+    return updated
+
+
+# Migration 1: typed blood pressure columns on health_monitoring
+def migrate_blood_pressure_columns(conn):
+    add_column_if_missing(conn, 'health_monitoring', 'bp_systolic', 'INTEGER')
+    add_column_if_missing(conn, 'health_monitoring', 'bp_diastolic', 'INTEGER')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_health_monitoring_user_bp
+        ON health_monitoring (user_id, bp_systolic, bp_diastolic)
+    ''')
+    conn.commit()
+
+    backfill_in_batches(
+        conn, 'health_monitoring',
+        '''bp_systolic = CAST(json_extract(blood_pressure, '$.systolic') AS INTEGER),
+           bp_diastolic = CAST(json_extract(blood_pressure, '$.diastolic') AS INTEGER)''',
+        "bp_systolic IS NULL AND json_valid(blood_pressure)"
+    )
+
+
+# Time-series tables and the text timestamp column each one is ordered by.
+# Every table gets a `<column>_ms` twin holding UTC epoch milliseconds.
+TIMESTAMP_COLUMNS = {
+    'health_monitoring': 'created_at',
+    'health_data': 'timestamp',
+    'bmi_history': 'recorded_at',
+    'disease_predictions': 'predicted_at',
+    'activity_tracking': 'created_at',
+    'medication_history': 'taken_at',
+}
+
+
+# Helper function to add a `<column>_ms` epoch-millisecond twin to a table
+def add_epoch_timestamp(conn, table, column):
+    if not table_exists(conn, table) or column not in table_columns(conn, table):
+        return
+    ms_column = f"{column}_ms"
+    add_column_if_missing(conn, table, ms_column, 'INTEGER')
+    conn.execute(f'''
+        CREATE INDEX IF NOT EXISTS idx_{table}_user_{ms_column}
+        ON {table} (user_id, {ms_column})
+    ''')
+
+    # Writers in the app bind the millisecond value directly. This trigger
+    # only fills it in for older scripts that still insert text timestamps.
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS fill_{table}_{ms_column}
+        AFTER INSERT ON {table}
+        FOR EACH ROW WHEN NEW.{ms_column} IS NULL AND NEW.{column} IS NOT NULL
+        BEGIN
+            UPDATE {table} SET {ms_column} = CAST(strftime('%s', NEW.{column}) AS INTEGER) * 1000
+            WHERE rowid = NEW.rowid;
+        END
+    ''')
+    conn.commit()
+
+    backfill_in_batches(
+        conn, table,
+        f"{ms_column} = CAST(strftime('%s', {column}) AS INTEGER) * 1000",
+        f"{ms_column} IS NULL AND {column} IS NOT NULL"
+    )
+
+
+# Migration 2: integer epoch-millisecond timestamps for time-series tables
+def migrate_epoch_timestamps(conn):
+    for table, column in TIMESTAMP_COLUMNS.items():
+        add_epoch_timestamp(conn, table, column)
+
+
+# Helper function to change a table's definition using SQLite's documented
+# "create new table, copy, drop, rename" procedure
+def rebuild_table(conn, table, transform_sql):
+    """
+    Recreate `table` with the CREATE TABLE statement returned by transform_sql(old_sql)
+
+    Rows, indexes, triggers and the AUTOINCREMENT counter are carried over.
+    Foreign key enforcement is switched off for the duration of the rebuild and
+    the result is checked with PRAGMA foreign_key_check before committing.
+    Returns False without touching the table when the definition is unchanged.
+    """
+    old_sql = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name = ?", (table,)).fetchone()[0]
+    new_sql = transform_sql(old_sql)
+    if new_sql == old_sql:
+        return False
+
+    dependents = [row[0] for row in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+        (table,)
+    ).fetchall()]
+    sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone() \
+        if table_exists(conn, 'sqlite_sequence') else None
+    columns = ', '.join(table_columns(conn, table))
+
+    conn.commit()
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        conn.execute("BEGIN")
+        new_table_sql = re.sub(r'^CREATE TABLE\s+(IF NOT EXISTS\s+)?"?' + table + r'"?',
+                               f'CREATE TABLE {table}__rebuild', new_sql, count=1)
+        conn.execute(new_table_sql)
+        conn.execute(f"INSERT INTO {table}__rebuild ({columns}) SELECT {columns} FROM {table}")
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}__rebuild RENAME TO {table}")
+        for sql in dependents:
+            conn.execute(sql)
+        if sequence is not None:
+            conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ?", (sequence[0], table))
+
+        violations = conn.execute(f"PRAGMA foreign_key_check({table})").fetchall()
+        if violations:
+            raise sqlite3.IntegrityError(f"{len(violations)} rows in {table} violate foreign keys")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
+
+    print(f"Rebuilt table {table}")
+    return True
+
+
+# Tables whose rows belong to a single user
+USER_TABLES = [
+    'health_data', 'health_monitoring', 'medication_reminders', 'medication_history',
+    'medical_records', 'medical_prescriptions', 'activity_tracking', 'bmi_history',
+    'disease_predictions', 'health_goals', 'chatbot_interactions', 'emergency_contacts',
+]
+
+
+def _cascade_user_references(sql):
+    sql = re.sub(r'REFERENCES users\s*\(id\)(?!\s+ON DELETE)', 'REFERENCES users(id) ON DELETE CASCADE', sql)
+    return re.sub(r'REFERENCES medication_reminders\s*\(id\)(?!\s+ON DELETE)',
+                  'REFERENCES medication_reminders(id) ON DELETE SET NULL', sql)
+
+
+# Migration 3: rely on declared foreign keys instead of verify_user_id_* triggers
+def migrate_foreign_keys(conn):
+    # The triggers re-ran `NEW.user_id NOT IN (SELECT id FROM users)` on every
+    # insert, duplicating the FOREIGN KEY checks the app already enables.
+    triggers = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE 'verify_user_id_%'"
+    ).fetchall()
+    for (name,) in triggers:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    if triggers:
+        print(f"Dropped {len(triggers)} verify_user_id_* triggers")
+    conn.commit()
+
+    for table in USER_TABLES:
+        if not table_exists(conn, table):
+            continue
+        rebuild_table(conn, table, _cascade_user_references)
+
+        # Child-side index so ON DELETE CASCADE and FK checks on users never scan
+        indexed = any(
+            conn.execute(f"PRAGMA index_info({index[1]})").fetchone()[2] == 'user_id'
+            for index in conn.execute(f"PRAGMA index_list({table})").fetchall()
+        )
+        if not indexed:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_user_id ON {table} (user_id)")
+        conn.commit()
+
+    if table_exists(conn, 'medication_history'):
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_medication_history_reminder_id ON medication_history (reminder_id)")
+        conn.commit()
+
+
+# Metric dictionary for health_data. Ids are fixed so they can be shared
+# across databases; new metrics are appended with the next free id.
+METRICS = [
+    (1, 'heart_rate', 'bpm'),
+    (2, 'oxygen_level', '%'),
+    (3, 'glucose_level', 'mg/dL'),
+    (4, 'body_temperature', 'F'),
+    (5, 'blood_pressure_systolic', 'mmHg'),
+    (6, 'blood_pressure_diastolic', 'mmHg'),
+    (7, 'steps', 'steps'),
+    (8, 'weight', 'kg'),
+]
+
+METRICS_TABLE = '''
+CREATE TABLE IF NOT EXISTS metrics (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    unit TEXT
+)
+'''
+
+HEALTH_DATA_TABLE = '''
+CREATE TABLE IF NOT EXISTS {name} (
+    user_id INTEGER NOT NULL,
+    metric_id INTEGER NOT NULL,
+    ts INTEGER NOT NULL,  -- UTC epoch milliseconds
+    value REAL NOT NULL,
+    PRIMARY KEY (user_id, metric_id, ts),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (metric_id) REFERENCES metrics(id)
+) WITHOUT ROWID
+'''
+
+
+HEALTH_DATA_COPY_SQL = '''
+    SELECT h.user_id, m.id,
+           COALESCE(h.timestamp_ms, CAST(strftime('%s', h.timestamp) AS INTEGER) * 1000),
+           h.value
+    FROM health_data h JOIN metrics m ON m.name = h.metric
+    WHERE h.id > ? AND h.id <= ?
+    ORDER BY h.id
+'''
+
+# Legacy timestamps only have whole seconds, so a second has this many free
+# millisecond slots for readings of the same metric that share it
+MAX_TIMESTAMP_SHIFT_MS = 999
+
+
+# Helper function to copy one id range of the old health_data into the new layout
+def _copy_health_data(conn, first_id, last_id):
+    """
+    Copy old rows with first_id < id <= last_id into health_data__rebuild and
+    return (merged, shifted). Rows colliding on (user_id, metric_id, ts) are
+    never overwritten: an exact duplicate of a reading already copied is
+    merged into it, a different value moves to the next free millisecond.
+    """
+    rows = conn.execute(HEALTH_DATA_COPY_SQL, (first_id, last_id)).fetchall()
+    insert_sql = "INSERT INTO health_data__rebuild (user_id, metric_id, ts, value) VALUES (?, ?, ?, ?)"
+    conn.execute("SAVEPOINT copy_health_data")
+    try:
+        conn.executemany(insert_sql, rows)
+        conn.execute("RELEASE copy_health_data")
+        return 0, 0
+    except sqlite3.IntegrityError:
+        conn.execute("ROLLBACK TO copy_health_data")
+        conn.execute("RELEASE copy_health_data")
+
+    # Slow path, only for batches with collisions
+    merged = shifted = 0
+    for user_id, metric_id, ts, value in rows:
+        for offset in range(MAX_TIMESTAMP_SHIFT_MS + 1):
+            existing = conn.execute('''
+                SELECT value FROM health_data__rebuild WHERE user_id = ? AND metric_id = ? AND ts = ?
+            ''', (user_id, metric_id, ts + offset)).fetchone()
+            if existing is None:
+                conn.execute(insert_sql, (user_id, metric_id, ts + offset, value))
+                shifted += offset > 0
+                break
+            if existing[0] == value:
+                merged += 1
+                break
+        else:
+            raise RuntimeError(f"health_data: more than {MAX_TIMESTAMP_SHIFT_MS + 1} readings of metric "
+                               f"{metric_id} for user {user_id} at {ts}; migration aborted")
+    return merged, shifted
+
+
+# Migration 4: compact health_data keyed by (user_id, metric_id, ts)
+def migrate_health_data_layout(conn):
+    conn.execute(METRICS_TABLE)
+    conn.executemany("INSERT OR IGNORE INTO metrics (id, name, unit) VALUES (?, ?, ?)", METRICS)
+    conn.commit()
+
+    if 'metric_id' in table_columns(conn, 'health_data'):
+        return
+
+    # Register any metric names the old table used that aren't in METRICS yet
+    conn.execute('''
+        INSERT INTO metrics (name)
+        SELECT DISTINCT metric FROM health_data
+        WHERE metric NOT IN (SELECT name FROM metrics)
+    ''')
+    conn.execute("DROP TABLE IF EXISTS health_data__rebuild")
+    conn.execute(HEALTH_DATA_TABLE.format(name='health_data__rebuild'))
+    conn.commit()
+
+    # Copy in committed batches while the old table stays live, then copy
+    # whatever arrived in the meantime and swap the tables in one transaction.
+    max_id = conn.execute("SELECT MAX(id) FROM health_data").fetchone()[0] or 0
+    merged = shifted = 0
+    last_id = 0
+    while last_id < max_id:
+        counts = _copy_health_data(conn, last_id, last_id + BACKFILL_BATCH_SIZE)
+        merged, shifted = merged + counts[0], shifted + counts[1]
+        conn.commit()
+        last_id += BACKFILL_BATCH_SIZE
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        counts = _copy_health_data(conn, last_id, 2 ** 62)
+        merged, shifted = merged + counts[0], shifted + counts[1]
+        conn.execute("DROP TABLE health_data")
+        conn.execute("ALTER TABLE health_data__rebuild RENAME TO health_data")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if merged or shifted:
+        print(f"health_data: {merged} duplicate readings merged, {shifted} readings sharing a timestamp "
+              f"kept a few milliseconds later")
+    print("Rebuilt health_data as a WITHOUT ROWID table keyed by (user_id, metric_id, ts)")
+
+
+# Hourly compressed sample blocks written by timeseries_blocks.py
+METRIC_BLOCKS_TABLE = '''
+CREATE TABLE IF NOT EXISTS metric_blocks (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    metric_id INTEGER NOT NULL,
+    block_start INTEGER NOT NULL,  -- start of the UTC hour, epoch milliseconds
+    first_ts INTEGER NOT NULL,
+    last_ts INTEGER NOT NULL,
+    sample_count INTEGER NOT NULL,
+    payload BLOB NOT NULL,  -- delta-of-delta timestamps + delta values, zlib-compressed
+    UNIQUE (user_id, metric_id, block_start),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (metric_id) REFERENCES metrics(id)
+)
+'''
+
+
+# Migration 5: block storage for high-frequency wearable streams
+def migrate_metric_blocks(conn):
+    conn.execute(METRIC_BLOCKS_TABLE)
+    conn.commit()
+
+
+# Migration 6: timestamp-only indexes so archiver.py can find rows older than
+# its cutoff without scanning every user's range
+ARCHIVE_SCAN_INDEXES = {
+    'health_monitoring': 'created_at_ms',
+    'disease_predictions': 'predicted_at_ms',
+    'health_data': 'ts',
+}
+
+
+def migrate_archive_scan_indexes(conn):
+    for table, column in ARCHIVE_SCAN_INDEXES.items():
+        if table_exists(conn, table) and column in table_columns(conn, table):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{column} ON {table} ({column})")
+    conn.commit()
+
+
+# Migration 7: FTS5 indexes for prescription and medical record search (see search.py).
+# External-content tables store only the index; the text stays in the
+# content table and the triggers below keep both in step.
+FTS_INDEXES = {
+    'prescriptions_fts': ('medical_prescriptions', ['diagnosis', 'medications', 'doctor_name', 'user_id']),
+    'records_fts': ('medical_records', ['record_name', 'notes', 'user_id']),
+}
+
+
+def fts_statements(fts_table):
+    content_table, columns = FTS_INDEXES[fts_table]
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f'new.{column}' for column in columns)
+    old_values = ', '.join(f'old.{column}' for column in columns)
+    return [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(
+            {column_list},
+            content='{content_table}', content_rowid='id',
+            tokenize='porter unicode61', prefix='2 3'
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS {content_table}_fts_insert AFTER INSERT ON {content_table} BEGIN
+            INSERT INTO {fts_table} (rowid, {column_list}) VALUES (new.id, {new_values});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {content_table}_fts_delete AFTER DELETE ON {content_table} BEGIN
+            INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {content_table}_fts_update AFTER UPDATE OF {column_list} ON {content_table} BEGIN
+            INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+            INSERT INTO {fts_table} (rowid, {column_list}) VALUES (new.id, {new_values});
+        END""",
+    ]
+
+
+def migrate_full_text_search(conn):
+    for fts_table, (content_table, _) in FTS_INDEXES.items():
+        if not table_exists(conn, content_table):
+            continue
+        for statement in fts_statements(fts_table):
+            conn.execute(statement)
+        # Backfill existing rows; 'rebuild' re-reads the whole content table
+        conn.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')")
+        print(f"Built full-text index {fts_table}")
+    conn.commit()
+
+
+# Row counts maintained by triggers, so listings can show totals without COUNT(*)
+STATS_COUNTERS_TABLE = '''
+CREATE TABLE IF NOT EXISTS stats_counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID
+'''
+
+
+def create_row_counter(conn, name, table, condition=None):
+    """
+    Seed counter `name` with the number of rows in `table` and keep it current
+    with triggers. `condition` optionally restricts the count, written against
+    `{row}` (e.g. "{row}.is_active = 1"); conditional counters also follow
+    updates that flip the condition.
+    """
+    conn.execute(STATS_COUNTERS_TABLE)
+    if condition is None:
+        added, removed = '1', '1'
+    else:
+        added = f"({condition.format(row='NEW')})"
+        removed = f"({condition.format(row='OLD')})"
+
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {name}_count_insert AFTER INSERT ON {table} BEGIN
+            UPDATE stats_counters SET value = value + {added} WHERE name = '{name}';
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {name}_count_delete AFTER DELETE ON {table} BEGIN
+            UPDATE stats_counters SET value = value - {removed} WHERE name = '{name}';
+        END
+    ''')
+    if condition is not None:
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name}_count_update AFTER UPDATE ON {table} BEGIN
+                UPDATE stats_counters SET value = value + {added} - {removed} WHERE name = '{name}';
+            END
+        ''')
+    seed_row_counter(conn, name, table, condition)
+
+
+def seed_row_counter(conn, name, table, condition=None, schema='main'):
+    """Set counter `name` to the real number of matching rows in schema.table"""
+    where = f"WHERE {condition.format(row=table)}" if condition else ''
+    conn.execute(f'''
+        INSERT OR REPLACE INTO {schema}.stats_counters (name, value)
+        VALUES ('{name}', (SELECT COUNT(*) FROM {schema}.{table} {where}))
+    ''')
+
+
+# Migration 8: admin users list -- user counter and a trigram index for
+# substring search on username/email
+USERS_SEARCH_TABLE = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS users_search USING fts5(
+    username, email,
+    content='users', content_rowid='id',
+    tokenize='trigram'
+)
+'''
+
+
+def migrate_user_listing(conn):
+    create_row_counter(conn, 'users', 'users')
+
+    try:
+        conn.execute(USERS_SEARCH_TABLE)
+    except sqlite3.OperationalError as e:
+        # The trigram tokenizer needs SQLite 3.34+; the admin list falls back to LIKE
+        print(f"Skipping users_search index: {str(e)}")
+        conn.commit()
+        return
+
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_search_insert AFTER INSERT ON users BEGIN
+            INSERT INTO users_search (rowid, username, email) VALUES (new.id, new.username, new.email);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_search_delete AFTER DELETE ON users BEGIN
+            INSERT INTO users_search (users_search, rowid, username, email)
+            VALUES ('delete', old.id, old.username, old.email);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_search_update AFTER UPDATE OF username, email ON users BEGIN
+            INSERT INTO users_search (users_search, rowid, username, email)
+            VALUES ('delete', old.id, old.username, old.email);
+            INSERT INTO users_search (rowid, username, email) VALUES (new.id, new.username, new.email);
+        END
+    ''')
+    conn.execute("INSERT INTO users_search (users_search) VALUES ('rebuild')")
+    conn.commit()
+
+
+# Migration 9: dashboard counters and per-day activity buckets (see counters.py).
+# counter name -> (table, optional row condition)
+ROW_COUNTERS = {
+    'users': ('users', None),
+    'health_records': ('health_monitoring', None),
+    'disease_predictions': ('disease_predictions', None),
+    'prescriptions': ('medical_prescriptions', None),
+    'medical_records': ('medical_records', None),
+    'active_medications': ('medication_reminders', '{row}.is_active = 1'),
+}
+
+# Counters whose inserts are also tallied per UTC day
+DAILY_ACTIVITY_COUNTERS = ['users', 'health_records', 'disease_predictions', 'prescriptions', 'medical_records']
+
+DAILY_ACTIVITY_TABLE = '''
+CREATE TABLE IF NOT EXISTS daily_activity (
+    day TEXT NOT NULL,      -- UTC date, YYYY-MM-DD
+    name TEXT NOT NULL,     -- a ROW_COUNTERS name
+    value INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, name)
+) WITHOUT ROWID
+'''
+
+
+def migrate_activity_counters(conn):
+    conn.execute(DAILY_ACTIVITY_TABLE)
+    for name, (table, condition) in ROW_COUNTERS.items():
+        if not table_exists(conn, table):
+            continue
+        create_row_counter(conn, name, table, condition)
+        if name in DAILY_ACTIVITY_COUNTERS:
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {name}_daily_activity AFTER INSERT ON {table} BEGIN
+                    INSERT INTO daily_activity (day, name, value) VALUES (date('now'), '{name}', 1)
+                    ON CONFLICT (day, name) DO UPDATE SET value = value + 1;
+                END
+            ''')
+    conn.commit()
+
+
+# Migration 10: per-user timeline support (see timeline.py)
+# Epoch-ms twins for the two remaining timeline sources
+TIMELINE_TIMESTAMP_COLUMNS = {
+    'medical_records': 'uploaded_at',
+    'medical_prescriptions': 'created_at',
+}
+
+# Version per (user, table), bumped by triggers on every write, so caches of
+# a user's data can be validated with one primary-key lookup
+USER_DATA_VERSIONS_TABLE = '''
+CREATE TABLE IF NOT EXISTS user_data_versions (
+    user_id INTEGER NOT NULL,
+    table_name TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_ms INTEGER NOT NULL,   -- UTC epoch milliseconds of the last write
+    PRIMARY KEY (user_id, table_name)
+) WITHOUT ROWID
+'''
+
+_BUMP_VERSION = '''
+    INSERT INTO user_data_versions (user_id, table_name, version, updated_ms)
+    VALUES ({row}.user_id, '{table}', 1, CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER))
+    ON CONFLICT (user_id, table_name) DO UPDATE SET
+        version = version + 1, updated_ms = excluded.updated_ms;
+'''
+
+
+def migrate_user_timeline(conn):
+    for table, column in TIMELINE_TIMESTAMP_COLUMNS.items():
+        add_epoch_timestamp(conn, table, column)
+
+    conn.execute(USER_DATA_VERSIONS_TABLE)
+    for table in USER_TABLES:
+        if not table_exists(conn, table):
+            continue
+        for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table} BEGIN
+                    {_BUMP_VERSION.format(row=row, table=table)}
+                END
+            ''')
+    conn.commit()
+
+
+# Migration 11: indexes for the filtered admin listings (see admin_listing.py).
+# Every listing pages on (<ts>_ms, user_id, id) newest first, which an index
+# on (<ts>_ms, user_id) answers directly (the rowid is the implicit last
+# column); the type filter gets its own (type, <ts>_ms, user_id) index and the
+# user filter reuses the (user_id, <ts>_ms) indexes from migrations 2 and 10.
+ADMIN_LISTING_INDEXES = {
+    'health_monitoring': ('created_at_ms', None),
+    'medical_records': ('uploaded_at_ms', 'record_type'),
+    'activity_tracking': ('created_at_ms', 'activity_type'),
+    'bmi_history': ('recorded_at_ms', 'bmi_category'),
+    'medical_prescriptions': ('created_at_ms', 'specialization'),
+}
+
+
+def migrate_admin_listing_indexes(conn):
+    for table, (ts_column, type_column) in ADMIN_LISTING_INDEXES.items():
+        if not table_exists(conn, table):
+            continue
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{ts_column}_user ON {table} ({ts_column}, user_id)")
+        if type_column:
+            conn.execute(f"""
+                CREATE INDEX IF NOT EXISTS idx_{table}_{type_column}_{ts_column}
+                ON {table} ({type_column}, {ts_column}, user_id)
+            """)
+    # Superseded by idx_health_monitoring_created_at_ms_user, which serves the
+    # archiver's range scans just as well
+    conn.execute("DROP INDEX IF EXISTS idx_health_monitoring_created_at_ms")
+    conn.commit()
+
+
+# Migration 12: write-ahead logging. Readers (exports, dashboards) then work
+# from a snapshot and never block writers, nor writers them. The journal mode
+# is stored in the database file, so this only has to happen once.
+def migrate_wal_journal(conn):
+    conn.commit()
+    mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+    if mode.lower() != 'wal':
+        print(f"Could not switch to WAL (journal_mode is {mode})")
+
+
+# Migration 13: soft delete plus a resumable background purge (see purge.py).
+# Deleting a user only stamps users.deleted_at_ms; purge_jobs tracks the
+# batched removal of their rows, so a crashed purge picks up where it left off.
+PURGE_JOBS_TABLE = '''
+CREATE TABLE IF NOT EXISTS purge_jobs (
+    user_id INTEGER PRIMARY KEY,   -- no FOREIGN KEY: the users row goes last
+    username TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',   -- pending, running, done, failed
+    current_table TEXT,
+    rows_deleted INTEGER NOT NULL DEFAULT 0,
+    created_ms INTEGER NOT NULL,
+    updated_ms INTEGER,
+    finished_ms INTEGER,
+    lease_owner TEXT,
+    lease_until_ms INTEGER,
+    error TEXT
+)
+'''
+
+
+def migrate_user_purge(conn):
+    add_column_if_missing(conn, 'users', 'deleted_at_ms', 'INTEGER')
+    conn.execute(PURGE_JOBS_TABLE)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_purge_jobs_status ON purge_jobs (status)")
+    conn.commit()
+
+
+# Migration 14: per-table change tokens for conditional GETs of the admin
+# listings (see etags.py). Same idea as user_data_versions, one row per table;
+# users is included because the listings show usernames.
+TABLE_DATA_VERSIONS_TABLE = '''
+CREATE TABLE IF NOT EXISTS table_data_versions (
+    table_name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_ms INTEGER NOT NULL   -- UTC epoch milliseconds of the last write
+) WITHOUT ROWID
+'''
+
+VERSIONED_TABLES = list(ADMIN_LISTING_INDEXES) + ['users']
+
+# The listings only show these users columns; other updates (last_login on
+# every login, say) must not invalidate every cached listing page
+VERSIONED_COLUMNS = {'users': ('username', 'email', 'deleted_at_ms')}
+
+_BUMP_TABLE_VERSION = '''
+    INSERT INTO table_data_versions (table_name, version, updated_ms)
+    VALUES ('{table}', 1, CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER))
+    ON CONFLICT (table_name) DO UPDATE SET
+        version = version + 1, updated_ms = excluded.updated_ms;
+'''
+
+
+def _table_version_trigger(conn, table, event):
+    condition = event
+    if event == 'UPDATE' and table in VERSIONED_COLUMNS:
+        condition = f"UPDATE OF {', '.join(VERSIONED_COLUMNS[table])}"
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_table_version_{event.lower()} AFTER {condition} ON {table} BEGIN
+            {_BUMP_TABLE_VERSION.format(table=table)}
+        END
+    ''')
+
+
+def migrate_table_versions(conn):
+    conn.execute(TABLE_DATA_VERSIONS_TABLE)
+    for table in VERSIONED_TABLES:
+        if not table_exists(conn, table):
+            continue
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            _table_version_trigger(conn, table, event)
+    conn.commit()
+
+
+# Migration 15: databases migrated before VERSIONED_COLUMNS existed bump the
+# users version on any UPDATE; recreate those triggers with the column list.
+def migrate_versioned_columns(conn):
+    for table in VERSIONED_COLUMNS:
+        if not table_exists(conn, table):
+            continue
+        conn.execute(f"DROP TRIGGER IF EXISTS {table}_table_version_update")
+        _table_version_trigger(conn, table, 'UPDATE')
+    conn.commit()
+
+
+# Migration 16: admin users list -- a users counter that leaves out deleted
+# accounts still being purged, and case-insensitive indexes for the short
+# (prefix) search, which the trigram index does not cover.
+# counter name -> (table, row condition); created here rather than in
+# ROW_COUNTERS because deleted_at_ms only exists from migration 13
+PURGE_AWARE_COUNTERS = {
+    'active_users': ('users', '{row}.deleted_at_ms IS NULL'),
+}
+
+USERS_NOCASE_INDEXES = {
+    'idx_users_username_nocase': 'username',
+    'idx_users_email_nocase': 'email',
+}
+
+
+def migrate_active_user_listing(conn):
+    for name, (table, condition) in PURGE_AWARE_COUNTERS.items():
+        if table_exists(conn, table):
+            create_row_counter(conn, name, table, condition)
+    if table_exists(conn, 'users'):
+        for index, column in USERS_NOCASE_INDEXES.items():
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {index} ON users ({column} COLLATE NOCASE)")
+    conn.commit()
+
+
+MIGRATIONS = [
+    migrate_blood_pressure_columns,
+    migrate_epoch_timestamps,
+    migrate_foreign_keys,
+    migrate_health_data_layout,
+    migrate_metric_blocks,
+    migrate_archive_scan_indexes,
+    migrate_full_text_search,
+    migrate_user_listing,
+    migrate_activity_counters,
+    migrate_user_timeline,
+    migrate_admin_listing_indexes,
+    migrate_wal_journal,
+    migrate_user_purge,
+    migrate_table_versions,
+    migrate_versioned_columns,
+    migrate_active_user_listing,
+]
+
+
+def apply_migrations(conn):
+    """Apply every migration newer than the database's PRAGMA user_version"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        print(f"Applying migration {number}: {migration.__name__}")
+        migration(conn)
+        conn.execute(f"PRAGMA user_version = {number}")
+        conn.commit()
+
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else db_path
+    conn = sqlite3.connect(target)
+    try:
+        version = apply_migrations(conn)
+        print(f"Database {target} is at schema version {version}")
+    finally:
+        conn.close()
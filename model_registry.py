@@ -0,0 +1,272 @@
+import os
+import pickle
+import threading
+
+import pandas as pd
+
+# Disease prediction model and symptom lookups, loaded once per process
+#
+# /predict used to unpickle the model (and read four CSV files for the
+# fallback matcher) on every request. Everything is now loaded on first use,
+# or up front by preload(): the production server calls it before forking
+# its workers, so they all share one copy of the model and lookups
+# copy-on-write instead of loading their own.
+#
+# Loading never raises; a part that cannot be loaded is None and its error
+# is kept in model_error / dataset_error, so /predict falls back exactly as
+# before (model -> dataset matching -> built-in rules).
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+MODEL_FILES = {
+    'model': 'health_assistant_model.pkl',
+    'label_encoder': 'label_encoder.pkl',
+    'disease_precautions': 'disease_precautions.pkl',
+    'disease_descriptions': 'disease_descriptions.pkl',
+    'feature_names': 'feature_names.pkl',
+    'display_to_data': 'display_to_data.pkl',
+}
+
+DATASET_FILES = {
+    'diseases': 'Disease_Symptom_Dataset.csv',
+    'descriptions': 'symptom_Description.csv',
+    'precautions': 'symptom_precaution.csv',
+    'severity': 'Symptom-severity.csv',
+}
+
+
+class ModelRegistry:
+    def __init__(self):
+        self.model = None
+        self.model_error = None
+        self.dataset = None
+        self.dataset_error = None
+
+    def load_model(self):
+        """The pickled model parts as a dict, plus feature_index (name -> position)"""
+        if not os.path.exists(os.path.join(base_dir, MODEL_FILES['model'])):
+            raise FileNotFoundError("Model file not found")
+        parts = {}
+        for name, file_name in MODEL_FILES.items():
+            with open(os.path.join(base_dir, file_name), 'rb') as f:
+                parts[name] = pickle.load(f)
+        parts['feature_index'] = {}
+        for index, feature in enumerate(parts['feature_names']):
+            parts['feature_index'].setdefault(feature, index)
+        return parts
+
+    def load_dataset(self):
+        """
+        Lookups for the dataset-based matcher: disease rows with their
+        symptom lists, symptom severities, and the first description and
+        precautions listed for each disease
+        """
+        frames = {name: pd.read_csv(os.path.join(base_dir, file_name)) for name, file_name in DATASET_FILES.items()}
+
+        disease_data = frames['diseases']
+        symptom_columns = list(disease_data.columns[1:])
+        rows = []
+        for _, row in disease_data.iterrows():
+            symptoms = []
+            for col in symptom_columns:
+                value = row[col].strip() if isinstance(row[col], str) else row[col]
+                if pd.notna(value) and value != '':
+                    symptoms.append(value)
+            rows.append((row['Disease'], symptoms))
+
+        severity = {}
+        for _, row in frames['severity'].iterrows():
+            severity[row['Symptom']] = row['weight']
+
+        descriptions = {}
+        for _, row in frames['descriptions'].iterrows():
+            descriptions.setdefault(row['Disease'], row['Description'])
+
+        precautions = {}
+        for _, row in frames['precautions'].iterrows():
+            if row['Disease'] in precautions:
+                continue
+            precautions[row['Disease']] = [precaution for precaution in
+                                           (row.get(f'Precaution_{i}') for i in range(1, 5))
+                                           if pd.notna(precaution) and precaution]
+
+        return {'rows': rows, 'severity': severity, 'descriptions': descriptions, 'precautions': precautions}
+
+    def load(self):
+        try:
+            self.model = self.load_model()
+        except Exception as e:
+            self.model_error = str(e)
+        try:
+            self.dataset = self.load_dataset()
+        except Exception as e:
+            self.dataset_error = str(e)
+        return self
+
+
+_registry = None
+_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        with _lock:
+            if _registry is None:
+                _registry = ModelRegistry().load()
+    return _registry
+
+
+# Helper function to predict a disease from the selected symptoms
+def predict(symptoms):
+    """
+    (predicted_disease, confidence, description, precautions) for a list of
+    symptom names: the model when it is available, else the best dataset
+    match, else built-in rules
+    """
+    registry = get_registry()
+    try:
+        if registry.model is not None:
+            parts = registry.model
+            model = parts['model']
+            label_encoder = parts['label_encoder']
+            disease_precautions = parts['disease_precautions']
+            disease_descriptions = parts['disease_descriptions']
+            feature_names = parts['feature_names']
+            feature_index = parts['feature_index']
+            display_to_data = parts['display_to_data']
+
+            features = [0] * len(feature_names)
+            for symptom in symptoms:
+                if symptom in display_to_data:
+                    data_symptom = display_to_data[symptom]
+                    if data_symptom in feature_index:
+                        features[feature_index[data_symptom]] = 1
+                elif symptom in feature_index:
+                    features[feature_index[symptom]] = 1
+
+            prediction = model.predict([features])
+            predicted_disease = label_encoder.inverse_transform(prediction)[0]
+            confidence = max(model.predict_proba([features])[0])
+
+            description = disease_descriptions.get(predicted_disease, "No description available")
+            precautions = disease_precautions.get(predicted_disease, ["Consult a doctor"])
+
+            print(f"Model prediction: {predicted_disease} with confidence {confidence}")
+        else:
+            raise RuntimeError(registry.model_error or "Model file not found")
+    except Exception as e:
+        print(f"Error using model: {str(e)}, using dataset-based prediction")
+
+        try:
+            dataset = registry.dataset
+            if dataset is None:
+                raise RuntimeError(registry.dataset_error or "Dataset not loaded")
+
+            disease_matches = {}
+            symptom_severity = dataset['severity']
+
+            selected_severity = 0
+            for symptom in symptoms:
+                if symptom in symptom_severity:
+                    selected_severity += symptom_severity[symptom]
+
+            for disease, disease_symptoms in dataset['rows']:
+                match_count = 0
+                severity_score = 0
+                for symptom in symptoms:
+                    if symptom in disease_symptoms:
+                        match_count += 1
+                        if symptom in symptom_severity:
+                            severity_score += symptom_severity[symptom]
+
+                if len(disease_symptoms) > 0:
+                    match_percentage = match_count / len(disease_symptoms)
+                    if disease not in disease_matches or match_percentage > disease_matches[disease]['match_percentage']:
+                        disease_matches[disease] = {
+                            'match_count': match_count,
+                            'match_percentage': match_percentage,
+                            'severity_score': severity_score,
+                            'total_symptoms': len(disease_symptoms)
+                        }
+
+            if disease_matches:
+                sorted_matches = sorted(
+                    disease_matches.items(), 
+                    key=lambda x: (x[1]['match_percentage'], x[1]['severity_score']), 
+                    reverse=True
+                )
+
+                top_matches = sorted_matches[:3]
+                best_match = top_matches[0]
+                predicted_disease = best_match[0]
+                match_data = best_match[1]
+
+                confidence = min(0.95, match_data['match_percentage'] * 0.7 + 
+                                (match_data['severity_score'] / (selected_severity + 0.1)) * 0.3)
+
+                description = dataset['descriptions'].get(
+                    predicted_disease, f"Information about {predicted_disease} is not available.")
+                precautions = list(dataset['precautions'].get(
+                    predicted_disease, ["Consult a healthcare professional"]))
+
+                print(f"Dataset-based prediction: {predicted_disease} with confidence {confidence:.2f}")
+            else:
+                predicted_disease = "Unknown Condition"
+                confidence = 0.3
+                description = "Based on the symptoms provided, we couldn't determine a specific condition. Please consult a healthcare professional."
+                precautions = ["Consult a doctor", "Monitor your symptoms", "Rest and stay hydrated"]
+        except Exception as dataset_error:
+            print(f"Error using dataset for prediction: {str(dataset_error)}, using fallback prediction")
+            symptom_count = len(symptoms)
+
+            if "skin_rash" in symptoms and "itching" in symptoms:
+                predicted_disease = "Fungal infection"
+                confidence = 0.75
+                description = "A fungal infection is caused by fungi that take over an area of the body."
+                precautions = ["Keep the affected area clean and dry", "Use antifungal medications", "Maintain good hygiene"]
+            elif "high_fever" in symptoms and "headache" in symptoms and "chills" in symptoms:
+                predicted_disease = "Malaria"
+                confidence = 0.80
+                description = "Malaria is a serious disease caused by a parasite that is transmitted by the bite of infected mosquitoes."
+                precautions = ["Consult a doctor immediately", "Take prescribed medications", "Use mosquito repellent"]
+            elif "continuous_sneezing" in symptoms and "chills" in symptoms:
+                predicted_disease = "Allergy"
+                confidence = 0.70
+                description = "An allergy is an immune system response to a foreign substance that's not typically harmful to your body."
+                precautions = ["Avoid allergens", "Take antihistamines", "Use nasal sprays if prescribed"]
+            elif "vomiting" in symptoms and "stomach_pain" in symptoms:
+                predicted_disease = "GERD"
+                confidence = 0.65
+                description = "Gastroesophageal reflux disease (GERD) occurs when stomach acid frequently flows back into the tube connecting your mouth and stomach."
+                precautions = ["Avoid spicy and fatty foods", "Don't lie down after eating", "Elevate your head while sleeping"]
+            elif "fatigue" in symptoms and "weight_loss" in symptoms and "restlessness" in symptoms:
+                predicted_disease = "Diabetes"
+                confidence = 0.75
+                description = "Diabetes is a disease that occurs when your blood glucose is too high."
+                precautions = ["Monitor blood sugar regularly", "Follow a balanced diet", "Exercise regularly"]
+            elif symptom_count > 5:
+                predicted_disease = "Influenza"
+                confidence = 0.65
+                description = "Influenza is a viral infection that attacks your respiratory system."
+                precautions = ["Rest and drink plenty of fluids", "Take over-the-counter pain relievers", "Stay home to avoid spreading infection"]
+            elif "fatigue" in symptoms and "mild_fever" in symptoms:
+                predicted_disease = "Common Cold"
+                confidence = 0.70
+                description = "The common cold is a viral infection of your nose and throat."
+                precautions = ["Rest and stay hydrated", "Use saline nasal drops", "Take over-the-counter cold medications"]
+            else:
+                predicted_disease = "General Viral Infection"
+                confidence = 0.50
+                description = "A viral infection is any illness caused by a virus."
+                precautions = ["Rest well", "Stay hydrated", "Take fever reducers if needed"]
+
+    return predicted_disease, confidence, description, precautions
+
+
+def preload():
+    """Load everything now (before forking workers); returns the registry"""
+    registry = get_registry()
+    print(f"Model registry: model {'loaded' if registry.model else 'unavailable (' + str(registry.model_error) + ')'}, "
+          f"dataset {'loaded' if registry.dataset else 'unavailable (' + str(registry.dataset_error) + ')'}")
+    return registry
@@ -0,0 +1,286 @@
+import os
+import sys
+import time
+import socket
+import sqlite3
+import threading
+
+import sharding
+import archiver
+from db_utils import now_ms
+
+# Background purge of deleted users
+#
+# Deleting a user in the admin panel only stamps users.deleted_at_ms (login
+# is refused and listings hide the account from then on) and queues a
+# purge_jobs row (migration 13). A worker thread then deletes the user's rows
+# table by table in batches of PURGE_BATCH_SIZE, one short transaction each
+# with a pause in between, so other writers only ever wait for one batch.
+# The users row itself goes last.
+#
+# Progress (current table, rows deleted) is written to purge_jobs after every
+# batch. Deleting is idempotent, so a purge interrupted by a crash simply
+# starts again on the same job once its lease expires. With sharding the
+# user's shard is purged as well as central, and so are the archive files.
+#
+# Usage:
+#   python purge.py status           list purge jobs
+#   python purge.py run              run every pending (and failed) purge now
+
+PURGE_BATCH_SIZE = 500
+PURGE_PAUSE_SECONDS = 0.05
+PURGE_LEASE_MS = 60 * 1000
+PURGE_POLL_SECONDS = 30
+
+# Rows referencing other per-user rows go first (medication_history.reminder_id
+# would otherwise be SET NULL row by row as reminders are deleted)
+PURGE_TABLES = ['medication_history'] + [table for table in sharding.SHARDED_TABLES if table != 'medication_history']
+
+_worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def _connect(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA busy_timeout = 5000')
+    return conn
+
+
+def schedule_purge(conn, user_id):
+    """
+    Mark a user deleted and queue their purge on `conn` (central database)
+
+    Returns False when the user does not exist. Re-deleting a user whose
+    purge failed queues it again.
+    """
+    stamp = now_ms()
+    cursor = conn.execute("UPDATE users SET deleted_at_ms = COALESCE(deleted_at_ms, ?) WHERE id = ?", (stamp, user_id))
+    if cursor.rowcount == 0:
+        return False
+    conn.execute('''
+        INSERT INTO purge_jobs (user_id, username, created_ms)
+        SELECT id, username, ? FROM users WHERE id = ?
+        ON CONFLICT (user_id) DO UPDATE SET
+            status = CASE WHEN status = 'failed' THEN 'pending' ELSE status END,
+            error = NULL
+    ''', (stamp, user_id))
+    conn.commit()
+    _wake.set()
+    return True
+
+
+def job_status(conn, user_id=None):
+    """purge_jobs rows (newest first) as dicts, optionally for one user"""
+    sql = "SELECT * FROM purge_jobs"
+    params = ()
+    if user_id is not None:
+        sql += " WHERE user_id = ?"
+        params = (user_id,)
+    try:
+        cursor = conn.execute(sql + " ORDER BY created_ms DESC", params)
+    except sqlite3.OperationalError:
+        return []
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def _claim_next(conn):
+    """Take the lease on the oldest unfinished job nobody else holds; its user_id or None"""
+    now = now_ms()
+    free = "(lease_owner IS NULL OR lease_owner = ? OR lease_until_ms < ?)"
+    row = conn.execute(f'''
+        SELECT user_id FROM purge_jobs
+        WHERE status IN ('pending', 'running') AND {free}
+        ORDER BY created_ms LIMIT 1
+    ''', (_worker_id, now)).fetchone()
+    if not row:
+        return None
+    cursor = conn.execute(f'''
+        UPDATE purge_jobs SET status = 'running', lease_owner = ?, lease_until_ms = ?, updated_ms = ?
+        WHERE user_id = ? AND {free}
+    ''', (_worker_id, now + PURGE_LEASE_MS, now, row[0], _worker_id, now))
+    conn.commit()
+    return row[0] if cursor.rowcount else None
+
+
+def _row_key(conn, schema, table):
+    """Columns identifying a row: rowid, or the primary key of a WITHOUT ROWID table"""
+    sql = conn.execute(f"SELECT sql FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+    if 'WITHOUT ROWID' not in sql.upper():
+        return ['rowid']
+    return [name for _, name in sorted((row[5], row[1]) for row in
+                                       conn.execute(f"PRAGMA {schema}.table_info({table})").fetchall() if row[5])]
+
+
+def _tables(conn, schema):
+    return {row[0] for row in conn.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'").fetchall()}
+
+
+# Helper function to delete one user's rows from one table in small batches
+def purge_table(conn, central, schema, table, user_id, batch_size=PURGE_BATCH_SIZE, pause=PURGE_PAUSE_SECONDS):
+    """
+    Delete `user_id`'s rows from schema.table on `conn`, one batch per
+    transaction, recording progress (and renewing the lease) on `central`
+    after each batch. Returns the number of rows deleted.
+    """
+    key = ', '.join(_row_key(conn, schema, table))
+    deleted = 0
+    while True:
+        cursor = conn.execute(f'''
+            DELETE FROM {schema}.{table} WHERE ({key}) IN (
+                SELECT {key} FROM {schema}.{table} WHERE user_id = ? LIMIT ?
+            )
+        ''', (user_id, batch_size))
+        count = cursor.rowcount
+        if schema == 'archive' and count:
+            # Keep the archived totals shown on the dashboard in step
+            conn.execute('''
+                UPDATE archive.archive_state SET rows_archived = MAX(rows_archived - ?, 0) WHERE table_name = ?
+            ''', (count, table))
+        now = now_ms()
+        progress = central.execute('''
+            UPDATE purge_jobs SET current_table = ?, rows_deleted = rows_deleted + ?,
+                                  updated_ms = ?, lease_until_ms = ?
+            WHERE user_id = ? AND lease_owner = ?
+        ''', (f"{schema}.{table}" if schema != 'main' else table, count, now, now + PURGE_LEASE_MS,
+              user_id, _worker_id))
+        if progress.rowcount == 0:
+            conn.rollback()
+            central.rollback()
+            raise LeaseLost(f"Lost the purge lease for user {user_id}")
+        conn.commit()
+        if central is not conn:
+            central.commit()
+
+        deleted += count
+        if count < batch_size:
+            return deleted
+        time.sleep(pause)
+
+
+def _purge_database(conn, central, user_id):
+    deleted = 0
+    tables = _tables(conn, 'main')
+    for table in PURGE_TABLES:
+        if table in tables:
+            deleted += purge_table(conn, central, 'main', table, user_id)
+
+    # Rows the archiver moved out of this database
+    if os.path.exists(archiver.archive_path_for(archiver.main_db_path(conn))):
+        archiver.attach_archive(conn)
+        archived = _tables(conn, 'archive')
+        for table in archiver.ARCHIVED_TABLES:
+            if table in archived:
+                deleted += purge_table(conn, central, 'archive', table, user_id)
+
+    if 'user_data_versions' in tables:
+        conn.execute("DELETE FROM main.user_data_versions WHERE user_id = ?", (user_id,))
+        conn.commit()
+    return deleted
+
+
+def purge_user(central, user_id):
+    """Purge every row of a claimed job's user, then the users row; returns rows deleted"""
+    deleted = _purge_database(central, central, user_id)
+    if sharding.sharding_enabled():
+        shard = sharding.connect_for_user(user_id)
+        try:
+            deleted += _purge_database(shard, central, user_id)
+        finally:
+            shard.close()
+
+    now = now_ms()
+    central.execute("DELETE FROM users WHERE id = ?", (user_id,))
+    central.execute('''
+        UPDATE purge_jobs SET status = 'done', current_table = NULL, finished_ms = ?, updated_ms = ?,
+                              lease_owner = NULL, lease_until_ms = NULL
+        WHERE user_id = ?
+    ''', (now, now, user_id))
+    central.commit()
+    return deleted
+
+
+def run_pending():
+    """Run purges until no unleased job is left; returns the number completed"""
+    central = _connect(sharding.central_db_path)
+    central.execute('PRAGMA foreign_keys = ON')
+    completed = 0
+    try:
+        while True:
+            user_id = _claim_next(central)
+            if user_id is None:
+                return completed
+            try:
+                deleted = purge_user(central, user_id)
+                completed += 1
+                print(f"Purged user {user_id}: {deleted} rows deleted")
+            except LeaseLost as e:
+                print(f"Purge stopped: {str(e)}")
+            except Exception as e:
+                central.rollback()
+                central.execute('''
+                    UPDATE purge_jobs SET status = 'failed', error = ?, updated_ms = ?,
+                                          lease_owner = NULL, lease_until_ms = NULL
+                    WHERE user_id = ?
+                ''', (str(e), now_ms(), user_id))
+                central.commit()
+                print(f"Purge of user {user_id} failed: {str(e)}")
+    finally:
+        central.close()
+
+
+_purger_thread = None
+_wake = threading.Event()
+
+
+def start_background_purger(interval=PURGE_POLL_SECONDS):
+    """
+    Run pending purges on a daemon thread, woken by schedule_purge and
+    otherwise every `interval` seconds, which also resumes jobs left behind
+    by a crashed process once their lease has expired
+    """
+    global _purger_thread
+    if _purger_thread and _purger_thread.is_alive():
+        return _purger_thread
+
+    def run():
+        while True:
+            try:
+                run_pending()
+            except Exception as e:
+                print(f"Purge worker error: {str(e)}")
+            _wake.wait(interval)
+            _wake.clear()
+
+    _purger_thread = threading.Thread(target=run, name='user-purger', daemon=True)
+    _purger_thread.start()
+    return _purger_thread
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == 'status':
+        conn = _connect(sharding.central_db_path)
+        try:
+            for job in job_status(conn):
+                print(f"user {job['user_id']} ({job['username']}): {job['status']}, "
+                      f"{job['rows_deleted']} rows deleted"
+                      f"{', at ' + job['current_table'] if job['current_table'] else ''}"
+                      f"{', error: ' + job['error'] if job['error'] else ''}")
+        finally:
+            conn.close()
+    elif command == 'run':
+        conn = _connect(sharding.central_db_path)
+        try:
+            conn.execute("UPDATE purge_jobs SET status = 'pending', error = NULL WHERE status = 'failed'")
+            conn.commit()
+        finally:
+            conn.close()
+        print(f"{run_pending()} purges completed")
+    else:
+        print("Usage: python purge.py status | run")
+        sys.exit(1)
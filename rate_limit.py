@@ -0,0 +1,243 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from flask import jsonify, session
+
+# Per-user rate limiting and load shedding for expensive routes
+#
+# Rate limiting: each (user_id, route) pair has a token bucket holding up to
+# `burst` tokens, refilled continuously at `per_minute` tokens a minute. A
+# request takes one token, or is answered 429 with Retry-After set to when
+# the next token arrives. A decision is a few arithmetic operations on one
+# bucket, whatever the number of users.
+#
+# Buckets live in a backend with a single method, take(key, burst, rate,
+# now), returning 0 when a token was taken or the seconds to wait:
+#   memory   per-process dict; each key hashes to one of LOCK_STRIPES locks,
+#            so requests of different users rarely wait on each other
+#   sqlite   buckets in a SQLite file shared by every worker on the host,
+#            one atomic UPSERT ... RETURNING per decision (with N workers the
+#            memory backend would grant each user N times the limit)
+# Another shared store (e.g. Redis) plugs in by adding a class to BACKENDS.
+#
+# Load shedding: a front proxy can stamp when it received a request
+# (X-Request-Start, which Heroku's router sets, or nginx with
+# proxy_set_header X-Request-Start "t=${msec}"). A request that has already
+# waited more than LOAD_SHED_QUEUE_MS for a worker is answered 503 at once:
+# its client has most likely given up, and serving it would only make every
+# request behind it wait longer. asgi.py stamps requests itself as well, so
+# time spent waiting for a WSGI bridge thread counts too.
+#
+# Settings (environment): RATE_LIMIT_BACKEND, RATE_LIMIT_DB,
+# RATE_LIMIT_<ROUTE> as "per_minute:burst" (0 turns a limit off),
+# LOAD_SHED_QUEUE_MS (0 turns shedding off)
+#
+# Usage:
+#   @app.route('/predict', methods=['POST'])
+#   @login_required
+#   @rate_limit.limit('predict')
+#   def predict_disease(): ...
+#
+#   app.wsgi_app = rate_limit.LoadSheddingMiddleware(app.wsgi_app)
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_DB = os.environ.get('RATE_LIMIT_DB', os.path.join(base_dir, '.rate_limit.db'))
+LOCK_STRIPES = 64
+
+# Past this many buckets the memory backend starts over; a dropped bucket
+# only means its user gets a full burst again
+MAX_MEMORY_BUCKETS = 100000
+
+LOAD_SHED_QUEUE_MS = int(os.environ.get('LOAD_SHED_QUEUE_MS', '5000'))
+
+# environ key asgi.py sets to the time.time() a request arrived
+REQUEST_START_KEY = 'healthcare.request_start'
+
+
+def _limit(route, default):
+    """(per_minute, burst) from RATE_LIMIT_<ROUTE>, e.g. RATE_LIMIT_PREDICT=30:10"""
+    value = os.environ.get(f"RATE_LIMIT_{route.upper()}", default)
+    per_minute, _, burst = value.partition(':')
+    per_minute = float(per_minute)
+    return per_minute, max(1, int(burst or per_minute or 1))
+
+
+# route -> (tokens per minute, burst)
+RATE_LIMITS = {
+    'predict': _limit('predict', '30:10'),
+    'wearable_ingest': _limit('wearable_ingest', '60:20'),
+    'health_advice': _limit('health_advice', '20:5'),
+}
+
+TAKE_TOKEN_SQL = '''
+INSERT INTO buckets (key, tokens, updated_at, allowed)
+VALUES (:key, :burst - 1, :now, 1)
+ON CONFLICT(key) DO UPDATE SET
+    tokens = MIN(:burst, tokens + (:now - updated_at) * :rate)
+             - (MIN(:burst, tokens + (:now - updated_at) * :rate) >= 1),
+    updated_at = :now,
+    allowed = MIN(:burst, tokens + (:now - updated_at) * :rate) >= 1
+RETURNING tokens, allowed
+'''
+
+
+class MemoryBackend:
+    def __init__(self, stripes=LOCK_STRIPES):
+        self.buckets = {}
+        self.locks = [threading.Lock() for _ in range(stripes)]
+
+    def take(self, key, burst, rate, now):
+        with self.locks[hash(key) % len(self.locks)]:
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if len(self.buckets) >= MAX_MEMORY_BUCKETS and key not in self.buckets:
+                self.buckets.clear()
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                return 0
+            self.buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+
+
+class SqliteBackend:
+    def __init__(self, path=RATE_LIMIT_DB):
+        self.path = path
+        self.local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            # Losing the last few decisions in a power cut is harmless
+            conn.execute('PRAGMA synchronous = OFF')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL,   -- epoch seconds
+                    allowed INTEGER NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    def take(self, key, burst, rate, now):
+        tokens, allowed = self._connection().execute(
+            TAKE_TOKEN_SQL, {'key': key, 'burst': burst, 'rate': rate, 'now': now}).fetchone()
+        return 0 if allowed else (1 - tokens) / rate
+
+
+BACKENDS = {'memory': MemoryBackend, 'sqlite': SqliteBackend}
+
+_backend = None
+_backend_lock = threading.Lock()
+_counts = {'allowed': 0, 'limited': 0, 'shed': 0, 'errors': 0}
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = BACKENDS[RATE_LIMIT_BACKEND]()
+    return _backend
+
+
+def check(user_id, route):
+    """Seconds until `user_id` may call `route` again, or 0 if this call is allowed (and counted)"""
+    per_minute, burst = RATE_LIMITS.get(route, (0, 0))
+    if not per_minute or user_id is None:
+        return 0
+    try:
+        wait = get_backend().take(f"{route}:{user_id}", burst, per_minute / 60, time.time())
+    except sqlite3.Error as e:
+        # Fail open: a limiter problem must not take the routes down with it
+        print(f"Rate limiter error: {str(e)}")
+        _counts['errors'] += 1
+        return 0
+    _counts['limited' if wait else 'allowed'] += 1
+    return wait
+
+
+def limit(route):
+    """Route decorator: answer 429 once the logged-in user has used up `route`'s bucket"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            wait = check(session.get('user_id'), route)
+            if wait:
+                return (jsonify({'success': False, 'error': 'Too many requests, please slow down'}), 429,
+                        {'Retry-After': str(math.ceil(wait))})
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def parse_request_start(value):
+    """
+    Epoch seconds from an X-Request-Start value: "t=1700000000.123" (nginx
+    $msec), or whole milliseconds (Heroku) or microseconds (Apache %D), with
+    or without the "t=" prefix. None if it cannot be read.
+    """
+    if not value:
+        return None
+    try:
+        stamp = float(value.strip().removeprefix('t='))
+    except ValueError:
+        return None
+    if stamp > 1e14:
+        return stamp / 1e6
+    if stamp > 1e11:
+        return stamp / 1e3
+    return stamp
+
+
+def queue_time_ms(environ, now=None):
+    """How long the request waited before reaching the app, or None if nothing stamped it"""
+    stamps = [stamp for stamp in (parse_request_start(environ.get('HTTP_X_REQUEST_START')),
+                                  environ.get(REQUEST_START_KEY)) if stamp]
+    if not stamps:
+        return None
+    # Clocks of the proxy and this host may disagree by a little
+    return max(0.0, ((now or time.time()) - min(stamps)) * 1000)
+
+
+def should_shed(environ, threshold_ms=LOAD_SHED_QUEUE_MS):
+    if not threshold_ms:
+        return False
+    waited = queue_time_ms(environ)
+    if waited is None or waited <= threshold_ms:
+        return False
+    _counts['shed'] += 1
+    return True
+
+
+SHED_BODY = json.dumps({'success': False, 'error': 'Server busy, please retry'}).encode()
+SHED_HEADERS = [('Content-Type', 'application/json'), ('Content-Length', str(len(SHED_BODY))), ('Retry-After', '1')]
+
+
+class LoadSheddingMiddleware:
+    """Answer 503 without running the app when a request queued longer than threshold_ms"""
+
+    def __init__(self, app, threshold_ms=LOAD_SHED_QUEUE_MS):
+        self.app = app
+        self.threshold_ms = threshold_ms
+
+    def __call__(self, environ, start_response):
+        if should_shed(environ, self.threshold_ms):
+            start_response('503 Service Unavailable', list(SHED_HEADERS))
+            return [SHED_BODY]
+        return self.app(environ, start_response)
+
+
+def stats():
+    return {'backend': RATE_LIMIT_BACKEND, 'limits': RATE_LIMITS, 'load_shed_queue_ms': LOAD_SHED_QUEUE_MS,
+            **_counts}
@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, render_template, session
+from jinja2 import meta
+
+# Full-page cache for templates whose only per-request input is the user
+#
+# Pages like health_monitor.html are plain layouts plus client-side code;
+# the only thing that differs between requests is current_user (set by
+# inject_user from the session). Their rendered HTML is kept per
+# (template, username, template version) and served without touching Jinja.
+# The version is the modification time of the template and every template
+# it extends or includes, so editing any of them renders the page afresh.
+#
+# Entries are evicted least recently used once the cached pages add up to
+# RENDER_CACHE_CHARS characters. stats() reports the hit rate and the render
+# time hits have saved (the time each page took to render, per hit).
+#
+# Usage:
+#   return render_cache.render_page('health_monitor.html')
+
+RENDER_CACHE_CHARS = 32 * 1024 * 1024
+
+
+class RenderCache:
+    def __init__(self, max_chars=RENDER_CACHE_CHARS):
+        self.max_chars = max_chars
+        self.size = 0
+        self.entries = OrderedDict()
+        self.dependencies = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def template_files(self, env, name):
+        """Source files of `name` and every template it extends or includes"""
+        files = self.dependencies.get(name)
+        if files is None:
+            files, pending, seen = [], [name], set()
+            while pending:
+                current = pending.pop()
+                if current in seen:
+                    continue
+                seen.add(current)
+                source, filename, _ = env.loader.get_source(env, current)
+                files.append(filename)
+                pending.extend(ref for ref in meta.find_referenced_templates(env.parse(source)) if ref)
+            self.dependencies[name] = files
+        return files
+
+    def template_version(self, env, name):
+        try:
+            return tuple(os.path.getmtime(filename) for filename in self.template_files(env, name))
+        except OSError:
+            # A template was moved or deleted; look its dependencies up again
+            self.dependencies.pop(name, None)
+            return None
+
+    def render(self, template_name, user_key, **context):
+        """Rendered `template_name` for `user_key`, from the cache when still current"""
+        version = self.template_version(current_app.jinja_env, template_name)
+        key = (template_name, user_key)
+        if version is not None:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None and entry[0] == version:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    self.saved_seconds += entry[2]
+                    return entry[1]
+                self.misses += 1
+
+        started = time.perf_counter()
+        html = render_template(template_name, **context)
+        elapsed = time.perf_counter() - started
+
+        if version is not None and len(html) <= self.max_chars // 8:
+            with self.lock:
+                previous = self.entries.pop(key, None)
+                if previous is not None:
+                    self.size -= len(previous[1])
+                self.entries[key] = (version, html, elapsed)
+                self.size += len(html)
+                while self.size > self.max_chars:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.size -= len(evicted[1])
+        return html
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'render_ms_saved': round(self.saved_seconds * 1000, 1),
+                'entries': len(self.entries),
+                'cached_chars': self.size,
+            }
+
+
+_cache = RenderCache()
+
+
+def render_page(template_name):
+    """Render a page that only depends on current_user, cached per username"""
+    user_key = session.get('username', 'User') if session.get('user_id') else None
+    return _cache.render(template_name, user_key)
+
+
+def stats():
+    return _cache.stats()
@@ -0,0 +1,147 @@
+import re
+import sys
+from markupsafe import escape
+
+from migrations import FTS_INDEXES
+
+# Ranked full-text search over prescriptions and medical records
+#
+# Backed by the prescriptions_fts and records_fts FTS5 tables created by
+# migration 7. Both are external-content tables kept in sync by triggers and
+# also index user_id, so a patient's search intersects the term posting
+# lists with their own user_id instead of filtering every match.
+
+_TERM_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+MAX_TERMS = 8
+
+# (fts table, content table, text columns, bm25 weights for the text columns)
+SEARCH_SOURCES = {
+    'prescriptions': ('prescriptions_fts', 'medical_prescriptions',
+                      ('diagnosis', 'medications', 'doctor_name'), (5.0, 3.0, 2.0)),
+    'records': ('records_fts', 'medical_records', ('record_name', 'notes'), (4.0, 1.0)),
+}
+
+SOURCE_COLUMNS = {
+    'prescriptions': 'c.doctor_name, c.specialization, c.patient_name, c.diagnosis, c.medications, c.created_at',
+    'records': 'c.record_name, c.record_type, c.provider, c.notes, c.record_date, c.uploaded_at AS created_at',
+}
+
+
+# Helper function to turn free text into a safe FTS5 prefix query
+def build_match_query(text):
+    """
+    Build an FTS5 MATCH expression from user input
+
+    Every word becomes a quoted prefix term ("metfo"*), so FTS5 operators and
+    punctuation typed by the user can never produce a syntax error. Terms are
+    ANDed together. Returns None when the input has no searchable words.
+    """
+    terms = _TERM_PATTERN.findall(text or '')[:MAX_TERMS]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def source_match(source, match, user_id=None):
+    """Restrict a MATCH expression to a source's text columns and optionally one user"""
+    columns = ' '.join(SEARCH_SOURCES[source][2])
+    expression = f"{{{columns}}} : ({match})"
+    if user_id is not None:
+        expression += f' AND user_id : "{int(user_id)}"'
+    return expression
+
+
+def search_sql(source):
+    """SQL for one source; params are (match, limit)"""
+    fts_table, content_table, columns, weights = SEARCH_SOURCES[source]
+    text_columns = {name: index for index, name in enumerate(columns)}
+    snippets = ',\n               '.join(
+        f"snippet({fts_table}, {index}, char(2), char(3), '...', 12) AS snippet_{name}"
+        for name, index in text_columns.items())
+    # user_id is the last FTS column and gets no weight in the ranking
+    bm25_weights = ', '.join(str(weight) for weight in weights + (0.0,))
+
+    return f'''
+        SELECT c.id, c.user_id, u.username, '{source}' AS source,
+               {SOURCE_COLUMNS[source]},
+               {snippets},
+               -bm25({fts_table}, {bm25_weights}) AS score
+        FROM {fts_table}
+        JOIN {content_table} c ON c.id = {fts_table}.rowid
+        JOIN users u ON u.id = c.user_id
+        WHERE {fts_table} MATCH ?
+        ORDER BY score DESC
+        LIMIT ?
+    '''
+
+
+def pick_snippet(item, source):
+    """
+    Keep the first snippet that actually contains a match, HTML-escaped with
+    the matched terms wrapped in <mark>
+    """
+    columns = SEARCH_SOURCES[source][2]
+    snippets = [item.pop(f'snippet_{name}', None) for name in columns]
+    snippet = next((s for s in snippets if s and '\x02' in s), snippets[0]) or ''
+    item['snippet'] = str(escape(snippet)).replace('\x02', '<mark>').replace('\x03', '</mark>')
+    return item
+
+
+def search(conn, text, sources=None, user_id=None, limit=20):
+    """
+    Search one connection's FTS indexes
+
+    Args:
+        text: raw user input; see build_match_query
+        sources: iterable of SEARCH_SOURCES keys (default: all)
+        user_id: restrict results to this user's rows (patients); None for admins
+        limit: maximum results per source
+
+    Returns a list of dicts ordered by relevance (highest score first).
+    """
+    match = build_match_query(text)
+    if match is None:
+        return []
+
+    results = []
+    for source in sources or SEARCH_SOURCES:
+        params = (source_match(source, match, user_id), limit)
+        for row in conn.execute(search_sql(source), params).fetchall():
+            if row is None:
+                continue
+            results.append(pick_snippet(dict(row), source))
+
+    results.sort(key=lambda item: item['score'], reverse=True)
+    return results[:limit]
+
+
+def rebuild_indexes(conn):
+    """Re-read every content table into its FTS index, then merge the index segments"""
+    for fts_table in FTS_INDEXES:
+        conn.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')")
+        conn.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('optimize')")
+        print(f"Rebuilt {fts_table}")
+    conn.commit()
+
+
+if __name__ == "__main__":
+    # Backfill job: python search.py rebuild
+    import sqlite3
+    import sharding
+    if len(sys.argv) < 2 or sys.argv[1] != 'rebuild':
+        print("Usage: python search.py rebuild")
+        sys.exit(1)
+
+    conn = sqlite3.connect(sharding.central_db_path)
+    try:
+        rebuild_indexes(conn)
+    finally:
+        conn.close()
+    if sharding.sharding_enabled():
+        for index in range(sharding.SHARD_COUNT):
+            conn = sharding.connect_shard(index)
+            try:
+                rebuild_indexes(conn)
+            finally:
+                conn.close()
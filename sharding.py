@@ -0,0 +1,297 @@
+import sqlite3
+import os
+import re
+import sys
+import heapq
+import zlib
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from migrations import USER_TABLES, FTS_INDEXES, ROW_COUNTERS, seed_row_counter
+
+# Optional per-user sharding of health.db
+#
+# When HEALTH_DB_SHARDS is set to N > 0, rows of the per-user tables live in
+# one of N SQLite files chosen by a hash of user_id, so N writers can commit
+# in parallel. users, metrics and everything else stay in the central
+# health.db, which every shard connection ATTACHes as `central`. Unqualified
+# table names resolve to the shard first and then to central, so existing
+# queries (including `SELECT ... FROM users`) work unchanged on a shard
+# connection.
+#
+# Shards carry no FOREIGN KEY to users/metrics because SQLite cannot enforce
+# constraints across attached files; user_id validity is checked against the
+# central users table by the write paths. Row ids are unique per shard only,
+# so rows moved by rebalance() get new ids in their target shard.
+#
+# Usage:
+#   python sharding.py rebalance [--dry-run]   move rows to their current shard
+#   python sharding.py status                  row counts per shard
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+central_db_path = os.path.join(base_dir, 'health.db')
+
+SHARD_COUNT = int(os.environ.get('HEALTH_DB_SHARDS', '0'))
+SHARD_DIR = os.environ.get('HEALTH_DB_SHARD_DIR', os.path.join(base_dir, 'shards'))
+
+# Per-user tables that are routed to shards
+SHARDED_TABLES = USER_TABLES + ['metric_blocks']
+
+# Full-text indexes, trigger-maintained counters and data versions over
+# sharded tables; each shard keeps its own for the rows it holds
+SHARD_LOCAL_INDEXES = list(FTS_INDEXES) + ['stats_counters', 'daily_activity', 'user_data_versions',
+                                           'table_data_versions']
+
+_schema_lock = threading.Lock()
+_initialized_shards = set()
+
+
+def sharding_enabled():
+    return SHARD_COUNT > 0
+
+
+def shard_for_user(user_id, shard_count=None):
+    """Stable shard index for a user; crc32 so every process agrees"""
+    shard_count = shard_count or SHARD_COUNT
+    return zlib.crc32(str(int(user_id)).encode()) % shard_count
+
+
+def shard_path(index):
+    return os.path.join(SHARD_DIR, f'health_shard_{index:03d}.db')
+
+
+def existing_shard_indexes():
+    if not os.path.isdir(SHARD_DIR):
+        return []
+    indexes = []
+    for name in os.listdir(SHARD_DIR):
+        match = re.match(r'^health_shard_(\d+)\.db$', name)
+        if match:
+            indexes.append(int(match.group(1)))
+    return sorted(indexes)
+
+
+def _strip_central_references(sql):
+    # Drop FOREIGN KEY clauses that point at tables living in the central file
+    return re.sub(r',\s*FOREIGN KEY\s*\(\w+\)\s*REFERENCES\s+(users|metrics)\s*\(id\)(\s+ON DELETE [A-Z ]+?)?(?=\s*[,)])',
+                  '', sql)
+
+
+# Helper function to create or update a shard's tables from the central schema
+def ensure_shard_schema(conn):
+    """
+    Mirror the central definitions of SHARDED_TABLES (columns, indexes and
+    triggers) and their full-text indexes into the shard opened on `conn`.
+    Missing columns added by later migrations are appended, so shards follow
+    the central schema over time.
+    """
+    mirrored = SHARDED_TABLES + SHARD_LOCAL_INDEXES
+    central = conn.execute('''
+        SELECT type, name, tbl_name, sql FROM central.sqlite_master
+        WHERE sql IS NOT NULL AND tbl_name IN ({})
+        ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END
+    '''.format(','.join('?' * len(mirrored))), mirrored).fetchall()
+    local = {row[0] for row in conn.execute("SELECT name FROM main.sqlite_master").fetchall()}
+    created_counters = 'stats_counters' not in local and any(row[1] == 'stats_counters' for row in central)
+
+    for object_type, name, table, sql in central:
+        if object_type == 'table':
+            if name not in local:
+                conn.execute(_strip_central_references(sql))
+                if name in FTS_INDEXES:
+                    conn.execute(f"INSERT INTO main.{name} ({name}) VALUES ('rebuild')")
+                continue
+            local_columns = {row[1] for row in conn.execute(f"PRAGMA main.table_info({name})").fetchall()}
+            for column in conn.execute(f"PRAGMA central.table_info({name})").fetchall():
+                if column[1] not in local_columns:
+                    default = f" DEFAULT {column[4]}" if column[4] is not None else ''
+                    conn.execute(f"ALTER TABLE main.{name} ADD COLUMN {column[1]} {column[2]}{default}")
+        elif name not in local:
+            conn.execute(sql)
+
+    # A new shard-local counter table starts empty; count what the shard holds
+    if created_counters:
+        for counter, (counted_table, condition) in ROW_COUNTERS.items():
+            if counted_table in SHARDED_TABLES:
+                seed_row_counter(conn, counter, counted_table, condition)
+    conn.commit()
+
+
+def connect_shard(index):
+    """Open shard `index` with the central database attached as `central`"""
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    path = shard_path(index)
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA busy_timeout = 5000')
+    conn.execute("ATTACH DATABASE ? AS central", (central_db_path,))
+    conn.execute('PRAGMA foreign_keys = ON')
+
+    if path not in _initialized_shards:
+        with _schema_lock:
+            if path not in _initialized_shards:
+                # Same journal mode as central (migration 12); persists in the file
+                conn.execute('PRAGMA main.journal_mode = WAL')
+                ensure_shard_schema(conn)
+                _initialized_shards.add(path)
+    return conn
+
+
+def connect_for_user(user_id):
+    return connect_shard(shard_for_user(user_id))
+
+
+# Helper function to run the same query on every shard and merge the results
+def fan_out_query(sql, params=(), sort_key=None, reverse=False, limit=None):
+    """
+    Run `sql` on every shard in parallel and merge the rows
+
+    Each shard's result must already be ordered by sort_key (in the same
+    direction as `reverse`); the per-shard lists are then k-way merged, so a
+    query ending in `ORDER BY x DESC LIMIT n` gives the global top n.
+
+    Returns a list of dicts.
+    """
+    def run(index):
+        conn = connect_shard(index)
+        try:
+            return [dict(row) for row in conn.execute(sql, params).fetchall()]
+        finally:
+            conn.close()
+
+    with ThreadPoolExecutor(max_workers=min(SHARD_COUNT, 16)) as executor:
+        results = list(executor.map(run, range(SHARD_COUNT)))
+
+    if sort_key is None:
+        merged = itertools.chain.from_iterable(results)
+    else:
+        merged = heapq.merge(*results, key=sort_key, reverse=reverse)
+    return list(itertools.islice(merged, limit))
+
+
+# Columns of sharded tables that hold the id of another sharded table's row;
+# rebalance() rewrites them, since moved rows get new ids in their target
+ID_REFERENCES = {
+    'medication_history': {'reminder_id': 'medication_reminders'},
+}
+
+
+# Helper function to copy one user's rows of `table` into the attached target
+def _move_rows(conn, table, user_id):
+    info = conn.execute(f"PRAGMA main.table_info({table})").fetchall()
+    # An INTEGER PRIMARY KEY is a per-file row id; the target assigns its own
+    id_column = next((row[1] for row in info if row[5] == 1 and row[2].upper() == 'INTEGER'
+                      and sum(1 for other in info if other[5]) == 1), None)
+    columns = [row[1] for row in info if row[1] != id_column]
+    references = ID_REFERENCES.get(table, {})
+    selected = ', '.join(
+        f"(SELECT new_id FROM temp.moved_ids WHERE table_name = '{references[column]}' AND old_id = {column})"
+        if column in references else column
+        for column in columns)
+    insert = f"INSERT INTO target.{table} ({', '.join(columns)}) SELECT {selected} FROM main.{table}"
+
+    referenced = {target for refs in ID_REFERENCES.values() for target in refs.values()}
+    if id_column and table in referenced:
+        # Row by row, to record each row's new id for the tables pointing at it
+        for (old_id,) in conn.execute(f"SELECT {id_column} FROM main.{table} WHERE user_id = ? ORDER BY {id_column}",
+                                      (user_id,)).fetchall():
+            new_id = conn.execute(f"{insert} WHERE {id_column} = ?", (old_id,)).lastrowid
+            conn.execute("INSERT INTO temp.moved_ids VALUES (?, ?, ?)", (table, old_id, new_id))
+    else:
+        order = f" ORDER BY {id_column}" if id_column else ''
+        conn.execute(f"{insert} WHERE user_id = ?{order}", (user_id,))
+    conn.execute(f"DELETE FROM main.{table} WHERE user_id = ?", (user_id,))
+
+
+# Helper function to move every row to the shard its user belongs to
+def rebalance(dry_run=False):
+    """
+    Move misplaced rows after HEALTH_DB_SHARDS changes or when sharding is
+    first enabled on a database that already holds per-user rows.
+
+    Sources are the central file and every shard file on disk (including
+    shards beyond the current count). Each user's rows move in a single
+    transaction, inserted into the target before being deleted from the
+    source, so an interrupted run can simply be restarted. Row ids are only
+    unique per file, so moved rows get new ids in the target and references
+    between them (ID_REFERENCES) are rewritten; rows are never replaced. A
+    row whose natural key (e.g. a health_data sample) already exists in the
+    target aborts that user's move with an error.
+    """
+    if not sharding_enabled():
+        print("Sharding is disabled (set HEALTH_DB_SHARDS to a positive number)")
+        return 0
+
+    sources = [('central', central_db_path)] + [(index, shard_path(index)) for index in existing_shard_indexes()]
+    for index in range(SHARD_COUNT):
+        connect_shard(index).close()
+
+    moved = 0
+    for source, path in sources:
+        conn = sqlite3.connect(path, isolation_level=None)
+        conn.execute('PRAGMA busy_timeout = 5000')
+        try:
+            tables = [table for table in SHARDED_TABLES
+                      if conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name = ?", (table,)).fetchone()]
+            counts = {}
+            for table in tables:
+                for user_id, count in conn.execute(f"SELECT user_id, COUNT(*) FROM {table} GROUP BY user_id").fetchall():
+                    if shard_for_user(user_id) != source:
+                        counts.setdefault(user_id, {})[table] = count
+
+            for user_id, user_counts in counts.items():
+                target = shard_for_user(user_id)
+                for table, count in user_counts.items():
+                    print(f"{'Would move' if dry_run else 'Moving'} {count} {table} rows of user {user_id}: {source} -> {target}")
+                moved += sum(user_counts.values())
+                if dry_run:
+                    continue
+
+                conn.execute("ATTACH DATABASE ? AS target", (shard_path(target),))
+                try:
+                    conn.execute("CREATE TEMP TABLE IF NOT EXISTS moved_ids (table_name TEXT, old_id INTEGER, new_id INTEGER, "
+                                 "PRIMARY KEY (table_name, old_id))")
+                    conn.execute("BEGIN IMMEDIATE")
+                    # SHARDED_TABLES lists referenced tables before the ones pointing at them
+                    for table in tables:
+                        if table in user_counts:
+                            _move_rows(conn, table, user_id)
+                    conn.execute("COMMIT")
+                except sqlite3.IntegrityError as e:
+                    conn.execute("ROLLBACK")
+                    raise RuntimeError(f"Rows of user {user_id} in {source} conflict with rows already in shard "
+                                       f"{target} ({str(e)}); nothing of this user was moved") from e
+                except Exception:
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                    raise
+                finally:
+                    conn.execute("DELETE FROM temp.moved_ids")
+                    conn.execute("DETACH DATABASE target")
+        finally:
+            conn.close()
+
+    print(f"{'Would move' if dry_run else 'Moved'} {moved} rows")
+    return moved
+
+
+def status():
+    for index in range(SHARD_COUNT):
+        conn = connect_shard(index)
+        try:
+            counts = {table: conn.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0] for table in SHARDED_TABLES}
+        finally:
+            conn.close()
+        print(f"shard {index:03d}: " + ', '.join(f"{table}={count}" for table, count in counts.items() if count))
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    if command == 'rebalance':
+        rebalance(dry_run='--dry-run' in sys.argv)
+    elif command == 'status':
+        status()
+    else:
+        print(f"Unknown command: {command}. Use 'rebalance' or 'status'.")
+        sys.exit(1)
@@ -0,0 +1,179 @@
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+from flask import request, send_from_directory
+from werkzeug.http import parse_accept_header
+
+from compression import is_compressible
+
+# Fingerprinted, precompressed static files
+#
+# The build step copies every file under static/ to static/dist/ with a
+# content hash in its name (script.js -> dist/script.1a2b3c4d.js), minifies
+# CSS and JavaScript on the way, and writes .gz (and, with the brotli package
+# installed, .br) siblings next to the text files. dist/manifest.json maps
+# each original name to its fingerprinted one.
+#
+# init_app() makes url_for('static', filename='script.js') point at the
+# fingerprinted file. A fingerprinted name never changes content, so it is
+# served with a one-year immutable Cache-Control, and the precompressed
+# sibling the client accepts is sent as is. Files missing from the manifest
+# (or every file, before the first build) are served as before.
+#
+# Minification uses rjsmin/rcssmin when installed; otherwise only comments,
+# indentation and blank lines are removed.
+#
+# Usage:
+#   python static_assets.py [--clean]   build static/dist (--clean: drop old builds first)
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+
+HASH_LENGTH = 8
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Precompressed sibling suffix per Content-Encoding, in order of preference
+PRECOMPRESSED = [('br', '.br'), ('gzip', '.gz')]
+
+
+def minify_js(source):
+    try:
+        import rjsmin
+        return rjsmin.jsmin(source)
+    except ImportError:
+        pass
+    lines = (line.strip() for line in source.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//')) + '\n'
+
+
+def minify_css(source):
+    try:
+        import rcssmin
+        return rcssmin.cssmin(source)
+    except ImportError:
+        pass
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    source = re.sub(r'\s+', ' ', source)
+    return re.sub(r'\s*([{};,>])\s*', r'\1', source).strip() + '\n'
+
+
+_MINIFIERS = {'.js': minify_js, '.css': minify_css}
+
+
+def fingerprinted_name(name, content):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{ext}"
+
+
+def write_precompressed(path, content):
+    """Write .gz (and .br) siblings of `path` when they are smaller than `content`"""
+    variants = [('.gz', gzip.compress(content, compresslevel=9, mtime=0))]
+    try:
+        import brotli
+        variants.append(('.br', brotli.compress(content, quality=11)))
+    except ImportError:
+        pass
+    for suffix, data in variants:
+        if len(data) < len(content):
+            with open(path + suffix, 'wb') as f:
+                f.write(data)
+
+
+# Helper function to build static/dist and its manifest
+def build(static_dir=STATIC_DIR, clean=False):
+    """
+    Fingerprint, minify and precompress every file under `static_dir`.
+    Builds from earlier runs are kept (pages cached by clients may still
+    reference them) unless `clean` is set. Returns the manifest.
+    """
+    dist_dir = os.path.join(static_dir, DIST_DIR)
+    if clean and os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        if os.path.abspath(root) == os.path.abspath(static_dir) and DIST_DIR in dirs:
+            dirs.remove(DIST_DIR)
+        for file_name in sorted(files):
+            source_path = os.path.join(root, file_name)
+            name = os.path.relpath(source_path, static_dir).replace(os.sep, '/')
+            with open(source_path, 'rb') as f:
+                content = f.read()
+
+            minify = _MINIFIERS.get(os.path.splitext(name)[1].lower())
+            if minify:
+                content = minify(content.decode('utf-8')).encode('utf-8')
+
+            target = f"{DIST_DIR}/{fingerprinted_name(name, content)}"
+            target_path = os.path.join(static_dir, *target.split('/'))
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            with open(target_path, 'wb') as f:
+                f.write(content)
+            if is_compressible(mimetypes.guess_type(name)[0]):
+                write_precompressed(target_path, content)
+            manifest[name] = target
+
+    with open(os.path.join(dist_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_dir):
+    try:
+        with open(os.path.join(static_dir, DIST_DIR, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def init_app(app):
+    """Point url_for('static') at fingerprinted files and serve them with long-lived caching"""
+    manifest = load_manifest(app.static_folder)
+    if not manifest:
+        print("No static build found; serving static files unversioned (run python static_assets.py)")
+        return
+    fingerprinted = set(manifest.values())
+    serve_default = app.view_functions['static']
+
+    @app.url_defaults
+    def fingerprint_static_url(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = manifest[values['filename']]
+
+    def static(filename):
+        if filename not in fingerprinted:
+            return serve_default(filename=filename)
+
+        accepted = parse_accept_header(request.headers.get('Accept-Encoding'))
+        path, encoding = filename, None
+        for candidate, suffix in PRECOMPRESSED:
+            if accepted.quality(candidate) > 0 and os.path.exists(os.path.join(app.static_folder, filename + suffix)):
+                path, encoding = filename + suffix, candidate
+                break
+
+        response = send_from_directory(app.static_folder, path, mimetype=mimetypes.guess_type(filename)[0],
+                                       max_age=IMMUTABLE_MAX_AGE)
+        response.cache_control.immutable = True
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if is_compressible(response.mimetype):
+            response.vary.add('Accept-Encoding')
+        return response
+
+    app.view_functions['static'] = static
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build fingerprinted, precompressed static files")
+    parser.add_argument('--clean', action='store_true', help="remove earlier builds first")
+    args = parser.parse_args()
+
+    manifest = build(clean=args.clean)
+    print(f"Built {len(manifest)} static files into {os.path.join(STATIC_DIR, DIST_DIR)}")
@@ -0,0 +1,211 @@
+import json
+import sqlite3
+import heapq
+import threading
+from collections import OrderedDict
+
+import archiver
+from db_utils import blood_pressure_from_row, ms_to_iso
+
+# Per-user timeline across the health tables
+#
+# Every source is read with an index range scan on (user_id, <ts>_ms) and the
+# already-ordered per-source results are k-way merged by timestamp, newest
+# first. Sources whose table the archiver moves old rows out of also read
+# the archive (same order, same cursor bound) once anything is archived. Pages continue from an opaque cursor "<ts>:<source>:<id>", so any
+# page costs the same regardless of how far back it is.
+#
+# Results that only depend on a user's data (per-source sections and the
+# summary) are cached in-process and validated against user_data_versions,
+# which triggers bump on every write to the user's rows (migration 10).
+
+# source -> (table, epoch-ms column, selected columns)
+TIMELINE_SOURCES = OrderedDict([
+    ('health', ('health_monitoring', 'created_at_ms',
+                'id, heart_rate, blood_pressure, bp_systolic, bp_diastolic, oxygen_level, '
+                'body_temperature, glucose_level, created_at')),
+    ('prediction', ('disease_predictions', 'predicted_at_ms',
+                    'id, symptoms, predicted_disease, confidence_score, predicted_at')),
+    ('bmi', ('bmi_history', 'recorded_at_ms',
+             'id, height, weight, bmi, bmi_category, recorded_at, notes')),
+    ('activity', ('activity_tracking', 'created_at_ms',
+                  'id, activity_type, duration, steps, calories_burned, activity_date, notes, created_at')),
+    ('record', ('medical_records', 'uploaded_at_ms',
+                'id, record_name, record_type, file_path, record_date, notes, uploaded_at')),
+    ('prescription', ('medical_prescriptions', 'created_at_ms',
+                      'id, doctor_name, specialization, patient_name, patient_age, patient_gender, '
+                      'allergies, diagnosis, medications, instructions, follow_up, created_at')),
+])
+
+_SOURCE_RANK = {source: rank for rank, source in enumerate(TIMELINE_SOURCES)}
+
+CACHE_SIZE = 1024
+
+_MAX_ID = 2 ** 62
+
+
+def _decode(source, item):
+    # Per-row decoding only happens for rows that end up on the page
+    if source == 'health':
+        blood_pressure_from_row(item)
+    elif source == 'prediction' and item.get('symptoms'):
+        try:
+            item['symptoms'] = json.loads(item['symptoms'])
+        except (TypeError, ValueError):
+            item['symptoms'] = []
+    return item
+
+
+def parse_cursor(cursor):
+    """Decode "<ts>:<source>:<id>"; None for a missing or malformed cursor"""
+    try:
+        ts, source, row_id = cursor.split(':')
+        if source not in _SOURCE_RANK:
+            return None
+        return int(ts), source, int(row_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _source_rows(conn, user_id, source, limit, after=None):
+    """One source's rows, newest first, strictly after the cursor in timeline order"""
+    table, ts_column, columns = TIMELINE_SOURCES[source]
+    sql = f'''
+        SELECT {columns}, {ts_column} AS ts FROM {table}
+        WHERE user_id = ? AND {ts_column} IS NOT NULL
+    '''
+    params = [user_id]
+
+    if after is not None:
+        # Timeline order is (ts, source rank, id) descending; translate the
+        # cursor into a (ts, id) bound for this source
+        cursor_ts, cursor_source, cursor_id = after
+        rank, cursor_rank = _SOURCE_RANK[source], _SOURCE_RANK[cursor_source]
+        bound_id = cursor_id if rank == cursor_rank else (_MAX_ID if rank < cursor_rank else -1)
+        sql += f" AND ({ts_column}, id) < (?, ?)"
+        params += [cursor_ts, bound_id]
+
+    sql += f" ORDER BY {ts_column} DESC, id DESC LIMIT ?"
+    params.append(limit)
+    rows = [row for row in conn.execute(sql, params).fetchall() if row is not None]
+
+    if table in archiver.ARCHIVED_TABLES:
+        names = [name.strip() for name in columns.split(',')] + ['ts']
+        before = tuple(params[1:3]) if after is not None else None
+        archived = [{name: item.get(name) for name in names}
+                    for item in archiver.read_archived_rows(conn, table, user_id, limit, before)]
+        if archived:
+            rows = sorted(rows + archived, key=lambda row: (row['ts'], row['id']), reverse=True)[:limit]
+
+    for row in rows:
+        yield (row['ts'], _SOURCE_RANK[source], row['id'], source, row)
+
+
+# Helper function to read one page of the merged timeline
+def get_timeline(conn, user_id, limit=50, cursor=None, sources=None):
+    """
+    Return one page of a user's timeline, newest first
+
+    Args:
+        cursor: next_cursor from the previous page (None for the first page)
+        sources: subset of TIMELINE_SOURCES keys (default: all)
+
+    Returns a dict with 'items' (each with type, id, ts, time and data) and
+    'next_cursor' (None on the last page).
+    """
+    after = parse_cursor(cursor)
+    streams = [_source_rows(conn, user_id, source, limit + 1, after)
+               for source in (sources or TIMELINE_SOURCES)]
+    merged = heapq.merge(*streams, reverse=True)
+
+    items = []
+    next_cursor = None
+    for ts, _, row_id, source, row in merged:
+        if len(items) == limit:
+            last = items[-1]
+            next_cursor = f"{last['ts']}:{last['type']}:{last['id']}"
+            break
+        data = _decode(source, dict(row))
+        data.pop('ts', None)
+        items.append({'type': source, 'id': row_id, 'ts': ts, 'time': ms_to_iso(ts), 'data': data})
+
+    return {'items': items, 'next_cursor': next_cursor}
+
+
+def data_versions(conn, user_id):
+    """The user's (table, version) pairs; changes whenever any of their rows do"""
+    try:
+        rows = conn.execute('''
+            SELECT table_name, version FROM user_data_versions WHERE user_id = ?
+        ''', (user_id,)).fetchall()
+    except sqlite3.OperationalError:
+        return None
+    return tuple(sorted((row[0], row[1]) for row in rows))
+
+
+class VersionedCache:
+    """LRU cache whose entries are only valid for the data versions they were built from"""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key, versions, build):
+        if versions is not None:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None and entry[0] == versions:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                self.misses += 1
+
+        value = build()
+        if versions is not None:
+            with self.lock:
+                self.entries[key] = (versions, value)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+        return value
+
+
+_cache = VersionedCache()
+
+
+def get_sections(conn, user_id, per_source=10):
+    """Latest `per_source` rows of every source as {source: [row dicts]}, cached"""
+    def build():
+        return {source: [_decode(source, dict(row)) for _, _, _, _, row
+                         in _source_rows(conn, user_id, source, per_source)]
+                for source in TIMELINE_SOURCES}
+
+    return _cache.get_or_build(('sections', conn_key(conn), user_id, per_source),
+                               data_versions(conn, user_id), build)
+
+
+def get_summary(conn, user_id):
+    """Row count and latest timestamp per source, cached"""
+    def build():
+        summary = {}
+        for source, (table, ts_column, _) in TIMELINE_SOURCES.items():
+            count, latest = conn.execute(f'''
+                SELECT COUNT(*), MAX({ts_column}) FROM {table} WHERE user_id = ?
+            ''', (user_id,)).fetchone()
+            if table in archiver.ARCHIVED_TABLES:
+                archived_count, archived_latest = archiver.archived_summary(conn, table, user_id)
+                count += archived_count
+                latest = max((ts for ts in (latest, archived_latest) if ts is not None), default=None)
+            summary[source] = {'count': count, 'latest': ms_to_iso(latest)}
+        return summary
+
+    return _cache.get_or_build(('summary', conn_key(conn), user_id),
+                               data_versions(conn, user_id), build)
+
+
+def conn_key(conn):
+    # Versions are per database file (each shard keeps its own)
+    return conn.execute("PRAGMA database_list").fetchone()[2]
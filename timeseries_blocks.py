@@ -0,0 +1,221 @@
+import struct
+import zlib
+import numpy as np
+
+# Compressed block storage for high-frequency wearable samples
+#
+# Samples are grouped per user, per metric and per UTC hour into a single
+# metric_blocks row. Inside a block, timestamps are stored as delta-of-delta
+# and values as deltas, zigzag-encoded into the narrowest unsigned integer
+# type that fits and then zlib-compressed. A steady 1 Hz stream has all-zero
+# timestamp deltas-of-deltas and small value deltas, which compress to a
+# few bytes per minute of data.
+#
+# Values are stored as fixed-point integers: each block records how many
+# decimal places its values need (0 for heart rate, 1 for a temperature of
+# 36.6, ...), up to MAX_VALUE_DECIMALS; digits beyond that are rounded off.
+# Blocks of integer metrics decode to int64 arrays, others to float64.
+#
+# Usage:
+#   append_samples(conn, user_id, metric_id, timestamps, values)
+#   timestamps, values = read_range(conn, user_id, metric_id, start_ms, end_ms)
+
+BLOCK_MS = 60 * 60 * 1000  # one block per hour
+
+MAX_VALUE_DECIMALS = 3
+
+# Version 1 blocks (integer values only) have no decimals field
+FORMAT_VERSION = 2
+
+# version, sample count, first ts, first ts delta, first value, ts width, value width
+_HEADER_V1 = struct.Struct('<BIqqqBB')
+# ... followed by the number of decimal places of the values
+_HEADER = struct.Struct('<BIqqqBBB')
+
+_WIDTHS = {1: np.uint8, 2: np.uint16, 4: np.uint32, 8: np.uint64}
+
+
+def _zigzag(values):
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def _unzigzag(values):
+    values = values.astype(np.uint64)
+    return ((values >> np.uint64(1)).astype(np.int64)) ^ -((values & np.uint64(1)).astype(np.int64))
+
+
+def _pack(values):
+    encoded = _zigzag(values)
+    largest = int(encoded.max()) if len(encoded) else 0
+    for width in (1, 2, 4, 8):
+        if largest < (1 << (8 * width)):
+            return width, encoded.astype(_WIDTHS[width]).tobytes()
+
+
+def _unpack(buffer, width, count):
+    return _unzigzag(np.frombuffer(buffer, dtype=_WIDTHS[width], count=count))
+
+
+def value_decimals(values):
+    """Fewest decimal places (at most MAX_VALUE_DECIMALS) that represent `values` exactly"""
+    values = np.asarray(values, dtype=np.float64)
+    for decimals in range(MAX_VALUE_DECIMALS):
+        scaled = values * 10 ** decimals
+        if np.all(np.abs(scaled - np.rint(scaled)) < 1e-6):
+            return decimals
+    return MAX_VALUE_DECIMALS
+
+
+def encode_block(timestamps, values):
+    """
+    Encode sorted timestamps (epoch ms) and their values into a block payload
+
+    Args:
+        timestamps: 1-D array-like of int64, strictly increasing
+        values: 1-D array-like of the same length; rounded to MAX_VALUE_DECIMALS places
+    """
+    ts = np.asarray(timestamps, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    if not np.all(np.isfinite(values)):
+        raise ValueError("Sample values must be finite numbers")
+    decimals = value_decimals(values)
+    vals = np.rint(values * 10 ** decimals).astype(np.int64)
+    count = len(ts)
+    if count == 0:
+        raise ValueError("Cannot encode an empty block")
+
+    first_delta = int(ts[1] - ts[0]) if count > 1 else 0
+    ts_width, ts_bytes = _pack(np.diff(ts, n=2) if count > 2 else np.zeros(0, dtype=np.int64))
+    val_width, val_bytes = _pack(np.diff(vals))
+
+    header = _HEADER.pack(FORMAT_VERSION, count, int(ts[0]), first_delta, int(vals[0]), ts_width, val_width,
+                          decimals)
+    return header + zlib.compress(ts_bytes + val_bytes, 6)
+
+
+def decode_block(payload):
+    """
+    Decode a block payload back into (timestamps, values) arrays; values are
+    int64 for blocks of whole numbers and float64 otherwise
+    """
+    version = payload[0]
+    if version == 1:
+        header = _HEADER_V1
+        _, count, first_ts, first_delta, first_value, ts_width, val_width = header.unpack_from(payload)
+        decimals = 0
+    elif version == FORMAT_VERSION:
+        header = _HEADER
+        _, count, first_ts, first_delta, first_value, ts_width, val_width, decimals = header.unpack_from(payload)
+    else:
+        raise ValueError(f"Unsupported block format version {version}")
+
+    body = zlib.decompress(payload[header.size:])
+    dod_count = max(count - 2, 0)
+    dod = _unpack(body, ts_width, dod_count)
+    value_deltas = _unpack(body[dod_count * ts_width:], val_width, count - 1)
+
+    deltas = np.empty(max(count - 1, 0), dtype=np.int64)
+    if count > 1:
+        deltas[0] = first_delta
+        deltas[1:] = first_delta + np.cumsum(dod)
+    ts = np.empty(count, dtype=np.int64)
+    ts[0] = first_ts
+    ts[1:] = first_ts + np.cumsum(deltas)
+
+    vals = np.empty(count, dtype=np.int64)
+    vals[0] = first_value
+    vals[1:] = first_value + np.cumsum(value_deltas)
+    if decimals:
+        return ts, np.round(vals / 10 ** decimals, decimals)
+    return ts, vals
+
+
+def _merge(old_ts, old_vals, new_ts, new_vals):
+    # Later samples win when the same timestamp is written twice
+    ts = np.concatenate([old_ts, new_ts])
+    vals = np.concatenate([old_vals, new_vals])
+    order = np.argsort(ts, kind='stable')
+    ts, vals = ts[order], vals[order]
+    keep = np.ones(len(ts), dtype=bool)
+    keep[:-1] = ts[1:] != ts[:-1]
+    return ts[keep], vals[keep]
+
+
+def append_samples(conn, user_id, metric_id, timestamps, values):
+    """
+    Write samples into their hourly blocks, merging with blocks already stored
+
+    Only the blocks covered by the new samples are read and rewritten. The
+    read-merge-write runs in a write transaction (BEGIN IMMEDIATE unless the
+    caller already opened one), so concurrent appends to the same block
+    cannot drop each other's samples. Returns the number of blocks written.
+    The caller commits.
+    """
+    ts = np.asarray(timestamps, dtype=np.int64)
+    vals = np.asarray(values, dtype=np.float64)
+    if len(ts) != len(vals):
+        raise ValueError("timestamps and values must have the same length")
+    if len(ts) == 0:
+        return 0
+
+    order = np.argsort(ts, kind='stable')
+    ts, vals = ts[order], vals[order]
+    block_starts = (ts // BLOCK_MS) * BLOCK_MS
+    boundaries = np.flatnonzero(np.diff(block_starts)) + 1
+    starts = np.concatenate([[0], boundaries])
+    ends = np.concatenate([boundaries, [len(ts)]])
+
+    if not conn.in_transaction:
+        # Take the write lock before reading the blocks that get rewritten
+        conn.execute('BEGIN IMMEDIATE')
+
+    rows = []
+    for start, end in zip(starts, ends):
+        block_start = int(block_starts[start])
+        block_ts, block_vals = _merge(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64),
+                                      ts[start:end], vals[start:end])
+
+        existing = conn.execute('''
+            SELECT payload FROM metric_blocks
+            WHERE user_id = ? AND metric_id = ? AND block_start = ?
+        ''', (user_id, metric_id, block_start)).fetchone()
+        if existing is not None:
+            old_ts, old_vals = decode_block(existing[0])
+            block_ts, block_vals = _merge(old_ts, old_vals, block_ts, block_vals)
+
+        rows.append((user_id, metric_id, block_start, int(block_ts[0]), int(block_ts[-1]),
+                     len(block_ts), encode_block(block_ts, block_vals)))
+
+    conn.executemany('''
+        INSERT OR REPLACE INTO metric_blocks
+        (user_id, metric_id, block_start, first_ts, last_ts, sample_count, payload)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    return len(rows)
+
+
+def read_range(conn, user_id, metric_id, start_ms, end_ms):
+    """
+    Return (timestamps, values) for samples with start_ms <= ts <= end_ms
+
+    Only blocks overlapping the window are fetched and decoded; the
+    block_start range lets SQLite answer this from the primary key index.
+    """
+    rows = conn.execute('''
+        SELECT payload FROM metric_blocks
+        WHERE user_id = ? AND metric_id = ? AND block_start BETWEEN ? AND ?
+          AND last_ts >= ?
+        ORDER BY block_start
+    ''', (user_id, metric_id, (start_ms // BLOCK_MS) * BLOCK_MS, end_ms, start_ms)).fetchall()
+
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    ts_parts, val_parts = [], []
+    for (payload,) in rows:
+        ts, vals = decode_block(payload)
+        mask = (ts >= start_ms) & (ts <= end_ms)
+        ts_parts.append(ts[mask])
+        val_parts.append(vals[mask])
+    return np.concatenate(ts_parts), np.concatenate(val_parts)
@@ -0,0 +1,352 @@
+import argparse
+import atexit
+import os
+import queue
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import sharding
+
+# Group-commit write queue
+#
+# Request handlers no longer commit on their own thread. They hand a small
+# write function to submit() (or write(), which waits for it) and get back a
+# Future. Each database (central, or one per shard) has a single writer
+# thread that takes every write queued up while it was committing the last
+# batch (at most WRITE_QUEUE_BATCH_SIZE) and runs them in one BEGIN IMMEDIATE
+# ... COMMIT. N concurrent requests then cost one lock acquisition and one
+# fsync instead of N, and request threads of the same process never wait on
+# each other through busy_timeout. On disks where fsync is slow,
+# WRITE_QUEUE_FLUSH_MS makes the writer wait that much longer for a batch to
+# fill, trading latency for fewer commits.
+#
+# Each write runs inside its own SAVEPOINT, so one that fails (a UNIQUE
+# violation, say) is rolled back on its own and only its Future gets the
+# exception. Futures are resolved only after the COMMIT succeeded: a write
+# that was acknowledged is on disk, and one lost to a crash was never
+# acknowledged. The queue is bounded; when it stays full for
+# WRITE_QUEUE_SUBMIT_TIMEOUT seconds, submit() raises WriteQueueFull, which
+# the routes answer with 503 so clients back off. write() likewise gives up
+# on a write the writer has not started within WRITE_QUEUE_WRITE_TIMEOUT
+# seconds: it is cancelled, so it never runs, and WriteQueueTimeout (a
+# WriteQueueFull) is raised. On interpreter exit (e.g.
+# a worker's SIGTERM) the writers finish and commit what is already queued
+# before the process goes.
+#
+# A write function gets the writer's connection (rows as sqlite3.Row; shard
+# connections have the central database attached as `central`), must not
+# commit or roll back itself, and returns what the caller needs, such as
+# cursor.lastrowid.
+#
+# Usage:
+#   python write_queue.py --benchmark [--threads 32] [--seconds 5]
+#       inserts per second: one commit per request vs. the write queue
+
+WRITE_QUEUE_FLUSH_MS = float(os.environ.get('WRITE_QUEUE_FLUSH_MS', '0'))
+WRITE_QUEUE_BATCH_SIZE = int(os.environ.get('WRITE_QUEUE_BATCH_SIZE', '256'))
+WRITE_QUEUE_SIZE = int(os.environ.get('WRITE_QUEUE_SIZE', '2000'))
+WRITE_QUEUE_SUBMIT_TIMEOUT = float(os.environ.get('WRITE_QUEUE_SUBMIT_TIMEOUT', '2'))
+WRITE_QUEUE_WRITE_TIMEOUT = float(os.environ.get('WRITE_QUEUE_WRITE_TIMEOUT', '10'))
+WRITE_QUEUE_SHUTDOWN_SECONDS = 10
+
+_STOP = object()
+
+
+class WriteQueueFull(Exception):
+    """The writer is behind by WRITE_QUEUE_SIZE writes; the caller should shed the request"""
+
+
+class WriteQueueTimeout(WriteQueueFull):
+    """A queued write was not started in time and has been cancelled; it is safe to retry"""
+
+
+class WriteQueueClosed(Exception):
+    """The process is shutting down and no longer accepts writes"""
+
+
+class Writer:
+    """One database's queue and the thread that group-commits it"""
+
+    def __init__(self, connect, name, flush_ms=WRITE_QUEUE_FLUSH_MS, batch_size=WRITE_QUEUE_BATCH_SIZE,
+                 queue_size=WRITE_QUEUE_SIZE):
+        self.connect = connect
+        self.name = name
+        self.flush_seconds = flush_ms / 1000
+        self.batch_size = batch_size
+        self.queue = queue.Queue(queue_size)
+        self.closed = False
+        self.batches = 0
+        self.writes = 0
+        self.failed = 0
+        self.thread = threading.Thread(target=self._run, name=f'db-writer-{name}', daemon=True)
+        self.thread.start()
+
+    def submit(self, fn, timeout=WRITE_QUEUE_SUBMIT_TIMEOUT):
+        if self.closed:
+            raise WriteQueueClosed(f"Writer {self.name} is closed")
+        future = Future()
+        try:
+            self.queue.put((fn, future), timeout=timeout)
+        except queue.Full:
+            raise WriteQueueFull(f"Write queue for {self.name} is full ({self.queue.maxsize} pending)")
+        return future
+
+    def close(self, timeout=WRITE_QUEUE_SHUTDOWN_SECONDS):
+        """Stop accepting writes, commit the ones already queued and wait for the thread"""
+        if not self.closed:
+            self.closed = True
+            self.queue.put(_STOP)
+        self.thread.join(timeout)
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _commit(self, conn, batch):
+        outcomes = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for fn, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute('SAVEPOINT queued_write')
+                try:
+                    outcomes.append((future, fn(conn), None))
+                except Exception as e:
+                    conn.execute('ROLLBACK TO queued_write')
+                    outcomes.append((future, None, e))
+                conn.execute('RELEASE queued_write')
+            conn.execute('COMMIT')
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.rollback()
+            print(f"Write queue {self.name}: batch of {len(batch)} failed: {str(e)}")
+            self.failed += len(batch)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        for future, result, error in outcomes:
+            if error is None:
+                self.writes += 1
+                future.set_result(result)
+            else:
+                self.failed += 1
+                future.set_exception(error)
+
+    def _run(self):
+        try:
+            conn = self.connect()
+        except Exception as e:
+            # Fail what was queued; the next submit() starts a new writer
+            print(f"Write queue {self.name}: could not open the database: {str(e)}")
+            self.closed = True
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    return
+                if item is not _STOP and item[1].set_running_or_notify_cancel():
+                    item[1].set_exception(e)
+        # Transactions are opened explicitly per batch
+        conn.isolation_level = None
+        try:
+            stopping = False
+            while not stopping:
+                item = self.queue.get()
+                if item is _STOP:
+                    break
+                batch, stopping = self._collect(item)
+                self._commit(conn, batch)
+
+            # Writes that raced with close() still get committed
+            leftover = []
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _STOP:
+                    leftover.append(item)
+            for start in range(0, len(leftover), self.batch_size):
+                self._commit(conn, leftover[start:start + self.batch_size])
+        finally:
+            conn.close()
+
+    def stats(self):
+        return {'pending': self.queue.qsize(), 'batches': self.batches, 'writes': self.writes,
+                'failed': self.failed, 'avg_batch': round(self.writes / self.batches, 1) if self.batches else 0}
+
+
+def _connect_central():
+    conn = sqlite3.connect(sharding.central_db_path)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.execute('PRAGMA busy_timeout = 5000')
+    return conn
+
+
+# Writer threads do not survive fork(), so each process starts its own lazily
+_writers = {}
+_writers_pid = None
+_writers_lock = threading.Lock()
+_shutting_down = False
+
+
+def _writer_for(user_id):
+    global _writers, _writers_pid
+    if _shutting_down:
+        raise WriteQueueClosed("The write queue is shut down")
+    shard = sharding.shard_for_user(user_id) if user_id is not None and sharding.sharding_enabled() else None
+    if _writers_pid == os.getpid():
+        writer = _writers.get(shard)
+        if writer is not None and not writer.closed:
+            return writer
+
+    with _writers_lock:
+        if _writers_pid != os.getpid():
+            _writers, _writers_pid = {}, os.getpid()
+        writer = _writers.get(shard)
+        if writer is None or writer.closed:
+            if shard is None:
+                writer = Writer(_connect_central, 'central')
+            else:
+                writer = Writer(lambda: sharding.connect_shard(shard), f'shard-{shard}')
+            _writers[shard] = writer
+        return writer
+
+
+def submit(fn, user_id=None, timeout=WRITE_QUEUE_SUBMIT_TIMEOUT):
+    """
+    Queue fn(conn) for the database holding `user_id`'s rows (the central
+    database for None) and return a Future of its result. Raises
+    WriteQueueFull when the queue stays full for `timeout` seconds (pass 0
+    from an event loop, which must not block).
+    """
+    return _writer_for(user_id).submit(fn, timeout)
+
+
+def write(fn, user_id=None, timeout=WRITE_QUEUE_WRITE_TIMEOUT):
+    """
+    submit() and wait until the write is committed; returns fn's result or
+    raises its exception. Raises WriteQueueTimeout when the writer has not
+    started the write within `timeout` seconds; a write already running is
+    waited for, since it can no longer be withdrawn.
+    """
+    future = submit(fn, user_id)
+    try:
+        return future.result(timeout)
+    except FutureTimeout:
+        if future.cancel():
+            raise WriteQueueTimeout(f"Write not started within {timeout} seconds")
+        return future.result()
+
+
+def shutdown(timeout=WRITE_QUEUE_SHUTDOWN_SECONDS):
+    """Commit whatever is queued and stop this process's writers"""
+    global _shutting_down
+    _shutting_down = True
+    if _writers_pid != os.getpid():
+        return
+    for writer in list(_writers.values()):
+        writer.close(timeout)
+
+
+atexit.register(shutdown)
+
+
+def stats():
+    if _writers_pid != os.getpid():
+        return {}
+    return {writer.name: writer.stats() for writer in list(_writers.values())}
+
+
+def benchmark(threads, seconds):
+    """Concurrent single-row inserts: a commit per request vs. group commits through a Writer"""
+    directory = tempfile.mkdtemp(prefix='write_queue_')
+    path = os.path.join(directory, 'bench.db')
+    setup = sqlite3.connect(path)
+    setup.execute('PRAGMA journal_mode = WAL')
+    setup.execute('CREATE TABLE readings (id INTEGER PRIMARY KEY, user_id INTEGER, value REAL, ts INTEGER)')
+    setup.close()
+
+    def connect():
+        conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA busy_timeout = 5000')
+        return conn
+
+    def insert(conn, i):
+        return conn.execute("INSERT INTO readings (user_id, value, ts) VALUES (?, ?, ?)",
+                            (i % 100, 72.0, int(time.time() * 1000))).lastrowid
+
+    def run(request):
+        counts = [0] * threads
+        latencies = []
+        deadline = time.perf_counter() + seconds
+
+        def worker(n):
+            state = {}
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                request(state, n)
+                latencies.append(time.perf_counter() - started)
+                counts[n] += 1
+            if 'conn' in state:
+                state['conn'].close()
+
+        with ThreadPoolExecutor(threads) as executor:
+            list(executor.map(worker, range(threads)))
+        latencies.sort()
+        return sum(counts), latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+    def direct(state, n):
+        conn = state.get('conn') or state.setdefault('conn', connect())
+        insert(conn, n)
+        conn.commit()
+
+    writer = Writer(connect, 'benchmark')
+
+    def queued(state, n):
+        writer.submit(lambda conn: insert(conn, n)).result()
+
+    print(f"{threads} threads inserting for {seconds}s each into {path}")
+    results = {}
+    for label, request in (('commit per request', direct), ('write queue', queued)):
+        total, p50, p99 = run(request)
+        results[label] = total / seconds
+        print(f"  {label:<20} {total / seconds:>10,.0f} writes/s   p50 {p50 * 1000:6.2f} ms   p99 {p99 * 1000:7.2f} ms")
+    writer.close()
+    print(f"  writer: {writer.stats()}")
+    print(f"  speedup: {results['write queue'] / results['commit per request']:.1f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Group-commit write queue')
+    parser.add_argument('--benchmark', action='store_true')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--seconds', type=int, default=5)
+    args = parser.parse_args(argv)
+    if args.benchmark:
+        benchmark(args.threads, args.seconds)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,14 @@
+from app import create_app
+
+# Production entry point
+#
+# The WSGI server imports this module once in its master process (gunicorn's
+# preload_app, see gunicorn.conf.py): migrations run and the model registry
+# and static manifest are loaded there, then workers are forked and share
+# them copy-on-write. Background jobs are started per worker by the server
+# config, which makes sure only one worker actually runs them.
+#
+# Usage:
+#   gunicorn -c gunicorn.conf.py wsgi:app
+
+app = create_app(background_jobs=False)